@@ -0,0 +1,68 @@
+# bench_bloom
+# 🌸 未登録判定のベンチ（ブルームフィルタの問い合わせ時間・実測偽陽性率・サイズ、スナップショットの保存／読み込み時間）
+#   python bench/bench_bloom.py [--rows 1000,10000,100000] [--fp 0.01] [--queries 100000]
+
+import os, sys, time, argparse, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_bloom import BloomFilter
+from shelf_snapshot import SheetSnapshot, BLOOM_HEADROOM
+from fakes import ean13, sample_rows
+
+# 未登録の問い合わせ1回あたりの上限（マイクロ秒）
+MAX_QUERY_US = 20.0
+
+
+def per_call_us(fn, keys):
+    t0 = time.perf_counter()
+    for k in keys:
+        fn(k)
+    return (time.perf_counter() - t0) / len(keys) * 1e6
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="1000,10000,100000")
+    ap.add_argument("--fp", type=float, default=0.01, help="目標偽陽性率")
+    ap.add_argument("--queries", type=int, default=100000)
+    args = ap.parse_args()
+
+    ok = True
+    print(f"{'rows':>8}{'bloom KB':>10}{'k':>4}{'miss us':>9}{'hit us':>8}{'fp':>9}{'target':>8}"
+          f"{'save ms':>9}{'load ms':>9}")
+    for n in (int(r) for r in args.rows.split(",")):
+        data = sample_rows(n)
+        codes = [row[0] for row in data[1:]]
+        # シートに無いコード（シードをずらして作る）
+        misses = [ean13(10**9 + i) for i in range(args.queries)]
+
+        with tempfile.TemporaryDirectory() as root:
+            snap = SheetSnapshot("bench", root=root)
+            t0 = time.perf_counter()
+            snap.replace(data[0], data[1:])
+            snap.flush()
+            save_ms = (time.perf_counter() - t0) * 1000
+            t0 = time.perf_counter()
+            loaded = SheetSnapshot("bench", root=root)
+            loaded.load()
+            load_ms = (time.perf_counter() - t0) * 1000
+
+        bloom = loaded.bloom
+        miss_us = per_call_us(loaded.absent, misses)
+        hit_us = per_call_us(loaded.absent, codes[:args.queries])
+        false_negatives = sum(loaded.absent(c) for c in codes)
+        fp = sum(not loaded.absent(c) for c in misses) / len(misses)
+        # スナップショットは追記の余裕を見て行数×BLOOM_HEADROOMで作るので、満杯時の目標と比べる
+        full = BloomFilter.of(codes, capacity=n, fp_rate=args.fp)
+        full_fp = sum(c in full for c in misses) / len(misses)
+        print(f"{n:>8}{bloom.nbytes() / 1024:>10.1f}{bloom.hashes:>4}{miss_us:>9.2f}{hit_us:>8.2f}"
+              f"{fp:>9.4%}{args.fp:>8.2%}{save_ms:>9.0f}{load_ms:>9.0f}")
+        print(f"{'':>8}  (filled to capacity: {full.nbytes() / 1024:.1f}KB, fp {full_fp:.4%}; "
+              f"snapshot headroom x{BLOOM_HEADROOM})")
+        ok &= false_negatives == 0 and miss_us < MAX_QUERY_US and full_fp < args.fp * 1.5
+        if false_negatives:
+            print(f"  ! {false_negatives} 件の偽陰性")
+    print("PASS" if ok else f"FAIL: 偽陰性・偽陽性率（目標×1.5超）・問い合わせ {MAX_QUERY_US}us 超のいずれか")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# bench_complete
+# 🔡 コード補完のベンチ（ソート済み索引で前方一致・1桁ワイルドカード・1桁抜けをp50/p99で測る）
+#   python bench/bench_complete.py [--codes 100000] [--queries 2000]
+
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_codeindex import CodeIndex
+from shelf_codes import canonical_code
+from fakes import ean13
+
+# 入力1文字ごとに呼ぶので、p99 がこれ以下なら PASS
+MAX_P99_MS = 1.0
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+def timed(fn, queries):
+    samples, found = [], 0
+    for q in queries:
+        t0 = time.perf_counter()
+        found += bool(fn(q))
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples, found
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--codes", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+
+    codes = [canonical_code(ean13(rng.randrange(10**10))) for _ in range(args.codes)]
+    t0 = time.perf_counter()
+    index = CodeIndex(codes)
+    build_ms = (time.perf_counter() - t0) * 1000
+    picks = [rng.choice(codes) for _ in range(args.queries)]
+
+    def drop(code):
+        i = rng.randrange(len(code))
+        return code[:i] + code[i + 1:]
+
+    def blank(code, n):
+        out = list(code)
+        for i in rng.sample(range(len(code)), n):
+            out[i] = "?"
+        return "".join(out)
+
+    cases = [
+        ("prefix 4", [c[:4] for c in picks]),
+        ("prefix 8", [c[:8] for c in picks]),
+        ("prefix 12", [c[:12] for c in picks]),
+        ("wildcard ?x1", [blank(c, 1) for c in picks]),
+        ("wildcard ?x2", [blank(c, 2) for c in picks]),
+        ("missing 1 digit", [drop(c) for c in picks]),
+        ("unknown 13", [ean13(10**11 + i) for i in range(args.queries)]),
+    ]
+    print(f"{len(index)} codes, build {build_ms:.0f}ms")
+    print(f"{'case':<18}{'found':>8}{'p50 us':>9}{'p99 us':>9}{'max us':>9}")
+    ok = True
+    for name, queries in cases:
+        samples, found = timed(index.complete, queries)
+        p99 = percentile(samples, 99)
+        print(f"{name:<18}{found / len(queries):>8.0%}{percentile(samples, 50) * 1000:>9.1f}"
+              f"{p99 * 1000:>9.1f}{max(samples) * 1000:>9.1f}")
+        ok &= p99 < MAX_P99_MS
+
+    # 登録1件ごとの追記（insort）
+    new_codes = [canonical_code(ean13(10**12 + i)) for i in range(1000)]
+    t0 = time.perf_counter()
+    for c in new_codes:
+        index.add(c)
+    print(f"insert: {(time.perf_counter() - t0) / len(new_codes) * 1e6:.1f}us/code")
+    print("PASS" if ok else f"FAIL: p99 が {MAX_P99_MS}ms を超えるケースがあります")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
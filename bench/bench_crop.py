@@ -0,0 +1,55 @@
+# bench_crop
+# ⏱️ バーコード領域切り出しのベンチ（合成フィクスチャ画像で的中率・縮小率・処理時間）
+#   python bench/bench_crop.py [--images 100] [--seed 1]
+
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_vision import crop_to_barcode
+from synth import shelf_scene, to_jpeg
+
+
+def coverage(truth, box):
+    # 正解枠のうち切り出し枠に含まれる割合
+    x0, y0 = max(truth[0], box[0]), max(truth[1], box[1])
+    x1, y1 = min(truth[2], box[2]), min(truth[3], box[3])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    return inter / float((truth[2] - truth[0]) * (truth[3] - truth[1]))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--images", type=int, default=100)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+
+    hits = found = 0
+    bytes_in = bytes_out = 0
+    area_frac, times = [], []
+    for i in range(args.images):
+        img, truth, _ = shelf_scene(rng, rotate=(i % 4 == 3))
+        data = to_jpeg(img)
+        t0 = time.perf_counter()
+        cropped, box = crop_to_barcode(data)
+        times.append(time.perf_counter() - t0)
+        bytes_in += len(data)
+        bytes_out += len(cropped)
+        if box is None:
+            continue
+        found += 1
+        area_frac.append((box[2] - box[0]) * (box[3] - box[1]) / float(img.width * img.height))
+        if coverage(truth, box) >= 0.9:
+            hits += 1
+
+    times.sort()
+    n = args.images
+    print(f"images          : {n}")
+    print(f"crop hit rate   : {hits / n:.1%}  (正解枠の90%以上を含む)")
+    print(f"crop found      : {found / n:.1%}")
+    if area_frac:
+        print(f"mean crop area  : {sum(area_frac) / len(area_frac):.1%} of frame")
+    print(f"upload bytes    : {bytes_in} -> {bytes_out} ({1 - bytes_out / bytes_in:.0%} saved)")
+    print(f"time p50 / p99  : {times[n // 2] * 1000:.1f} ms / {times[min(n - 1, int(n * 0.99))] * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
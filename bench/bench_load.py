@@ -0,0 +1,177 @@
+# bench_load
+# 🏪 同時利用の負荷試験（売場の端末N台ぶんのセッションを思考時間つきで並走させ、段階的に増やす）
+#   1セッション = 撮影 → OCR → JANCodeLookup → 登録、ときどきExcel出力（Streamlitと同じくセッション毎に1スレッド）
+#   フェイクは別プロセスで起動するので、スレッド数・RSSはアプリ側だけの値になる
+#   python bench/bench_load.py [--sessions 1,2,4,8,16,32] [--step-seconds 30] [--think 3.0] [--latency 0.3]
+
+import os, sys, time, random, argparse, threading, subprocess, warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shelf_ocr, shelf_lookup, shelf_sheets
+from shelf_codes import normalize_code
+from shelf_ocr import build_body, build_prompt, post_chat
+from shelf_lookup import HostRateLimiter, lookup_jan_polite
+from shelf_pipeline import preprocess
+from synth import shelf_scene, to_jpeg
+
+API_KEY = "sk-load-bench"
+FAKES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakes.py")
+# 1ステップ前よりスループットがこの割合しか伸びず、p95がこの倍率を超えたら飽和とみなす
+SATURATION_GAIN = 0.10
+SATURATION_P95 = 2.0
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] if samples else None
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ------------------------------------------------------------
+# 🧪 フェイク（別プロセス）
+# ------------------------------------------------------------
+def start_fakes(args):
+    cmd = [sys.executable, FAKES, "--rows", str(args.rows), "--latency", str(args.latency),
+           "--jitter", str(args.jitter), "--error-rate", str(args.error_rate)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    urls = {}
+    while len(urls) < 3:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError("fakes exited before reporting their URLs")
+        key, _, value = line.strip().partition("=")
+        urls[key] = value.strip("'")
+    return proc, urls
+
+
+# ------------------------------------------------------------
+# 👤 セッション
+# ------------------------------------------------------------
+class Recorder:
+    def __init__(self):
+        self.samples = {"scan": [], "export": []}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self._lock:
+            self.samples[kind].append(seconds)
+
+    def fail(self):
+        with self._lock:
+            self.errors += 1
+
+def session(sheet, images, recorder, stop, think, export_every, limiter, rng):
+    scans = 0
+    while not stop.is_set():
+        # 思考時間（商品を手に取って構えるまで）は指数分布
+        if stop.wait(rng.expovariate(1 / think) if think > 0 else 0):
+            break
+        t0 = time.perf_counter()
+        try:
+            prep = preprocess(rng.choice(images))
+            code = normalize_code(post_chat(build_body(prep["ocr_bytes"], build_prompt()), API_KEY))
+            _, title, img_url, _ = lookup_jan_polite(code, limiter=limiter, retries=1)
+            shelf_sheets.append_one(sheet, code, title, img_url, "2025-01-01 09:00:00")
+            recorder.add("scan", time.perf_counter() - t0)
+            scans += 1
+            if export_every and scans % export_every == 0:
+                t0 = time.perf_counter()
+                shelf_sheets.records_to_xlsx(shelf_sheets.read_records(sheet))
+                recorder.add("export", time.perf_counter() - t0)
+        except Exception:
+            recorder.fail()
+
+def run_step(n, args, images, client, limiter):
+    recorder, stop = Recorder(), threading.Event()
+    # セッション毎にシートを開く（アプリも再実行毎に開き直す）
+    threads = [threading.Thread(target=session, daemon=True,
+                                args=(shelf_sheets.open_sheet(client), images, recorder, stop, args.think,
+                                      args.export_every, limiter, random.Random(args.seed * 1000 + i)))
+               for i in range(n)]
+    for t in threads:
+        t.start()
+    peak_threads, peak_rss = 0, 0.0
+    deadline = time.monotonic() + args.step_seconds
+    while time.monotonic() < deadline:
+        peak_threads = max(peak_threads, threading.active_count())
+        peak_rss = max(peak_rss, rss_mb())
+        time.sleep(0.5)
+    stop.set()
+    for t in threads:
+        t.join(timeout=60)
+    scans = recorder.samples["scan"]
+    exports = recorder.samples["export"]
+    ms = lambda v: None if v is None else v * 1000
+    return {"sessions": n, "scans": len(scans), "errors": recorder.errors,
+            "throughput": len(scans) / args.step_seconds,
+            "p50": ms(percentile(scans, 50)), "p95": ms(percentile(scans, 95)), "p99": ms(percentile(scans, 99)),
+            "export_p95": ms(percentile(exports, 95)), "threads": peak_threads, "rss": peak_rss}
+
+def saturated(prev, cur, first):
+    if prev is None or not cur["scans"] or first["p95"] is None:
+        return False
+    gain = (cur["throughput"] - prev["throughput"]) / prev["throughput"] if prev["throughput"] else 0
+    return gain < SATURATION_GAIN and cur["p95"] > first["p95"] * SATURATION_P95
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", default="1,2,4,8,16,32")
+    ap.add_argument("--step-seconds", type=float, default=30.0)
+    ap.add_argument("--think", type=float, default=3.0, help="平均思考時間（秒）")
+    ap.add_argument("--export-every", type=int, default=20, help="何スキャン毎にExcel出力するか（0=しない）")
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--latency", type=float, default=0.3, help="フェイク共通の応答遅延（秒）")
+    ap.add_argument("--jitter", type=float, default=0.2)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--images", type=int, default=12)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--keep-going", action="store_true", help="飽和を検出しても最後のステップまで続ける")
+    args = ap.parse_args()
+
+    warnings.filterwarnings("ignore", message="Ignoring URL")
+    rng = random.Random(args.seed)
+    images = [to_jpeg(shelf_scene(rng)[0]) for _ in range(args.images)]
+    proc, urls = start_fakes(args)
+    try:
+        shelf_ocr.OPENAI_CHAT_URL = urls["MY_SHELF_OPENAI_URL"]
+        shelf_lookup.JANCODELOOKUP_URL = urls["MY_SHELF_JANCODELOOKUP_URL"]
+        client = shelf_sheets.endpoint_client(urls["MY_SHELF_SHEETS_URL"])
+        limiter = HostRateLimiter(1e9, 1e9)
+
+        print(f"fakes pid {proc.pid}: latency {args.latency * 1000:.0f}ms ±{args.jitter * 1000:.0f}ms, "
+              f"think {args.think}s, {args.step_seconds:.0f}s/step, cpu_count={os.cpu_count()}")
+        print(f"{'sessions':>8}{'scans':>7}{'err':>5}{'scan/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'exp p95':>9}{'threads':>8}{'RSS MB':>8}")
+        fmt = lambda v: "-" if v is None else f"{v:.0f}"
+        first = prev = None
+        saturation = None
+        for n in (int(s) for s in args.sessions.split(",")):
+            cur = run_step(n, args, images, client, limiter)
+            print(f"{n:>8}{cur['scans']:>7}{cur['errors']:>5}{cur['throughput']:>8.2f}{fmt(cur['p50']):>9}"
+                  f"{fmt(cur['p95']):>9}{fmt(cur['p99']):>9}{fmt(cur['export_p95']):>9}{cur['threads']:>8}"
+                  f"{cur['rss']:>8.0f}")
+            first = first or cur
+            if saturation is None and saturated(prev, cur, first):
+                saturation = prev["sessions"]
+                if not args.keep_going:
+                    break
+            prev = cur
+        if saturation is None:
+            print(f"no saturation up to {prev['sessions'] if prev else 0} sessions")
+        else:
+            print(f"saturation: about {saturation} concurrent sessions per replica "
+                  f"(more sessions add < {SATURATION_GAIN:.0%} throughput with p95 > {SATURATION_P95:.0f}x single-session)")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+if __name__ == "__main__":
+    main()
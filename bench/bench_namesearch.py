@@ -0,0 +1,91 @@
+# bench_namesearch
+# 🔎 商品名検索のベンチ（文字バイグラム索引の構築時間・追記・部分一致／表記ゆれ／誤字／絞れない語の問い合わせをp50/p99で測る）
+#   python bench/bench_namesearch.py [--rows 100000] [--queries 500]
+
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_namesearch import NameIndex, normalize_name
+from fakes import ean13
+
+# 入力のたびに呼ぶので、典型（p50）はこれ以下、絞れない語を含めた p99 もこれ以下なら PASS
+MAX_P50_MS = 5.0
+MAX_P99_MS = 30.0
+
+BRANDS = "サントリー 伊藤園 キリン アサヒ 明治 森永 日清 カルビー ロッテ 花王 ライオン 資生堂 味の素 キッコーマン ハウス食品 江崎グリコ 不二家 ヤクルト 雪印 カゴメ".split()
+PRODUCTS = ("天然水 緑茶 紅茶 コーヒー ポテトチップス カップヌードル チョコレート シャンプー 歯みがき 洗剤 ミネラルウォーター "
+            "スポーツドリンク 野菜ジュース ヨーグルト 牛乳 食パン カレー ラーメン ビスケット アイスクリーム").split()
+VARIANTS = "ミルク 無糖 微糖 濃いめ うすしお味 しょうゆ味 カレー味 大盛 ストロベリー 抹茶 レモン 贅沢 プレミアム 限定 詰め替え".split()
+SIZES = "500ml 2L 85g 12個入 350ml 1kg 6枚切 3個パック 150g 24本".split()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+def hiragana(s):
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in s)
+
+def zenkaku(s):
+    return "".join(chr(ord(c) + 0xFEE0) if "!" <= c <= "~" else c for c in s)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+
+    rows = [(rng.choice(BRANDS), rng.choice(PRODUCTS), rng.choice(VARIANTS), rng.choice(SIZES))
+            for _ in range(args.rows)]
+    names = [" ".join(r) for r in rows]
+    t0 = time.perf_counter()
+    index = NameIndex.of(names)
+    build_ms = (time.perf_counter() - t0) * 1000
+    picks = [rng.choice(rows) for _ in range(args.queries)]
+
+    def typo(word):
+        i = rng.randrange(len(word))
+        return word[:i] + rng.choice("アイウエオカキクケコ") + word[i + 1:]
+
+    cases = [
+        ("product+variant", [f"{p} {v}" for _, p, v, _ in picks], None),
+        ("full name", [" ".join(r) for r in picks], None),
+        ("hiragana brand+product", [f"{hiragana(b)} {p}" for b, p, _, _ in picks], None),
+        ("zenkaku size", [f"{v} {zenkaku(s)}" for _, _, v, s in picks], None),
+        ("typo in product", [f"{b} {typo(p)}" for b, p, _, _ in picks if len(p) > 2], "fuzzy"),
+        ("brand only", [b for b, _, _, _ in picks], None),
+    ]
+    print(f"{len(index)} names, {len(index._postings)} grams, build {build_ms:.0f}ms")
+    print(f"{'case':<24}{'found':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    everything = []
+    for name, queries, mode in cases:
+        samples, found = [], 0
+        for q in queries:
+            t0 = time.perf_counter()
+            hits = index.search(q)
+            samples.append((time.perf_counter() - t0) * 1000)
+            if mode == "fuzzy":
+                found += bool(hits)
+            else:
+                # 表記ゆれを揃えたうえで先頭の結果がクエリを部分文字列として含むこと
+                found += bool(hits) and normalize_name(q) in index.names[hits[0][0]]
+        everything += samples
+        print(f"{name:<24}{found / len(queries):>8.0%}{percentile(samples, 50):>9.2f}"
+              f"{percentile(samples, 99):>9.2f}{max(samples):>9.2f}")
+
+    # 登録1件ごとの追記
+    t0 = time.perf_counter()
+    for i in range(1000):
+        index.add(len(index), f"新商品 テスト {ean13(i)}")
+    print(f"append: {(time.perf_counter() - t0) / 1000 * 1e6:.1f}us/name")
+
+    p50, p99 = percentile(everything, 50), percentile(everything, 99)
+    ok = p50 < MAX_P50_MS and p99 < MAX_P99_MS
+    print(f"all queries: p50 {p50:.2f}ms, p99 {p99:.2f}ms")
+    print("PASS" if ok else f"FAIL: p50 が {MAX_P50_MS}ms または p99 が {MAX_P99_MS}ms を超えています")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
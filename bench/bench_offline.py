@@ -0,0 +1,182 @@
+# bench_offline
+# ⏱️ オフライン総合ベンチ（OpenAI／JANCodeLookup／Google Sheets をローカルフェイクに差し替え）
+#   単体スキャン・バッチスキャン・検索・エクスポートのスループットとp50/p99をシート行数別に測る
+#   python bench/bench_offline.py [--rows 1000,10000,100000] [--latency 0.02] [--error-rate 0.0]
+#                                [--save baseline.json | --baseline baseline.json --tolerance 0.25]
+#   python bench/bench_offline.py --cassette cassettes/shop.jsonl.gz [--latency-scale 1.0]（記録済み応答で再生）
+
+import os, sys, json, time, random, argparse, warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shelf_ocr, shelf_lookup, shelf_sheets
+from shelf_codes import normalize_code
+from shelf_ocr import OcrBatcher, build_body, build_prompt, post_chat
+from shelf_lookup import HostRateLimiter, lookup_jan_polite, bulk_lookup, cache_clear
+from shelf_pipeline import preprocess, get_pipeline
+from shelf_cassette import load_cassette
+from fakes import FakeConfig, FakeOpenAI, FakeJanLookup, FakeSheets
+from replay import ReplayServer
+from synth import shelf_scene, to_jpeg
+
+API_KEY = "sk-offline-bench"
+REGISTERED_AT = "2025-01-01 09:00:00"
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+# ------------------------------------------------------------
+# 🎬 シナリオ（1回 = 画面操作1回ぶん）
+# ------------------------------------------------------------
+class Scenarios:
+    def __init__(self, images, sheet, limiter, batch):
+        self.images = images
+        self.sheet = sheet
+        self.limiter = limiter
+        self.batch = batch
+        self.batcher = OcrBatcher(API_KEY, min_size=batch, max_size=batch)
+        self.codes = [r[0] for r in sheet.get_all_values()[1:]]
+        self._i = 0
+
+    def _next_images(self, n):
+        out = [self.images[(self._i + k) % len(self.images)] for k in range(n)]
+        self._i += n
+        return out
+
+    def single_scan(self):
+        # 前処理 → OCR → JANCodeLookup → 登録（update_cell×4）
+        image_bytes = self._next_images(1)[0]
+        prep = preprocess(image_bytes)
+        code = normalize_code(post_chat(build_body(prep["ocr_bytes"], build_prompt()), API_KEY))
+        _, title, img_url, _ = lookup_jan_polite(code, limiter=self.limiter, retries=1)
+        shelf_sheets.append_one(self.sheet, code, title, img_url, REGISTERED_AT)
+
+    def batch_scan(self):
+        # まとめて前処理 → バッチOCR → 一括取得 → append_rows 1回
+        preps = get_pipeline().map(self._next_images(self.batch))
+        futures = [self.batcher.submit(p["ocr_bytes"]) for p in preps]
+        codes = [normalize_code(f.result(timeout=60)) for f in futures]
+        items = [(code, title, img) for code, _, title, img, _, _ in bulk_lookup(codes, limiter=self.limiter)]
+        shelf_sheets.append_many(self.sheet, items, REGISTERED_AT)
+
+    def search(self):
+        code = random.choice(self.codes)
+        name, _ = shelf_sheets.search(self.sheet, code)
+        if name is None:
+            raise AssertionError(f"{code} not found")
+
+    def export(self):
+        shelf_sheets.records_to_xlsx(shelf_sheets.read_records(self.sheet))
+
+def measure(fn, iterations, max_seconds):
+    # 各シナリオは最低3回、iterations 回か max_seconds 秒で打ち切り
+    samples, errors = [], 0
+    started = time.perf_counter()
+    while len(samples) + errors < iterations:
+        cache_clear()
+        t0 = time.perf_counter()
+        try:
+            fn()
+            samples.append(time.perf_counter() - t0)
+        except Exception as e:
+            errors += 1
+            print(f"    ! {type(e).__name__}: {e}", file=sys.stderr)
+        if len(samples) + errors >= 3 and time.perf_counter() - started > max_seconds:
+            break
+    wall = time.perf_counter() - started
+    if not samples:
+        return {"n": 0, "errors": errors, "ops_per_s": 0.0, "p50_ms": None, "p99_ms": None}
+    return {"n": len(samples), "errors": errors, "ops_per_s": round(len(samples) / wall, 2),
+            "p50_ms": round(percentile(samples, 50) * 1000, 1), "p99_ms": round(percentile(samples, 99) * 1000, 1)}
+
+
+# ------------------------------------------------------------
+# 📏 回帰判定
+# ------------------------------------------------------------
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, r in results.items():
+        base = baseline.get(key)
+        if not base or r["p50_ms"] is None:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if base.get(metric) and r[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{key} {metric}: {base[metric]} → {r[metric]}")
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="1000,10000,100000")
+    ap.add_argument("--scenarios", default="single_scan,batch_scan,search,export")
+    ap.add_argument("--iterations", type=int, default=20)
+    ap.add_argument("--max-seconds", type=float, default=30.0)
+    ap.add_argument("--batch", type=int, default=8)
+    ap.add_argument("--images", type=int, default=16)
+    ap.add_argument("--latency", type=float, default=0.02, help="フェイク共通の応答遅延（秒）")
+    ap.add_argument("--jitter", type=float, default=0.01)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="429を返す割合")
+    ap.add_argument("--page-bytes", type=int, default=None, help="JANCodeLookupのページサイズ")
+    ap.add_argument("--jan-rate", type=float, default=0.0, help="JANCodeLookupのホスト毎レート（0=無制限）")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--cassette", help="フェイクの代わりに記録済みカセットを再生する")
+    ap.add_argument("--latency-scale", type=float, default=1.0, help="カセット再生時の遅延倍率")
+    ap.add_argument("--save", help="結果をベースラインとして保存するJSON")
+    ap.add_argument("--baseline", help="比較するベースラインJSON")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+
+    # 65,530行を超えるとxlsxwriterがURLのハイパーリンク化を諦めて行毎に警告する
+    warnings.filterwarnings("ignore", message="Ignoring URL")
+    random.seed(args.seed)
+    rng = random.Random(args.seed)
+    images = [to_jpeg(shelf_scene(rng)[0]) for _ in range(args.images)]
+
+    config = lambda: FakeConfig(args.latency, args.jitter, args.error_rate, seed=args.seed)
+    if args.cassette:
+        replay = ReplayServer(load_cassette(args.cassette), args.latency_scale).start()
+        openai_url, jan_url = replay.env()["MY_SHELF_OPENAI_URL"], replay.env()["MY_SHELF_JANCODELOOKUP_URL"]
+        print(f"cassette: {args.cassette}, latency x{args.latency_scale}, {len(images)} images")
+    else:
+        openai, jan = FakeOpenAI(config()).start(), FakeJanLookup(config(), page_bytes=args.page_bytes).start()
+        openai_url, jan_url = openai.chat_url, jan.search_url
+        print(f"fakes: latency {args.latency * 1000:.0f}ms ±{args.jitter * 1000:.0f}ms, "
+              f"error rate {args.error_rate:.0%}, {len(images)} images")
+    # 接続先の差し替え（アプリでは MY_SHELF_OPENAI_URL／MY_SHELF_JANCODELOOKUP_URL／MY_SHELF_SHEETS_URL）
+    shelf_ocr.OPENAI_CHAT_URL = openai_url
+    shelf_lookup.JANCODELOOKUP_URL = jan_url
+    limiter = HostRateLimiter(args.jan_rate or 1e9, 4 if args.jan_rate else 1e9)
+
+    print(f"{'scenario':<14}{'rows':>8}{'n':>5}{'err':>5}{'ops/s':>9}{'p50 ms':>10}{'p99 ms':>10}")
+    results = {}
+    for rows in (["replay"] if args.cassette else [int(r) for r in args.rows.split(",")]):
+        sheets = replay if args.cassette else FakeSheets(config(), rows=rows).start()
+        client = shelf_sheets.endpoint_client(sheets.base_url)
+        scenarios = Scenarios(images, shelf_sheets.open_sheet(client), limiter, args.batch)
+        for name in args.scenarios.split(","):
+            r = measure(getattr(scenarios, name), args.iterations, args.max_seconds)
+            results[f"{name}@{rows}"] = r
+            p50 = "-" if r["p50_ms"] is None else f"{r['p50_ms']:.1f}"
+            p99 = "-" if r["p99_ms"] is None else f"{r['p99_ms']:.1f}"
+            print(f"{name:<14}{rows:>8}{r['n']:>5}{r['errors']:>5}{r['ops_per_s']:>9.2f}{p50:>10}{p99:>10}")
+        sheets.stop()
+
+    if args.cassette:
+        # 記録にない要求（404）があると、その経路は実際の負荷を再現できていない
+        print(f"replay hits {dict(replay.hits)}, misses {len(replay.misses)}"
+              + (f" (e.g. {replay.misses[0]})" if replay.misses else ""))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {args.save}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(" -", line)
+        print("PASS" if not regressions else f"FAIL: {len(regressions)} 件の退行（許容 +{args.tolerance:.0%}）")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
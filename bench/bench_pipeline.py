@@ -0,0 +1,42 @@
+# bench_pipeline
+# ⏱️ 画像パイプラインのスループット（直列・スレッド・プロセス×ワーカー数）
+#   python bench/bench_pipeline.py [--images 64] [--workers 1,2,4,8]（プロセスは2以上のみ）
+
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_pipeline import ImagePipeline, preprocess
+from synth import shelf_scene, to_jpeg
+
+
+def run(label, fn, images):
+    t0 = time.perf_counter()
+    results = fn(images)
+    dt = time.perf_counter() - t0
+    local = sum(1 for r in results if r["local_code"])
+    print(f"{label:<22}{dt * 1000:>10.0f} ms{len(images) / dt:>10.1f} img/s   local decode {local}/{len(images)}")
+    return dt
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--images", type=int, default=64)
+    ap.add_argument("--workers", default="1,2,4,8")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    images = [to_jpeg(shelf_scene(rng, symbology="code128" if i % 2 else "ean13")[0]) for i in range(args.images)]
+    print(f"{len(images)} images, {sum(map(len, images)) / 1e6:.1f} MB, cpu_count={os.cpu_count()}")
+
+    base = run("serial", lambda ims: [preprocess(b, allow_alnum=True) for b in ims], images)
+    for n in (int(w) for w in args.workers.split(",")):
+        threads = ImagePipeline(workers=n, min_process_items=10 ** 9)
+        run(f"threads x{n}", lambda ims: threads.map(ims, allow_alnum=True), images)
+        if n < 2:
+            continue
+        procs = ImagePipeline(workers=n, min_process_items=1, min_process_bytes=0)
+        procs.map(images[:n], allow_alnum=True)  # プロセス起動を計測から除く
+        dt = run(f"processes x{n}", lambda ims: procs.map(ims, allow_alnum=True), images)
+        print(f"{'':<22}speedup vs serial {base / dt:.2f}x")
+
+if __name__ == "__main__":
+    main()
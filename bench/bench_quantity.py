@@ -0,0 +1,83 @@
+# bench_quantity
+# 🔢 数量モードのベンチ（同じ読み取り列を「1スキャン1行の追記」「1スキャン毎の数量加算」「一括登録の数量加算」で登録し、行数・API回数・全件読みの大きさを比べる）
+#   python bench/bench_quantity.py [--rows 1000] [--scans 200] [--skus 40] [--repeat 0.5]
+
+import os, sys, json, time, random, argparse, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shelf_sheets
+from shelf_snapshot import SheetSnapshot
+from fakes import FakeSheets, ean13
+
+
+def scan_stream(rng, scans, skus, repeat, existing):
+    """棚卸しらしい読み取り列。repeat の確率で直前と同じコード（同じ商品を続けて数える）、半分は登録済みのコード。"""
+    pool = [ean13(rng.randrange(1, existing + 1)) if i % 2 else ean13(10**6 + i) for i in range(skus)]
+    out = []
+    for _ in range(scans):
+        out.append(out[-1] if out and rng.random() < repeat else rng.choice(pool))
+    return out
+
+def run(mode, codes, rows):
+    fake = FakeSheets(rows=rows).start()
+    try:
+        sheet = shelf_sheets.open_sheet(shelf_sheets.endpoint_client(fake.base_url))
+        with tempfile.TemporaryDirectory() as root:
+            snapshot = SheetSnapshot("bench", root=root)
+            snapshot.sync_records(shelf_sheets.read_records(sheet))
+            before = fake.config.requests
+            t0 = time.perf_counter()
+            if mode == "append":
+                for code in codes:
+                    shelf_sheets.append_one(sheet, code, f"商品 {code}", "", "now", snapshot)
+            elif mode == "quantity":
+                # アプリの「登録する」と同じく1スキャン毎にすぐ書く
+                for code in codes:
+                    shelf_sheets.add_quantities(sheet, [(code, f"商品 {code}", "", 1)], "now", snapshot)
+            else:
+                # 一括登録と同じく読んだ分をコード毎にまとめて1回で書く
+                shelf_sheets.add_quantities(sheet, shelf_sheets.tally((c, f"商品 {c}", "") for c in codes), "now", snapshot)
+            seconds = time.perf_counter() - t0
+            calls = fake.config.requests - before
+        values = [list(r) for r in fake.values]
+    finally:
+        fake.stop()
+    return {"rows": len(values) - 1, "calls": calls, "seconds": seconds, "values": values,
+            "download_kb": len(json.dumps(values, ensure_ascii=False).encode("utf-8")) / 1024}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000, help="初期の登録行数")
+    ap.add_argument("--scans", type=int, default=200)
+    ap.add_argument("--skus", type=int, default=40, help="読み取る商品の種類")
+    ap.add_argument("--repeat", type=float, default=0.5, help="直前と同じコードを読む確率")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    codes = scan_stream(random.Random(args.seed), args.scans, args.skus, args.repeat, args.rows)
+    distinct = set(codes)
+    new_skus = len({c for c in distinct if int(c[2:12]) > args.rows})
+
+    print(f"{args.scans} scans of {len(distinct)} SKUs ({new_skus} new), sheet {args.rows} rows")
+    print(f"{'mode':<10}{'rows':>8}{'API calls':>11}{'calls/scan':>12}{'full read KB':>14}{'seconds':>9}")
+    results = {}
+    for mode in ("append", "quantity", "bulk"):
+        r = results[mode] = run(mode, codes, args.rows)
+        print(f"{mode:<10}{r['rows']:>8}{r['calls']:>11}{r['calls'] / len(codes):>12.2f}"
+              f"{r['download_kb']:>14.1f}{r['seconds']:>9.2f}")
+
+    # 数量モードは行数が種類数でしか増えず、数量の合計が読み取り数と一致すること
+    expected = {c: codes.count(c) + (int(c[2:12]) <= args.rows) for c in distinct}
+    ok = True
+    for mode in ("quantity", "bulk"):
+        values = results[mode]["values"]
+        qty = values[0].index(shelf_sheets.QTY_COLUMN)
+        counted = {}
+        for row in values[1:]:
+            if row and row[0] in distinct:
+                counted[row[0]] = counted.get(row[0], 0) + shelf_sheets._quantity(row[qty] if qty < len(row) else "")
+        ok &= results[mode]["rows"] == args.rows + new_skus and counted == expected
+    print("PASS" if ok else "FAIL: 数量モードの行数または数量の合計が読み取り数と合いません")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
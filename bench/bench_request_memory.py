@@ -0,0 +1,53 @@
+# bench_request_memory
+# 🧠 OCRリクエスト本体の組み立てピークメモリ（tracemalloc）
+#   python bench/bench_request_memory.py [--sizes 1,5,10]（MB）
+
+import os, sys, json, base64, argparse, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_ocr import build_body, build_prompt, OCR_MODEL, SYSTEM_PROMPT, B64_CHUNK
+
+
+def legacy_body(image_bytes):
+    # 旧方式：b64 bytes → str → f-string → dict → json.dumps → 送信時のエンコード
+    image_b64 = base64.b64encode(image_bytes).decode("utf-8")
+    payload = {
+        "model": OCR_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": [
+                {"type": "text", "text": build_prompt()},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}}
+            ]}
+        ],
+        "max_tokens": 50
+    }
+    return json.dumps(payload).encode("latin-1")
+
+def peak(fn, image_bytes):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    body = fn(image_bytes)
+    _, top = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return top, len(body)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1,5,10")
+    args = ap.parse_args()
+    ok = True
+    print(f"{'image':>8}{'body':>10}{'legacy peak':>14}{'new peak':>12}{'x body':>9}")
+    for mb in (float(v) for v in args.sizes.split(",")):
+        image_bytes = os.urandom(int(mb * 1024 * 1024))
+        old_peak, _ = peak(legacy_body, image_bytes)
+        new_peak, size = peak(lambda b: build_body(b, build_prompt()), image_bytes)
+        print(f"{mb:>6.0f}MB{size / 2**20:>8.1f}MB{old_peak / 2**20:>12.1f}MB{new_peak / 2**20:>10.1f}MB"
+              f"{new_peak / size:>8.2f}x")
+        # 本体1つ＋base64チャンク数個分に収まること
+        ok &= new_peak < size + 4 * B64_CHUNK
+    print("PASS" if ok else "FAIL: 新方式のピークが本体＋チャンク上限を超えました")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
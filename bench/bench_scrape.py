@@ -0,0 +1,48 @@
+# bench_scrape
+# ⏱️ JANCodeLookup解析のマイクロベンチ（保存済みHTMLフィクスチャ使用）
+#   python bench/bench_scrape.py [--repeat 200]
+
+import os, sys, glob, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_lookup import CHUNK_SIZE, read_result_fragment, parse_product_html, parse_html_full
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def chunked(data: bytes, size=CHUNK_SIZE):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+def bench(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - t0) / repeat * 1000, result
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    print(f"{'fixture':<34}{'full ms':>9}{'fast ms':>9}{'speedup':>9}{'bytes':>9}{'read':>9}{'saved':>8}")
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "jancodelookup_*.html"))):
+        data = open(path, "rb").read()
+
+        # 旧方式：全文受信＋全文BeautifulSoup
+        full_ms, full = bench(lambda: parse_html_full(data.decode("utf-8")), args.repeat)
+
+        # 新方式：先頭ブロックで受信打ち切り＋断片の高速パス
+        def fast():
+            fragment, body, nbytes = read_result_fragment(chunked(data))
+            return parse_product_html(fragment, body), nbytes
+        fast_ms, (fast_result, nbytes) = bench(fast, args.repeat)
+
+        if (full[0] or "商品名不明", full[1]) != fast_result:
+            print(f"  ⚠️ 結果不一致: full={full} fast={fast_result}")
+        saved = 1 - nbytes / len(data)
+        print(f"{os.path.basename(path):<34}{full_ms:>9.3f}{fast_ms:>9.3f}{full_ms / fast_ms:>8.1f}x"
+              f"{len(data):>9}{nbytes:>9}{saved:>7.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# bench_session_memory
+# 🧠 長時間稼働のメモリ試験（Streamlit AppTest で実際のスクリプトを数千回再実行し、tracemalloc で関数別の確保量を出す）
+#   セッション毎に「コード入力 → JANCodeLookup／Sheets取得 → 登録 → 一括取得 → Excel作成」を繰り返す
+#   カメラ入力は AppTest で操作できないため、画像OCRの経路は bench_offline.py 側で測る
+#   python bench/bench_session_memory.py [--reruns 2000] [--traced 200] [--sessions 4] [--budget-mb 32] [--max-growth-mb 8]
+
+import os, sys, ast, time, random, argparse, tempfile, tracemalloc, warnings
+from collections import defaultdict
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+import shelf_ocr, shelf_lookup, shelf_sheets
+from bench_load import start_fakes, rss_mb
+from fakes import ean13
+
+APP = os.path.join(ROOT, "my_shelf_st_1.214.py")
+
+
+# ------------------------------------------------------------
+# 🔎 確保位置 → 関数名（リポジトリ内の最も内側のフレームに寄せる）
+# ------------------------------------------------------------
+_functions = {}
+
+def _function_ranges(filename):
+    if filename not in _functions:
+        ranges = []
+        try:
+            with open(filename, encoding="utf-8") as f:
+                tree = ast.parse(f.read())
+            for node in ast.walk(tree):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    ranges.append((node.lineno, node.end_lineno, node.name))
+        except (OSError, SyntaxError, ValueError):
+            pass
+        _functions[filename] = ranges
+    return _functions[filename]
+
+def function_at(filename, lineno):
+    # 入れ子の関数は最も内側（範囲の狭い方）を採る
+    inside = [(end - start, name) for start, end, name in _function_ranges(filename) if start <= lineno <= end]
+    return min(inside)[1] if inside else "<module>"
+
+def owner(traceback):
+    for frame in reversed(traceback):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(ROOT) and not path.startswith(BENCH_DIR):
+            return f"{function_at(path, frame.lineno)} ({os.path.basename(path)})"
+    frame = traceback[-1]
+    return f"[lib] {os.path.basename(frame.filename)}:{frame.lineno}"
+
+def by_function(new, old):
+    sizes, counts = defaultdict(int), defaultdict(int)
+    for diff in new.compare_to(old, "traceback"):
+        key = owner(diff.traceback)
+        sizes[key] += diff.size_diff
+        counts[key] += diff.count_diff
+    return sorted(((k, sizes[k], counts[k]) for k in sizes), key=lambda r: -abs(r[1]))
+
+
+# ------------------------------------------------------------
+# 👤 1セッションぶんの操作（1回 = 1再実行）
+# ------------------------------------------------------------
+def button(at, text):
+    return next(b for b in at.button if text in b.label)
+
+def step(at, i, rng, bulk_size):
+    action = i % 10
+    if action == 0:
+        at.text_input[0].input(ean13(rng.randrange(1, 10**6)))
+    elif action == 1:
+        button(at, "JANCodeLookup").click()
+    elif action == 2:
+        button(at, "Google Sheetsから取得").click()
+    elif action == 3:
+        button(at, "登録する").click()
+    elif action == 4:
+        at.text_area[0].input("\n".join(ean13(rng.randrange(1, 10**6)) for _ in range(bulk_size)))
+    elif action == 5:
+        button(at, "一括取得").click()
+    elif action == 7 and i % 40 == 7:
+        button(at, "Excelを作成").click()
+    # 残りは何も操作しない再実行（ウィジェットの変化やタブ復帰）
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reruns", type=int, default=2000, help="全セッション合計の再実行回数")
+    ap.add_argument("--sessions", type=int, default=4)
+    ap.add_argument("--warmup", type=int, default=200, help="計測前の再実行回数（import・キャッシュの初期化）")
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--bulk-size", type=int, default=100)
+    ap.add_argument("--budget-mb", type=float, default=32.0, help="セッション毎の上限（MY_SHELF_SESSION_BUDGET_MB）")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--frames", type=int, default=10, help="tracemalloc が保持するスタックの深さ")
+    ap.add_argument("--traced", type=int, default=200, help="最後にtracemallocで追う再実行回数")
+    ap.add_argument("--max-growth-mb", type=float, default=8.0, help="追った区間の増加がこれ以下なら PASS")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="my_shelf_mem_")
+    proc, urls = start_fakes(SimpleNamespace(rows=args.rows, latency=0.0, jitter=0.0, error_rate=0.0))
+    os.environ.update(urls)
+    os.environ.update({"OPENAI_API_KEY": "sk-memory-bench", "MY_SHELF_SESSION_BUDGET_MB": str(args.budget_mb),
+                       "MY_SHELF_IMAGE_CACHE": os.path.join(tmp, "images"),
+                       "MY_SHELF_TRACE_LOG": os.path.join(tmp, "spans.jsonl"),
+                       # 本番のシートキー・既定のスナップショット置き場を読み書きしないよう、どちらもベンチ専用に
+                       "MY_SHELF_SNAPSHOT_DIR": os.path.join(tmp, "snapshot"),
+                       "MY_SHELF_SHEET_KEY": "memory-bench"})
+    warnings.filterwarnings("ignore", message="Ignoring URL")
+    from streamlit.testing.v1 import AppTest
+    # bench_load の import で読み込み済みのため、接続先は環境変数でなく直接差し替える
+    shelf_ocr.OPENAI_CHAT_URL = urls["MY_SHELF_OPENAI_URL"]
+    shelf_lookup.JANCODELOOKUP_URL = urls["MY_SHELF_JANCODELOOKUP_URL"]
+    shelf_sheets.SHEET_KEY = os.environ["MY_SHELF_SHEET_KEY"]
+    # 相手はフェイクなので、JANCodeLookupへの礼儀の間隔は外して再実行回数を稼ぐ
+    shelf_lookup.host_limiter = shelf_lookup.HostRateLimiter(1e9, 1e9)
+
+    try:
+        rng = random.Random(args.seed)
+        sessions = [AppTest.from_file(APP, default_timeout=120) for _ in range(args.sessions)]
+        for at in sessions:
+            at.run()
+
+        def run(n, start):
+            for i in range(start, start + n):
+                step(sessions[i % len(sessions)], i // len(sessions), rng, args.bulk_size)
+                if (i + 1) % 100 == 0:
+                    print(f"  {i + 1} reruns, RSS {rss_mb():.0f}MB", file=sys.stderr, flush=True)
+
+        t0 = time.perf_counter()
+        run(args.warmup, 0)
+        warm_rss = rss_mb()
+        # 大半は計測なしで回し（tracemalloc は数倍遅くなる）、最後の --traced 回だけ確保を追う
+        soak = max(0, args.reruns - args.traced)
+        run(soak, args.warmup)
+        soak_rss = rss_mb()
+        tracemalloc.start(args.frames)
+        base = tracemalloc.take_snapshot()
+        run(args.reruns - soak, args.warmup + soak)
+        end, end_rss = tracemalloc.take_snapshot(), rss_mb()
+        growth_bytes, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        elapsed = time.perf_counter() - t0
+
+        total = args.warmup + args.reruns
+        print(f"{total} reruns over {args.sessions} sessions in {elapsed:.0f}s, budget {args.budget_mb:g}MB/session")
+        print(f"RSS {warm_rss:.0f}MB after warmup → {soak_rss:.0f}MB after {soak} reruns → {end_rss:.0f}MB; "
+              f"last {args.reruns - soak} reruns kept +{growth_bytes / 2**20:.1f}MB (peak {peak / 2**20:.1f}MB)")
+        print(f"\ntop allocations by function (last {args.reruns - soak} reruns, still alive at the end):")
+        print(f"{'size MB':>9}{'blocks':>9}  function")
+        for name, size, count in by_function(end, base)[:args.top]:
+            print(f"{size / 2**20:>9.2f}{count:>9}  {name}")
+
+        print()
+        for i, at in enumerate(sessions):
+            u = at.session_state["_budget"].usage()
+            print(f"session {i}: {u['bytes'] / 2**20:.1f}MB in {u['items']} items, {u['evictions']} evictions "
+                  f"({', '.join(f'{k} {v / 1024:.0f}KB' for k, v in u['entries'].items())})")
+        growth = growth_bytes / 2**20
+        ok = growth <= args.max_growth_mb
+        print("PASS" if ok else f"FAIL: 最後の区間で {growth:.1f}MB 増加（許容 {args.max_growth_mb}MB）")
+        sys.exit(0 if ok else 1)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+if __name__ == "__main__":
+    main()
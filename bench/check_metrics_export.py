@@ -0,0 +1,112 @@
+# check_metrics_export
+# 📡 Prometheus出力をローカルでスクレイプして形式と中身を確認する
+#   python bench/check_metrics_export.py
+
+import os, re, sys, tempfile, urllib.request
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_metrics import metrics
+from shelf_exporter import start_http_exporter, write_textfile, CONTENT_TYPE
+from shelf_lookup import cache_get, cache_put
+from shelf_vision import FrameIndex
+import shelf_imagecache  # noqa: F401（収集関数の登録）
+import shelf_ocr  # noqa: F401
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+EXPECTED = [
+    "my_shelf_stage_duration_seconds_bucket", "my_shelf_stage_duration_seconds_count",
+    "my_shelf_stage_errors_total", "my_shelf_stage_cache_hits_total", "my_shelf_upstream_responses_total",
+    "my_shelf_sheets_api_calls_total", "my_shelf_jan_lookup_total", "my_shelf_cache_requests_total",
+    "my_shelf_ocr_breaker_state", "my_shelf_ocr_events_total", "my_shelf_bulk_lookup_queue_depth",
+]
+
+
+def drive():
+    # 実際の記録経路を一通り通す
+    for ms in (3, 40, 40, 700):
+        metrics.record("ocr", ms / 1000)
+    metrics.record("ocr", 2.0, error=True)
+    with metrics.stage("jancodelookup") as span:
+        span.cache_hit()
+    metrics.inc("upstream_responses_total", upstream="openai", code=429)
+    metrics.inc("sheets_api_calls_total", method="append_rows")
+    metrics.inc("jan_lookup_total", tier="cache")
+    cache_put("4901234567894", 'テスト "商品"', None)
+    cache_get("4901234567894")
+    cache_get("0000000000000")
+    FrameIndex().lookup("check", 0, None)
+
+def parse(text):
+    samples, types, problems = defaultdict(list), {}, []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ", 3)
+            if name in types:
+                problems.append(f"TYPE重複: {name}")
+            types[name] = kind
+            continue
+        if not line or line.startswith("#"):
+            continue
+        m = _SAMPLE.match(line)
+        if m is None:
+            problems.append(f"形式不正: {line}")
+            continue
+        float(m.group(3).replace("+Inf", "inf"))
+        samples[m.group(1)].append((dict(_LABEL.findall(m.group(2) or "")), float(m.group(3).replace("+Inf", "inf"))))
+    return samples, types, problems
+
+def check_histogram(samples):
+    problems = []
+    buckets = defaultdict(list)
+    for labels, value in samples["my_shelf_stage_duration_seconds_bucket"]:
+        buckets[labels["stage"]].append((float(labels["le"].replace("+Inf", "inf")), value))
+    counts = {l["stage"]: v for l, v in samples["my_shelf_stage_duration_seconds_count"]}
+    for stage, series in buckets.items():
+        values = [v for _, v in sorted(series)]
+        if values != sorted(values):
+            problems.append(f"{stage}: バケットが単調増加でない")
+        if values[-1] != counts.get(stage):
+            problems.append(f"{stage}: +Inf と _count が不一致")
+    return problems
+
+def main():
+    drive()
+    server = start_http_exporter(0, "127.0.0.1")
+    url = f"http://127.0.0.1:{server.server_port}/metrics"
+    with urllib.request.urlopen(url, timeout=5) as res:
+        content_type = res.headers.get("Content-Type")
+        text = res.read().decode("utf-8")
+    server.shutdown()
+
+    samples, types, problems = parse(text)
+    if content_type != CONTENT_TYPE:
+        problems.append(f"Content-Type: {content_type}")
+    problems += [f"欠落: {name}" for name in EXPECTED if name not in samples]
+    problems += check_histogram(samples)
+    if not any(l.get("code") == "429" for l, _ in samples["my_shelf_upstream_responses_total"]):
+        problems.append("429 の応答数が出力されていない")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "my_shelf.prom")
+        write_textfile(path)
+        with open(path, encoding="utf-8") as f:
+            problems += [f"textfile: {p}" for p in parse(f.read())[2]]
+
+    try:
+        from prometheus_client.parser import text_string_to_metric_families
+        families = list(text_string_to_metric_families(text))
+        print(f"prometheus_client parser: {len(families)} families")
+    except ImportError:
+        pass
+
+    print(f"scraped {url}: {sum(len(v) for v in samples.values())} samples, {len(types)} families")
+    for p in problems:
+        print(" -", p)
+    print("PASS" if not problems else "FAIL")
+    sys.exit(0 if not problems else 1)
+
+if __name__ == "__main__":
+    main()
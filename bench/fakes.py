@@ -0,0 +1,330 @@
+# fakes
+# 🧪 上流サービスのローカルフェイク（OpenAI Chat Completions／JANCodeLookup／Google Sheets v4）
+#   遅延・エラー率・データ量を指定して別スレッドのHTTPサーバーとして起動する
+#   python bench/fakes.py --rows 10000 --latency 0.05   （単体起動して手動で叩く場合）
+
+import os, re, sys, json, time, random, hashlib, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synth import ean13_check
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+HIT_FIXTURE = os.path.join(FIXTURE_DIR, "jancodelookup_4901777018888.html")
+FIXTURE_CODE = "4901777018888"
+FIXTURE_TITLE = "サントリー 天然水 550ml ペットボトル"
+HEADER = ["コード", "商品名", "登録日", "画像URL"]
+
+
+def ean13(seed: int):
+    """seed から決まるチェックディジット付きEAN-13。"""
+    body = f"49{seed % 10**10:010d}"
+    return body + ean13_check(body)
+
+def code_for_image(data: bytes):
+    # 同じ画像には同じコードを返す
+    return ean13(int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big"))
+
+
+# ------------------------------------------------------------
+# 🎛️ 共通：遅延・エラー注入
+# ------------------------------------------------------------
+class FakeConfig:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=429, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """待ってから、エラーを返すならそのステータスを返す（なければNone）。"""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            fail = self._rng.random() < self.error_rate
+            self.errors += fail
+        if delay > 0:
+            time.sleep(delay)
+        return self.error_status if fail else None
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        body = self._body()
+        error = self.fake.config.admit()
+        if error is not None:
+            self._send(error, {"error": {"code": error, "message": "injected by fake", "status": "UNAVAILABLE"}})
+            return
+        try:
+            status, payload, content_type = self.fake.handle(method, self.path, body)
+        except Exception as e:
+            status, payload, content_type = 500, {"error": {"code": 500, "message": str(e)}}, "application/json"
+        self._send(status, payload, content_type)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 受信を途中で打ち切るクライアント（JANCodeLookupの早期終了）による切断は正常
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+class FakeServer:
+    """handle(method, path, body) -> (status, payload, content_type) を実装して使う。"""
+
+    def __init__(self, config=None):
+        self.config = config or FakeConfig()
+        self.server = None
+
+    def start(self, port=0, addr="127.0.0.1"):
+        handler = type(f"{type(self).__name__}Handler", (_Handler,), {"fake": self})
+        self.server = _QuietServer((addr, port), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ------------------------------------------------------------
+# 🤖 OpenAI Chat Completions
+# ------------------------------------------------------------
+_DATA_URL = re.compile(rb'"url":\s*"data:image/[a-z]+;base64,([A-Za-z0-9+/=]+)"')
+
+class FakeOpenAI(FakeServer):
+    """画像ごとに決まったEAN-13を返す。プロンプトから単体／バッチ／マルチを判別する。"""
+
+    def handle(self, method, path, body):
+        if method != "POST" or not path.startswith("/v1/chat/completions"):
+            return 404, {"error": {"message": "not found"}}, "application/json"
+        images = [m.group(1) for m in _DATA_URL.finditer(body)]
+        codes = [code_for_image(b) for b in images]
+        text = body.decode("utf-8", "replace")
+        if "JSON配列" in text:
+            content = json.dumps([{"code": c, "x": 0.5, "y": 0.5} for c in codes])
+        elif "JSON文字列配列" in text:
+            content = json.dumps(codes)
+        else:
+            content = codes[0] if codes else ""
+        return 200, {"choices": [{"message": {"role": "assistant", "content": content}}]}, "application/json"
+
+    @property
+    def chat_url(self):
+        return self.base_url + "/v1/chat/completions"
+
+
+# ------------------------------------------------------------
+# 🛒 JANCodeLookup
+# ------------------------------------------------------------
+class FakeJanLookup(FakeServer):
+    """保存済みフィクスチャを雛形に検索結果ページを返す。page_bytes でページの大きさを変える。miss_rate で未登録。"""
+
+    def __init__(self, config=None, page_bytes=None, miss_rate=0.0):
+        super().__init__(config)
+        with open(HIT_FIXTURE, encoding="utf-8") as f:
+            page = f.read()
+        head, tail = page.split("</body>", 1) if "</body>" in page else (page, "")
+        if page_bytes is not None:
+            # 結果ブロックより後ろの分量で調整（早期打ち切りが効くかも測れる）
+            pad = max(0, page_bytes - len(page.encode("utf-8")))
+            head += "<!-- " + "x" * pad + " -->"
+        self.template = head + "</body>" + tail
+        self.miss_rate = miss_rate
+        self._rng = random.Random(7)
+
+    def handle(self, method, path, body):
+        parts = urlsplit(path)
+        code = (parse_qs(parts.query).get("q") or [""])[0]
+        if method != "GET" or not parts.path.startswith("/search"):
+            return 404, b"not found", "text/html"
+        if not code or self._rng.random() < self.miss_rate:
+            page = self.template.split('<div class="search-result-item">', 1)[0] + "</body></html>"
+        else:
+            page = self.template.replace(FIXTURE_CODE, code).replace(FIXTURE_TITLE, f"テスト商品 {code}")
+        return 200, page.encode("utf-8"), "text/html; charset=utf-8"
+
+    @property
+    def search_url(self):
+        return self.base_url + "/search/?q={}"
+
+
+# ------------------------------------------------------------
+# 📗 Google Sheets API v4（gspreadが使う範囲だけ）
+# ------------------------------------------------------------
+_A1 = re.compile(r"^(?P<c0>[A-Z]*)(?P<r0>\d*)(?::(?P<c1>[A-Z]*)(?P<r1>\d*))?$")
+
+def _col_index(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+def sample_rows(rows, unnamed_every=10):
+    """ヘッダー＋rows行。unnamed_every 行ごとに商品名不明を混ぜる。"""
+    data = [list(HEADER)]
+    for i in range(rows):
+        code = ean13(i + 1)
+        name = "商品名不明" if unnamed_every and i % unnamed_every == 0 else f"テスト商品 {code}"
+        data.append([code, name, "2025-01-01 09:00:00", f"https://image.example/{code}.jpg"])
+    return data
+
+class FakeSheets(FakeServer):
+    """1シートのスプレッドシートをメモリ上に持ち、values の取得・一括取得・更新・追記・一括更新に応える。"""
+
+    TITLE = "Sheet1"
+
+    def __init__(self, config=None, rows=1000, values=None):
+        super().__init__(config)
+        self.values = values if values is not None else sample_rows(rows)
+        self._lock = threading.Lock()
+
+    def _range(self, a1):
+        a1 = unquote(a1)
+        if "!" in a1:
+            a1 = a1.split("!", 1)[1]
+        elif a1.strip("'") == self.TITLE:
+            a1 = ""
+        m = _A1.match(a1)
+        if m is None:
+            raise ValueError(f"bad range {a1}")
+        c0 = _col_index(m["c0"]) if m["c0"] else 1
+        r0 = int(m["r0"]) if m["r0"] else 1
+        if m["c1"] is None and m["r1"] is None:
+            # 単一セル、またはシート名だけ（全体）
+            if not m["c0"] and not m["r0"]:
+                return 1, 1, None, None
+            return r0, c0, r0, c0
+        c1 = _col_index(m["c1"]) if m["c1"] else None
+        r1 = int(m["r1"]) if m["r1"] else None
+        return r0, c0, r1, c1
+
+    def _get(self, a1):
+        r0, c0, r1, c1 = self._range(a1)
+        with self._lock:
+            rows = self.values[r0 - 1:r1]
+            out = [row[c0 - 1:c1] for row in rows]
+        while out and not any(out[-1]):
+            out.pop()
+        return {"range": f"{self.TITLE}!{a1}", "majorDimension": "ROWS", "values": out}
+
+    def _put(self, a1, values):
+        r0, c0, _, _ = self._range(a1)
+        with self._lock:
+            for i, row in enumerate(values):
+                while len(self.values) < r0 + i:
+                    self.values.append([])
+                target = self.values[r0 - 1 + i]
+                target.extend([""] * max(0, c0 - 1 + len(row) - len(target)))
+                target[c0 - 1:c0 - 1 + len(row)] = [str(v) for v in row]
+        return {"updatedRange": a1, "updatedRows": len(values),
+                "updatedCells": sum(len(r) for r in values)}
+
+    def _metadata(self, key):
+        with self._lock:
+            rows, cols = len(self.values), max(len(r) for r in self.values)
+        return {"spreadsheetId": key, "properties": {"title": "my_shelf (fake)", "locale": "ja_JP",
+                                                     "timeZone": "Asia/Tokyo"},
+                "sheets": [{"properties": {"sheetId": 0, "title": self.TITLE, "index": 0, "sheetType": "GRID",
+                                           "gridProperties": {"rowCount": max(rows, 1000), "columnCount": max(cols, 26)}}}]}
+
+    def handle(self, method, path, body):
+        parts = urlsplit(path)
+        m = re.match(r"^/v4/spreadsheets/([^/:]+)(.*)$", parts.path)
+        if m is None:
+            return 404, {"error": {"code": 404, "message": "not found"}}, "application/json"
+        key, rest = m.group(1), m.group(2)
+        payload = json.loads(body) if body else {}
+        if rest == "" and method == "GET":
+            return 200, self._metadata(key), "application/json"
+        if rest == "/values:batchUpdate":
+            responses = [self._put(d["range"], d["values"]) for d in payload.get("data", [])]
+            return 200, {"spreadsheetId": key, "responses": responses}, "application/json"
+        if rest == "/values:batchGet" and method == "GET":
+            ranges = parse_qs(parts.query).get("ranges", [])
+            return 200, {"spreadsheetId": key, "valueRanges": [self._get(a1) for a1 in ranges]}, "application/json"
+        if rest.startswith("/values/"):
+            a1 = rest[len("/values/"):]
+            if a1.endswith(":append"):
+                with self._lock:
+                    start = len(self.values) + 1
+                rows = payload.get("values", [])
+                self._put(f"A{start}", rows)
+                return 200, {"spreadsheetId": key, "updates": {"updatedRows": len(rows),
+                                                                "updatedRange": f"{self.TITLE}!A{start}"}}, "application/json"
+            if method == "GET":
+                return 200, self._get(a1), "application/json"
+            if method == "PUT":
+                return 200, self._put(a1, payload.get("values", [])), "application/json"
+        return 404, {"error": {"code": 404, "message": f"unsupported {method} {rest}"}}, "application/json"
+
+
+# ------------------------------------------------------------
+# 🚀 まとめて起動
+# ------------------------------------------------------------
+def start_all(latency=0.0, jitter=0.0, error_rate=0.0, rows=1000, page_bytes=None):
+    return {
+        "openai": FakeOpenAI(FakeConfig(latency, jitter, error_rate)).start(),
+        "jan": FakeJanLookup(FakeConfig(latency, jitter, error_rate), page_bytes=page_bytes).start(),
+        "sheets": FakeSheets(FakeConfig(latency, jitter, error_rate), rows=rows).start(),
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--latency", type=float, default=0.0)
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--page-bytes", type=int, default=None)
+    args = ap.parse_args()
+    fakes = start_all(args.latency, args.jitter, args.error_rate, args.rows, args.page_bytes)
+    print(f"MY_SHELF_OPENAI_URL={fakes['openai'].chat_url}")
+    print(f"MY_SHELF_JANCODELOOKUP_URL='{fakes['jan'].search_url}'")
+    print(f"MY_SHELF_SHEETS_URL={fakes['sheets'].base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# replay
+# 📼 カセット再生サーバー（記録済みの応答を記録時の遅延×倍率で返す／OpenAI・JANCodeLookup・Sheetsを1つで受ける）
+#   python bench/replay.py cassettes/shop.jsonl.gz [--latency-scale 1.0 | --latency 0.05]
+
+import os, sys, time, argparse, threading
+from collections import defaultdict
+from itertools import cycle
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_cassette import load_cassette, scrub_path, route_of, body_digest, decode_body
+from fakes import FakeServer
+
+
+class ReplayServer(FakeServer):
+    """同じ要求（メソッド・パス・本体ハッシュ）→ 同じパス → 数字を伏せた経路、の順に記録を探して返す。"""
+
+    def __init__(self, entries, latency_scale=1.0, latency=None):
+        super().__init__()
+        self.latency_scale = latency_scale
+        self.latency = latency
+        self.hits = defaultdict(int)
+        self.misses = []
+        indexes = (defaultdict(list), defaultdict(list), defaultdict(list))
+        for e in entries:
+            indexes[0][(e["method"], e["path"], e["req_sha"])].append(e)
+            indexes[1][(e["method"], e["path"])].append(e)
+            indexes[2][(e["method"], route_of(e["path"]))].append(e)
+        # 同じキーに複数の記録があれば順番に返す（決定的）
+        self._indexes = [{k: cycle(v) for k, v in index.items()} for index in indexes]
+        self._lock = threading.Lock()
+
+    def find(self, method, path, body):
+        path = scrub_path(path)
+        digest, _ = body_digest(body or None)
+        keys = ((method, path, digest), (method, path), (method, route_of(path)))
+        with self._lock:
+            for level, (index, key) in enumerate(zip(self._indexes, keys)):
+                if key in index:
+                    self.hits[("exact", "path", "route")[level]] += 1
+                    return next(index[key])
+            self.misses.append(f"{method} {path}")
+        return None
+
+    def handle(self, method, path, body):
+        entry = self.find(method, path, body)
+        if entry is None:
+            return 404, {"error": {"code": 404, "message": f"no cassette entry for {method} {path}"}}, "application/json"
+        delay = self.latency if self.latency is not None else entry["latency_ms"] / 1000 * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+        return entry["status"], decode_body(entry["response"]), entry["content_type"] or "application/octet-stream"
+
+    def env(self):
+        return {"MY_SHELF_OPENAI_URL": self.base_url + "/v1/chat/completions",
+                "MY_SHELF_JANCODELOOKUP_URL": self.base_url + "/search/?q={}",
+                "MY_SHELF_SHEETS_URL": self.base_url}
+
+def summarize(entries):
+    by_host = defaultdict(lambda: [0, 0])
+    for e in entries:
+        by_host[e["host"]][0] += 1
+        by_host[e["host"]][1] += len(decode_body(e["response"]))
+    return ", ".join(f"{host}: {n} req / {size / 1024:.0f}KB" for host, (n, size) in sorted(by_host.items()))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("cassette")
+    ap.add_argument("--port", type=int, default=0)
+    ap.add_argument("--latency-scale", type=float, default=1.0, help="記録時の遅延に掛ける倍率（0で待たない）")
+    ap.add_argument("--latency", type=float, default=None, help="記録を無視して固定遅延（秒）")
+    args = ap.parse_args()
+    entries = load_cassette(args.cassette)
+    server = ReplayServer(entries, args.latency_scale, args.latency).start(args.port)
+    print(f"# {len(entries)} entries ({summarize(entries)})", file=sys.stderr)
+    for key, value in server.env().items():
+        print(f"{key}='{value}'" if "{" in value else f"{key}={value}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"# hits {dict(server.hits)}, misses {len(server.misses)}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
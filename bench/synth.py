@@ -0,0 +1,99 @@
+# synth
+# 🧪 ベンチ用の合成バーコード画像（EAN-13を雑多な背景に配置）
+
+import io
+import numpy as np
+from PIL import Image, ImageDraw
+
+_L = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+_G = ["0100111", "0110011", "0011011", "0100001", "0011101", "0111001", "0000101", "0010001", "0001001", "0010111"]
+_R = ["1110010", "1100110", "1101100", "1000010", "1011100", "1001110", "1010000", "1000100", "1001000", "1110100"]
+_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+
+def ean13_check(body12: str):
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(body12))
+    return str((10 - total % 10) % 10)
+
+def random_ean13(rng):
+    body = "49" + "".join(str(rng.randrange(10)) for _ in range(10))
+    return body + ean13_check(body)
+
+def ean13_modules(code: str):
+    parity = _PARITY[int(code[0])]
+    bits = "101"
+    for d, p in zip(code[1:7], parity):
+        bits += (_L if p == "L" else _G)[int(d)]
+    bits += "01010"
+    for d in code[7:]:
+        bits += _R[int(d)]
+    return bits + "101"
+
+def code128_modules(text: str):
+    """Code128 B（数字4桁以上の連続はC）でモジュール列を作る。"""
+    from shelf_decode import CODE128_PATTERNS
+    values, i = [], 0
+    use_c = text.isdigit() and len(text) % 2 == 0 and len(text) >= 4
+    if use_c:
+        values.append(105)
+        values += [int(text[k:k + 2]) for k in range(0, len(text), 2)]
+    else:
+        values.append(104)
+        values += [ord(ch) - 32 for ch in text]
+    values.append((values[0] + sum(k * v for k, v in enumerate(values[1:], 1))) % 103)
+    values.append(106)
+    bits = ""
+    for v in values:
+        for n, w in enumerate(CODE128_PATTERNS[v]):
+            bits += ("1" if n % 2 == 0 else "0") * int(w)
+    return bits
+
+def random_asset_label(rng):
+    return "AS-" + "".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(rng.randrange(5, 9)))
+
+def render_barcode(bits: str, module=3, height=120, quiet=10, digits=None):
+    """モジュール列を白地の黒バーに描画（下に数字の代わりの細い帯）。"""
+    width = (len(bits) + 2 * quiet) * module
+    text_h = height // 4 if digits else 0
+    arr = np.full((height + text_h, width), 255, np.uint8)
+    for i, b in enumerate(bits):
+        if b == "1":
+            x = (quiet + i) * module
+            arr[:height, x:x + module] = 0
+    img = Image.fromarray(arr)
+    if digits:
+        ImageDraw.Draw(img).text((quiet * module, height + 2), " ".join(digits), fill=0)
+    return img
+
+def shelf_scene(rng, size=(1280, 960), rotate=False, symbology="ean13"):
+    """雑多な背景にバーコード1つを置いた画像と、その正解枠 (x0, y0, x1, y1) を返す。"""
+    w, h = size
+    nprng = np.random.default_rng(rng.randrange(1 << 30))
+    bg = nprng.normal(150, 25, (h // 8, w // 8, 3)).clip(0, 255).astype(np.uint8)
+    img = Image.fromarray(bg).resize(size, Image.BILINEAR)
+    draw = ImageDraw.Draw(img)
+    for _ in range(25):
+        x, y = rng.randrange(w), rng.randrange(h)
+        draw.rectangle([x, y, x + rng.randrange(20, 200), y + rng.randrange(10, 120)],
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    for _ in range(12):
+        x, y = rng.randrange(w - 100), rng.randrange(h - 20)
+        draw.text((x, y), "SALE ABC 123 NEW", fill=(0, 0, 0))
+    if symbology == "code128":
+        code = random_asset_label(rng)
+        bits = code128_modules(code)
+    else:
+        code = random_ean13(rng)
+        bits = ean13_modules(code)
+    barcode = render_barcode(bits, module=rng.choice([2, 3, 4]), height=rng.randrange(80, 180), digits=code)
+    if rotate:
+        barcode = barcode.rotate(90, expand=True)
+    bx = rng.randrange(0, max(1, w - barcode.width))
+    by = rng.randrange(0, max(1, h - barcode.height))
+    img.paste(barcode.convert("RGB"), (bx, by))
+    return img, (bx, by, bx + barcode.width, by + barcode.height), code
+
+def to_jpeg(img, quality=90):
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
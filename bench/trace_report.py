@@ -0,0 +1,72 @@
+# trace_report
+# 🧵 トレースログの集計（処理時間の長いスキャンを上から並べ、区間ごとの内訳を出す）
+#   python bench/trace_report.py [--log .traces/spans.jsonl] [--top 10] [--since 24] [--trace ID] [--stage ocr]
+
+import os, sys, time, argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shelf_trace import TRACE_LOG, read_spans, group_traces, busy_ms
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] if samples else None
+
+def fmt_span(s):
+    extra = "".join([f" {s['tier']}" if s.get("tier") else "",
+                     f" {s['bytes'] / 1024:.0f}KB" if s.get("bytes") else "",
+                     " ERROR" if s["outcome"] == "error" else ""])
+    return f"{s['span']} {s['ms']:.0f}ms{extra}"
+
+def stage_table(spans):
+    by_stage = defaultdict(list)
+    errors = defaultdict(int)
+    for s in spans:
+        # キャッシュ等で済んだ区間は別の行にする（0msが混ざると本来の分布が見えない）
+        key = s["span"] + (f"[{s['tier']}]" if s.get("tier") else "")
+        by_stage[key].append(s["ms"])
+        errors[key] += s["outcome"] == "error"
+    print(f"{'stage':<22}{'n':>7}{'err':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, samples in sorted(by_stage.items(), key=lambda kv: -percentile(kv[1], 95)):
+        print(f"{name:<22}{len(samples):>7}{errors[name]:>6}{percentile(samples, 50):>9.0f}"
+              f"{percentile(samples, 95):>9.0f}{percentile(samples, 99):>9.0f}{max(samples):>9.0f}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--log", default=TRACE_LOG)
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--since", type=float, default=None, help="直近何時間ぶんを見るか")
+    ap.add_argument("--trace", help="このトレースIDの区間をすべて表示")
+    ap.add_argument("--stage", help="この区間を含むトレースだけに絞る")
+    args = ap.parse_args()
+
+    spans = list(read_spans(args.log))
+    if args.since is not None:
+        cutoff = time.time() - args.since * 3600
+        spans = [s for s in spans if s["start"] >= cutoff]
+    if args.trace:
+        spans = [s for s in spans if s["trace"].startswith(args.trace)]
+    if not spans:
+        print(f"no spans in {args.log}")
+        return
+    traces = group_traces(spans)
+    if args.stage:
+        traces = [t for t in traces if any(s["span"] == args.stage for s in t["spans"])]
+
+    print(f"{len(spans)} spans / {len(traces)} traces "
+          f"({time.strftime('%Y-%m-%d %H:%M', time.localtime(min(s['start'] for s in spans)))} 〜)")
+    stage_table(spans)
+    print()
+    # 再実行の間（店員の操作待ち）を含まない、区間の合計時間で並べる
+    print(f"slowest {min(args.top, len(traces))} traces (sum of top-level span time):")
+    for t in sorted(traces, key=busy_ms, reverse=True)[:args.top]:
+        started = time.strftime("%m-%d %H:%M:%S", time.localtime(t["start"]))
+        print(f"  {t['trace']}  {busy_ms(t):>7.0f}ms  {started}  {len(t['spans'])} spans"
+              + (f", {t['errors']} errors" if t["errors"] else ""))
+        for s in t["spans"]:
+            # 入れ子の区間（sheet_search の中の sheet_read 等）は字下げして出す
+            print(f"      +{(s['start'] - t['start']) * 1000:>7.0f}ms  {'  ' * s.get('depth', 0)}{fmt_span(s)}")
+
+if __name__ == "__main__":
+    main()
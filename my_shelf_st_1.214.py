@@ -6,15 +6,44 @@ import streamlit as st
 st.set_page_config(page_title="my_shelf v1.214", layout="wide")
 st.title("📦 my_shelf v1.214（JST対応＋通信安定化版）")
 
-from PIL import Image
-import io, base64, re, unicodedata, requests, os, json
-from bs4 import BeautifulSoup
+import re, os, time, hashlib
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta, timezone
 import pandas as pd
-from io import BytesIO
 from dotenv import load_dotenv
+from shelf_codes import normalize_code, is_valid_code
+from shelf_ocr import (build_prompt, build_multi_prompt, parse_multi_codes, build_body, post_chat,
+                       breaker_status, hedge, get_batcher, Deadline, SCAN_DEADLINE, MULTI_MAX_TOKENS, BATCH_DEADLINE,
+                       CircuitOpenError, DeadlineExceeded, OcrHttpError)
+from shelf_vision import make_thumbnail, frame_hash, frame_key, FrameIndex, HASH_MAX_DISTANCE
+from shelf_pipeline import preprocess, get_pipeline
+from shelf_imagecache import get_image_cache
+from shelf_metrics import metrics
+from shelf_exporter import start_from_env as start_metrics_exporter
+from shelf_cassette import start_recording_from_env as start_cassette_recording
+import shelf_profile
+import shelf_trace
+from shelf_budget import session_budget
+from shelf_snapshot import get_snapshot
+from shelf_lookup import lookup_jan_polite, bulk_lookup
+import shelf_sheets
+from shelf_sheets import SHEET_KEY
+
+# ------------------------------------------------------------
+# 🔥 再実行プロファイル（?profile=1 / MY_SHELF_PROFILE=1 のときだけ、この再実行全体を採取）
+# ------------------------------------------------------------
+_unfinished = st.session_state.pop("_profiler", None)
+if _unfinished is not None:
+    # 前回の再実行が最後まで届かなかった（st.stop・途中での再実行）
+    _unfinished.stop(interrupted=True)
+if shelf_profile.enabled(st.query_params):
+    st.session_state["_profiler"] = shelf_profile.RerunSampler("rerun", root_file=__file__).start()
+
+# Prometheus形式のメトリクス公開（MY_SHELF_METRICS_PORT / MY_SHELF_METRICS_TEXTFILE 設定時のみ）
+start_metrics_exporter()
+# 性能試験用に実通信を記録（MY_SHELF_CASSETTE_RECORD 設定時のみ・秘密情報は除去）
+start_cassette_recording()
 
 # ------------------------------------------------------------
 # 🔐 APIキー（Secrets / .env 両対応）
@@ -31,6 +60,9 @@ if not api_key:
     st.error("❌ OpenAI APIキーが見つかりません。Secretsまたは.envを確認してください。")
     st.stop()
 
+# 読み取り結果・一括取得結果・Excelはセッション毎の上限つき置き場へ（超えたら古い順に追い出す）
+budget = session_budget(st.session_state)
+
 # ------------------------------------------------------------
 # 🕒 JST時刻関数
 # ------------------------------------------------------------
@@ -39,73 +71,128 @@ def now_jst_str():
     return datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S")
 
 # ------------------------------------------------------------
-# 🧮 正規化関数
+# 🤖 OCR（HTTP直呼び出し方式＋再試行・締切・ブレーカー）
 # ------------------------------------------------------------
-def normalize_code(s: str, allow_alnum=False, uppercase=True):
-    if not s:
-        return ""
-    s = unicodedata.normalize("NFKC", s)
-    s = re.sub(r"[\u200B-\u200D\uFEFF\s\n\r\t]+", "", s)
-    if allow_alnum:
-        s = re.sub(r"[^A-Za-z0-9]", "", s)
-        if uppercase:
-            s = s.upper()
-    else:
-        s = re.sub(r"\D", "", s)
-    return s
+def preprocess_image(image_bytes: bytes, allow_alnum=False, auto_crop=True):
+    # 1回のデコードでCode128ローカル復号・バーコード切り出しを済ませる
+    try:
+        with metrics.stage("preprocess") as span:
+            span.add_bytes(len(image_bytes))
+            return preprocess(image_bytes, allow_alnum, auto_crop)
+    except Exception as e:
+        st.warning(f"⚠️ 画像前処理をスキップしました: {e}")
+        return {"local_code": "", "ocr_bytes": image_bytes, "box": None}
 
-# ------------------------------------------------------------
-# 🤖 OCR（HTTP直呼び出し方式）
-# ------------------------------------------------------------
-def analyze_code_with_openai(image_bytes: bytes, allow_alnum=False):
+def image_digest(image_bytes: bytes):
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def preprocess_cached(digest: str, _image_bytes: bytes, allow_alnum=False, auto_crop=True):
+    # 再実行のたびに全画素をデコードし直さないよう画像ハッシュ単位でキャッシュ（元画像はキャッシュに持たない）
+    # 失敗は例外のまま返す（st.cache_data は例外をキャッシュしないので、同じ画像でも次はやり直せる）
+    with metrics.stage("preprocess") as span:
+        span.add_bytes(len(_image_bytes))
+        return preprocess(_image_bytes, allow_alnum, auto_crop, keep_original=False)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def frame_key_cached(digest: str, _image_bytes: bytes):
+    # 縮小デコードだけで求まる (dHash, バー幅署名)。近似フレームならこれだけで済む
     try:
-        image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-        directive = "数字のみを半角で返してください。" if not allow_alnum else "英数字のみを半角で返してください。"
-        prompt = f"この画像の中央付近に印字されたコードを読み取り、{directive}説明や余計な文字は不要です。"
-
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {"role": "system", "content": "あなたはバーコードや印字コードを正確に読むOCRアシスタントです。"},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}}
-                    ]
-                }
-            ],
-            "max_tokens": 50
-        }
-
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=60
-        )
-
-        if response.status_code != 200:
-            st.error(f"OCR APIエラー: {response.status_code} {response.text}")
-            return ""
-
-        result = response.json()
-        raw = result["choices"][0]["message"]["content"].strip()
-        return normalize_code(raw, allow_alnum)
+        return frame_key(_image_bytes)
+    except Exception:
+        return None, None
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def preview_thumbnail(digest: str, _image_bytes: bytes):
+    # 画像ハッシュ単位でキャッシュ（_image_bytes はキャッシュキーに含めない）
+    return make_thumbnail(_image_bytes)
 
+def _post_ocr(image_bytes: bytes, prompt: str, hedged=False, max_tokens=50):
+    try:
+        body = build_body(image_bytes, prompt, max_tokens=max_tokens)
+        with metrics.stage("ocr") as span:
+            span.add_bytes(len(body))
+            return post_chat(body, api_key, deadline=Deadline(SCAN_DEADLINE), hedged=hedged)
+
+    except CircuitOpenError as e:
+        # API劣化中は即時に手入力へ誘導
+        st.warning(f"⚡ {e}。下の入力欄にコードを手入力してください。")
+        return ""
+    except DeadlineExceeded as e:
+        st.warning(f"⏱️ {e}。コードを手入力してください。")
+        return ""
+    except OcrHttpError as e:
+        st.error(f"OCR APIエラー: {e}")
+        return ""
     except Exception as e:
         st.error(f"OCR処理中にエラー: {e}")
         return ""
 
+def analyze_code_with_openai(image_bytes: bytes, allow_alnum=False, hedged=False):
+    raw = _post_ocr(image_bytes, build_prompt(allow_alnum), hedged)
+    return normalize_code(raw, allow_alnum)
+
+def analyze_codes_with_openai(image_bytes: bytes, allow_alnum=False, hedged=False):
+    # 棚写真1枚から全コードを位置つきで返す（正規化・重複除外・検証済み）
+    raw = _post_ocr(image_bytes, build_multi_prompt(allow_alnum), hedged, max_tokens=MULTI_MAX_TOKENS)
+    found, seen = [], set()
+    for item in parse_multi_codes(raw):
+        code = normalize_code(item["code"], allow_alnum)
+        if not code or code in seen:
+            continue
+        seen.add(code)
+        found.append({"コード": code, "有効": is_valid_code(code, allow_alnum), "x": item["x"], "y": item["y"]})
+    # 棚の並び順（上段→下段、左→右）
+    found.sort(key=lambda r: (round((r["y"] if r["y"] is not None else 1.0) * 5), r["x"] or 0.0))
+    return found
+
+def analyze_codes_batched(files, allow_alnum=False, auto_crop=True):
+    # 複数画像をバッチャーに投入し、まとめて1リクエストで解析（画像順で返す）
+    batcher = get_batcher(api_key, allow_alnum)
+    images = [f.getvalue() for f in files]
+    try:
+        # CPUの重い前処理は枚数が多ければプロセスプールで並列化
+        with metrics.stage("preprocess_batch"):
+            preps = get_pipeline().map(images, allow_alnum, auto_crop)
+    except Exception as e:
+        st.warning(f"⚠️ 並列前処理に失敗したため逐次処理します: {e}")
+        preps = [preprocess_image(b, allow_alnum, auto_crop) for b in images]
+    futures = []
+    for f, prep in zip(files, preps):
+        local = normalize_code(prep["local_code"], allow_alnum=True)
+        futures.append((f.name, local or batcher.submit(prep["ocr_bytes"])))
+    rows, errors = [], set()
+    for name, fut in futures:
+        if isinstance(fut, str):
+            metrics.hit("ocr_batch", tier="local")
+            rows.append({"画像": name, "コード": fut, "有効": is_valid_code(fut, allow_alnum), "x": None, "y": None})
+            continue
+        try:
+            with metrics.stage("ocr_batch"):
+                code = normalize_code(fut.result(timeout=BATCH_DEADLINE * 2), allow_alnum)
+        except Exception as e:
+            code = ""
+            errors.add(f"{type(e).__name__}: {e}")
+        rows.append({"画像": name, "コード": code, "有効": is_valid_code(code, allow_alnum), "x": None, "y": None})
+    for err in errors:
+        st.warning(f"⚠️ バッチOCRエラー: {err}")
+    return rows
+
 # ------------------------------------------------------------
 # 🔐 Google Sheets 認証
 # ------------------------------------------------------------
 def _authorize_gspread():
+    with metrics.stage("sheets_auth") as span:
+        client = _authorize_gspread_inner()
+        if client is None:
+            span.fail()
+        return client
+
+def _authorize_gspread_inner():
+    # MY_SHELF_SHEETS_URL が設定されていればそちら（ローカルのフェイク等）へ接続
+    local = shelf_sheets.endpoint_client()
+    if local is not None:
+        return local
     try:
         if "gcp_service_account" in st.secrets:
             from gspread import service_account_from_dict
@@ -123,6 +210,30 @@ def _authorize_gspread():
         st.error(f"❌ GSheet認証エラー: {e}")
         return None
 
+def _open_sheet():
+    gs_client = _authorize_gspread()
+    if gs_client is None:
+        return None
+    return shelf_sheets.open_sheet(gs_client)
+
+# ------------------------------------------------------------
+# 🖼️ 商品画像（サーバー側で取得・サムネイル化してローカルキャッシュから表示）
+# ------------------------------------------------------------
+def show_product_image(url, caption):
+    cache = get_image_cache()
+    with metrics.stage("image_proxy") as span:
+        if cache.cached(str(url)):
+            span.cache_hit()
+        data = cache.get(str(url))
+        if data:
+            span.add_bytes(len(data))
+        else:
+            span.fail()
+    if data:
+        st.image(data, width=200, caption=caption)
+    else:
+        st.caption(f"🖼️ {caption}を取得できませんでした。")
+
 # ------------------------------------------------------------
 # 🛒 JANCodeLookup（verify=Falseで安定化）
 # ------------------------------------------------------------
@@ -132,22 +243,21 @@ def get_product_info(raw_code: str):
         if not jan_query:
             st.warning("⚠️ クエリが空です。コードを入力してください。")
             return None, None
-        url = f"https://www.jancodelookup.com/search/?q={jan_query}"
-        headers = {"User-Agent": "Mozilla/5.0"}
-        # ✅ Cloud側のSSL検証を無効化して通信安定化
-        res = requests.get(url, headers=headers, timeout=10, verify=False)
-        if res.status_code == 200:
-            soup = BeautifulSoup(res.text, "html.parser")
-            name_tag = soup.select_one("div.search-result-item p")
-            title = name_tag.get_text(strip=True) if name_tag else "商品名不明"
-            img_tag = soup.select_one("div.search-result-item img.image")
-            image_url = img_tag["src"] if img_tag and img_tag.has_attr("src") else None
+        # ✅ Cloud側のSSL検証を無効化して通信安定化／先頭の結果ブロック受信で打ち切り
+        with metrics.stage("jancodelookup") as span:
+            status, title, image_url, source = lookup_jan_polite(jan_query, retries=1, timeout=10, verify=False, span=span)
+            span.tier = source
+            if source == "cache":
+                span.cache_hit()
+            if status != 200:
+                span.fail()
+        if status == 200:
             st.success(f"🟢 JANCodeLookupヒット: {title}")
             if image_url:
-                st.image(image_url, width=200, caption="取得された商品画像")
+                show_product_image(image_url, "取得された商品画像")
             return title, image_url
         else:
-            st.warning(f"⚠️ HTTPエラー: {res.status_code}")
+            st.warning(f"⚠️ HTTPエラー: {status}")
             return None, None
     except Exception as e:
         st.error(f"商品情報取得中にエラー: {e}")
@@ -157,21 +267,22 @@ def get_product_info(raw_code: str):
 # 🔍 Google Sheets 検索／登録（JST時刻で記録）
 # ------------------------------------------------------------
 def search_gsheet(code_to_find):
+    snapshot = get_snapshot(SHEET_KEY)
+    if snapshot.fresh() and snapshot.absent(code_to_find):
+        # 同期済みのローカル索引で「確実に未登録」と分かればシートを読まない
+        metrics.hit("sheet_search", tier="bloom")
+        st.warning("⚠️ Google Sheetsに一致データなし（ローカル索引で確認）。")
+        return None, None
     try:
-        gs_client = _authorize_gspread()
-        if gs_client is None:
+        sheet = _open_sheet()
+        if sheet is None:
             return None, None
-        sheet = gs_client.open_by_key("1lIDwaGMx-bMUXsLsF4p9_KmaXCyDPZIVeIdBen6ebE0").sheet1
-        df = pd.DataFrame(sheet.get_all_records())
-        left = df.iloc[:, 0].astype(str).str.lstrip("0")
-        right = str(code_to_find).lstrip("0")
-        hit = df[left == right]
-        if not hit.empty:
-            name = hit.iloc[0]["商品名"] if "商品名" in hit.columns else hit.iloc[0, 1]
-            img_url = hit.iloc[0]["画像URL"] if "画像URL" in hit.columns else None
+        with metrics.stage("sheet_search"):
+            name, img_url = shelf_sheets.search(sheet, code_to_find, snapshot)
+        if name is not None:
             st.success(f"🟣 Google Sheetsヒット: {name}")
             if img_url:
-                st.image(img_url, width=200, caption="GS登録画像")
+                show_product_image(img_url, "GS登録画像")
             return name, img_url
         else:
             st.warning("⚠️ Google Sheetsに一致データなし。")
@@ -182,100 +293,409 @@ def search_gsheet(code_to_find):
 
 def append_to_gsheet(code_to_save, product_name, img_url):
     try:
-        gs_client = _authorize_gspread()
-        if gs_client is None:
+        sheet = _open_sheet()
+        if sheet is None:
             return
-        sheet = gs_client.open_by_key("1lIDwaGMx-bMUXsLsF4p9_KmaXCyDPZIVeIdBen6ebE0").sheet1
-        header = sheet.row_values(1)
-        col_map = {name: idx + 1 for idx, name in enumerate(header)}
-        next_row = len(sheet.get_all_values()) + 1
-        if "コード" in col_map:
-            sheet.update_cell(next_row, col_map["コード"], code_to_save)
-        if "商品名" in col_map:
-            sheet.update_cell(next_row, col_map["商品名"], product_name)
-        if "登録日" in col_map:
-            sheet.update_cell(next_row, col_map["登録日"], now_jst_str())
-        if "画像URL" in col_map:
-            sheet.update_cell(next_row, col_map["画像URL"], img_url or "")
+        shelf_sheets.append_one(sheet, code_to_save, product_name, img_url, now_jst_str(), get_snapshot(SHEET_KEY))
         st.success("✅ Google Sheetsに登録しました。")
     except Exception as e:
         st.error(f"GS登録中にエラー: {e}")
 
+def append_many_to_gsheet(items):
+    # (コード, 商品名, 画像URL) の列を append_rows 1回で登録
+    try:
+        sheet = _open_sheet()
+        if sheet is None:
+            return
+        count = shelf_sheets.append_many(sheet, items, now_jst_str(), get_snapshot(SHEET_KEY))
+        st.success(f"✅ Google Sheetsに{count}件登録しました。")
+    except Exception as e:
+        st.error(f"GS一括登録中にエラー: {e}")
+
+def add_quantities_to_gsheet(items):
+    # tally() でまとめた (コード, 商品名, 画像URL, 個数) を、登録済みは数量セルの書き換え・未登録は追記で反映
+    try:
+        sheet = _open_sheet()
+        if sheet is None:
+            return False
+        updated, added = shelf_sheets.add_quantities(sheet, items, now_jst_str(), get_snapshot(SHEET_KEY))
+        st.success(f"✅ 数量を加算 {updated} 件・新規登録 {added} 件（計 {sum(item[3] for item in items)} 個）")
+        return True
+    except Exception as e:
+        st.error(f"GS数量登録中にエラー: {e}")
+        return False
+
+# ------------------------------------------------------------
+# 🧵 トレースID（同じ画像・同じコードを扱う間は、再実行をまたいで同じIDでOCR→取得→登録を追える）
+# ------------------------------------------------------------
+def scan_trace(digest=None, code=None):
+    s = st.session_state
+    if digest is not None and s.get("trace_digest") != digest:
+        s["trace_id"], s["trace_digest"], s["trace_code"] = shelf_trace.new_id(), digest, None
+    elif code and s.get("trace_code") not in (None, code):
+        # 別のコードに打ち替えたら別のスキャン
+        s["trace_id"], s["trace_digest"], s["trace_code"] = shelf_trace.new_id(), None, code
+    if code:
+        s["trace_code"] = code
+    return s.setdefault("trace_id", shelf_trace.new_id())
+
 # ------------------------------------------------------------
 # 🧠 OCR + 検索UI
 # ------------------------------------------------------------
-input_mode = st.radio("入力方法を選択", ["📷 カメラで撮影", "📁 ファイルアップロード"], horizontal=True)
+input_mode = st.radio("入力方法を選択", ["📷 カメラで撮影", "📁 ファイルアップロード", "🗂️ まとめてアップロード（バッチ）"],
+                      horizontal=True)
 allow_alnum = st.toggle("英数字もOCRで拾う（Code128対応）", value=False)
+multi_mode = st.toggle("📚 棚まとめ読み（1枚の写真から全コードを読む）", value=False)
+auto_crop = st.toggle("✂️ バーコード部分を自動で切り出してからOCR", value=True)
+
+ocr_status = breaker_status()
+breaker_icon = {"closed": "🟢", "half_open": "🟡", "open": "🔴"}[ocr_status["state"]]
+st.sidebar.caption(
+    f"{breaker_icon} OCRブレーカー: {ocr_status['state']}"
+    + (f"（{ocr_status['retry_in']}秒後に再開）" if ocr_status["state"] == "open" else "")
+    + f"｜呼出 {ocr_status['calls']}・再試行 {ocr_status['retries']}・失敗 {ocr_status['failures']}・遮断 {ocr_status['rejected']}"
+)
+hedge_ocr = st.sidebar.toggle("OCRヘッジ送信（遅延時に2本目を送る）", value=False)
+if hedge_ocr:
+    hedge_status = hedge.status()
+    st.sidebar.caption(
+        f"🪁 閾値 {hedge_status['threshold']}秒（p{hedge.percentile}）｜ヘッジ率 {hedge_status['hedge_rate']:.1%}"
+        f"（{hedge_status['hedges']}/{hedge_status['primaries']}）・ヘッジ勝ち {hedge_status['hedge_wins']}"
+        f"・負けて放置 {hedge_status['abandoned']}（実行中 {hedge_status['abandoned_running']}）"
+    )
+dedupe_distance = st.sidebar.slider("近似フレーム判定（ハミング距離、-1で無効）", -1, 16, HASH_MAX_DISTANCE,
+                                    help="撮り直した同じ商品はOCRせず前回の結果を再利用します"
+                                         "（バーの幅まで一致したときだけ。棚まとめ読みは同じ画像のみ）。")
+# 別セッションの商品の結果を返さないよう、索引はセッション毎
+frame_index = st.session_state.setdefault("_frame_index", FrameIndex())
+st.sidebar.caption(f"♻️ 近似フレーム再利用 {frame_index.hits} 回／新規 {frame_index.misses} 回")
 
 image_bytes = None
+image_file = None
 if input_mode == "📷 カメラで撮影":
     image_file = st.camera_input("バーコードを撮影してください")
-else:
+elif input_mode == "📁 ファイルアップロード":
     image_file = st.file_uploader("画像をアップロード", type=["jpg", "jpeg", "png"])
+else:
+    batch_files = st.file_uploader("画像をまとめてアップロード", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
+    if batch_files and st.button(f"🧩 {len(batch_files)} 枚をまとめてOCR", use_container_width=True):
+        with shelf_trace.use(shelf_trace.new_id()), st.spinner("🔍 バッチOCR解析中..."):
+            batch_codes = analyze_codes_batched(batch_files, allow_alnum, auto_crop)
+        budget.put("multi_codes", batch_codes)
+        valid = sum(r["有効"] for r in batch_codes)
+        st.success(f"🧩 {len(batch_codes)} 枚を解析（有効 {valid} 件）— ④「📚 まとめ読みの結果」で一括取得・登録できます。")
+        st.dataframe(pd.DataFrame(batch_codes), use_container_width=True)
+    batcher_status = get_batcher(api_key, allow_alnum).status()
+    st.caption(f"🧩 バッチ {batcher_status['batches']} 回／画像 {batcher_status['images']} 枚"
+               f"（平均 {batcher_status['avg_batch']} 枚/回・現在の上限 {batcher_status['batch_size']} 枚）")
 
 if image_file is not None:
     try:
         image_bytes = image_file.getvalue()
         if image_bytes:
-            st.image(Image.open(io.BytesIO(image_bytes)), caption="読み取り対象", use_column_width=True)
+            st.image(preview_thumbnail(image_digest(image_bytes), image_bytes), caption="読み取り対象", use_column_width=True)
         else:
             st.warning("⚠️ 画像が空のためプレビューをスキップしました。")
     except Exception as e:
         st.error(f"画像の読み込み中にエラー: {e}")
 
-if image_bytes:
-    with st.spinner("🔍 OCR解析中..."):
-        ai_code = analyze_code_with_openai(image_bytes, allow_alnum)
+def reuse_ocr(h, signature, namespace, run):
+    # 知覚ハッシュが近く署名も一致する過去フレームがあればその結果を使い、なければrun()してから登録
+    if h is None or dedupe_distance < 0:
+        return run()
+    cached, distance = frame_index.lookup(namespace, h, signature, dedupe_distance)
+    if cached is not None:
+        metrics.hit("ocr", tier="frame")
+        st.caption(f"♻️ 近似フレーム（距離 {distance}）の結果を再利用しました。")
+        return cached
+    result = run()
+    if result:
+        frame_index.put(namespace, h, signature, result)
+    return result
+
+if image_bytes and multi_mode:
+    try:
+        shelf_hash = frame_hash(image_bytes)
+    except Exception:
+        shelf_hash = None
+    with shelf_trace.use(scan_trace(digest=image_digest(image_bytes))), st.spinner("🔍 OCR解析中（全コード）..."):
+        # 棚写真はバーが多すぎて署名にならないので、同じ画像（バイト列一致）のときだけ再利用
+        multi_codes = reuse_ocr(shelf_hash, image_digest(image_bytes), ("multi", allow_alnum),
+                                lambda: analyze_codes_with_openai(image_bytes, allow_alnum, hedged=hedge_ocr))
+    if multi_codes:
+        budget.put("multi_codes", multi_codes)
+        valid = sum(r["有効"] for r in multi_codes)
+        st.success(f"📚 {len(multi_codes)} 件検出（有効 {valid} 件）— ④「📚 まとめ読みの結果」で一括取得・登録できます。")
+        st.dataframe(pd.DataFrame(multi_codes), use_container_width=True)
+elif image_bytes:
+    digest = image_digest(image_bytes)
+    trace_id = scan_trace(digest=digest)
+    frame_h, frame_signature = frame_key_cached(digest, image_bytes)
+
+    def _single_ocr():
+        # 全画素のデコードは近似フレームが無いときだけ
+        try:
+            prep = preprocess_cached(digest, image_bytes, allow_alnum, auto_crop)
+        except Exception as e:
+            st.warning(f"⚠️ 画像前処理をスキップしました: {e}")
+            prep = {"local_code": "", "ocr_bytes": None, "box": None}
+        ocr_bytes = prep["ocr_bytes"] or image_bytes
+        # 英数字モードではCode128をローカルで先に読む（読めればAPIを呼ばない）
+        local_code = normalize_code(prep["local_code"], allow_alnum=True)
+        if local_code:
+            metrics.hit("ocr", tier="local")
+            st.caption("🔢 Code128をローカルで読み取りました（OCR API不使用）")
+            return local_code
+        if prep["box"] is not None:
+            st.image(ocr_bytes, width=320, caption=f"✂️ 切り出し領域 {prep['box']}"
+                     f"（{len(ocr_bytes) // 1024}KB / 元 {len(image_bytes) // 1024}KB）")
+        return analyze_code_with_openai(ocr_bytes, allow_alnum, hedged=hedge_ocr)
+    with shelf_trace.use(trace_id), st.spinner("🔍 OCR解析中..."):
+        # バーを読めないフレームも、同じ画像の再実行ならバイト列一致で再利用
+        ai_code = reuse_ocr(frame_h, digest if frame_signature is None else frame_signature,
+                            ("single", allow_alnum), _single_ocr)
     if ai_code:
         st.success(f"📖 認識コード: {ai_code}")
-        st.session_state["ai_code"] = ai_code
+        # 入力欄へ入れるのは新しい画像（か読み直した結果）のときだけ。候補から選んだコードを再実行で上書きしない
+        if st.session_state.get("ocr_applied") != (digest, ai_code):
+            st.session_state["ocr_applied"] = (digest, ai_code)
+            st.session_state["ai_code"] = ai_code
+        scan_trace(code=ai_code)
 
 st.subheader("① コード確認")
-jan_input = st.text_input("コード入力（OCR結果を上書き可）", value=st.session_state.get("ai_code", ""))
+def use_choice(widget_key, codes):
+    # 選んだ候補をコード入力へ入れ、選択欄は空に戻す（選択はその1回だけ反映し、st.rerun() は使わない）
+    choice = st.session_state.get(widget_key)
+    if choice in codes:
+        st.session_state["ai_code"] = codes[choice]
+    st.session_state[widget_key] = None
+
+jan_input = st.text_input("コード入力（OCR結果を上書き可）", value=st.session_state.get("ai_code", ""),
+                          help="途中まででも登録済みの候補を出します。読めない桁は ? で（例: 49012345?7894）。")
 effective_code = normalize_code(jan_input, allow_alnum=True)
+snapshot = get_snapshot(SHEET_KEY)
 if effective_code:
     st.info(f"🔢 現在の桁数: {len(effective_code)} 桁")
+    if "?" not in jan_input and snapshot.fresh() and snapshot.absent(effective_code):
+        st.caption("🆕 シート未登録のコードです（ローカル索引で確認・API不使用）。JANCodeLookupで取得してください。")
+# 前方一致・? の1桁ワイルドカード・1桁抜けで、ローカル索引から登録済みコードを補完
+suggestions = snapshot.complete(jan_input) if jan_input else []
+if suggestions:
+    labels = [f"{code}　{name}" for code, name in suggestions]
+    st.selectbox(f"🔡 登録済みの候補（{len(suggestions)} 件）", labels, index=None, placeholder="候補から選ぶ",
+                 key="suggest_choice", on_change=use_choice,
+                 args=("suggest_choice", {label: code for label, (code, _) in zip(labels, suggestions)}))
+with st.expander("🔎 商品名から探す"):
+    # ローカル索引の商品名を文字バイグラムで部分一致検索（全角半角・ひらがなカタカナの違いは無視）
+    name_query = st.text_input("商品名の一部", placeholder="例: さんとりー 天然水")
+    name_hits = snapshot.search_names(name_query) if name_query.strip() else []
+    if name_query.strip() and not name_hits:
+        st.caption("該当なし（ローカル索引が空なら⑤の「ローカル索引を同期」を押してください）")
+    if name_hits:
+        st.dataframe(pd.DataFrame([{"コード": code, "商品名": name, "行": row} for code, name, row in name_hits]),
+                     use_container_width=True, hide_index=True)
+        labels = [f"{code}　{name}" for code, name, _ in name_hits]
+        # シート上のコードが正規形でなくても（小文字・ハイフン入り等）選んだ1回だけ反映する
+        st.selectbox("コード入力に使う", labels, index=None, placeholder="結果から選ぶ",
+                     key="name_choice", on_change=use_choice,
+                     args=("name_choice", {label: code for label, (code, _, _) in zip(labels, name_hits)}))
+if st.session_state.get("trace_id"):
+    # 「遅かった」と言われたらこのIDで bench/trace_report.py --trace を引く
+    st.caption(f"🧵 トレースID: {st.session_state['trace_id']}")
 
 col1, col2 = st.columns(2)
 product_name, product_image = None, None
 with col1:
     if st.button("🟢 JANCodeLookupから取得"):
-        product_name, product_image = get_product_info(effective_code)
+        with shelf_trace.use(scan_trace(code=effective_code)):
+            product_name, product_image = get_product_info(effective_code)
 with col2:
     if st.button("🟣 Google Sheetsから取得"):
-        product_name, product_image = search_gsheet(effective_code)
+        with shelf_trace.use(scan_trace(code=effective_code)):
+            product_name, product_image = search_gsheet(effective_code)
 
 if product_name:
     st.session_state["product_title"] = product_name
     st.session_state["product_image"] = product_image
 
 st.subheader("② Google Sheetsに登録")
+qty_mode = st.toggle("🔢 数量モード（登録済みのコードは行を増やさず「数量」列に加算）", value=False,
+                     help="1回の登録で1個をすぐ書き込みます（タブを閉じても数え漏れません）。"
+                          "同じ商品を複数の端末で同時に数えると、読んでから書くまでの一瞬に重なった1回分が消えることがあります。")
+
 if st.button("💾 登録する", use_container_width=True):
     title = st.session_state.get("product_title", "商品名未取得")
     img_url = st.session_state.get("product_image", None)
-    append_to_gsheet(effective_code, title, img_url)
-    st.success(f"💾 登録完了：{effective_code} / {title}")
-    if img_url:
-        st.image(img_url, width=200, caption="登録商品画像")
+    with shelf_trace.use(scan_trace(code=effective_code)):
+        if qty_mode:
+            # セッションに溜めずにすぐ書く（同じ再実行で読んだ分をまとめるのは一括登録のほう）
+            add_quantities_to_gsheet([(effective_code, title, img_url, 1)])
+        else:
+            append_to_gsheet(effective_code, title, img_url)
+            st.success(f"💾 登録完了：{effective_code} / {title}")
+            if img_url:
+                show_product_image(img_url, "登録商品画像")
 
 st.subheader("③ Excelエクスポート")
 def export_excel():
+    # 押したときだけシート全体を読んで組み立てる（毎回の再実行で全件読み・xlsx生成をしない）
     try:
-        gs_client = _authorize_gspread()
-        if gs_client is None:
+        sheet = _open_sheet()
+        if sheet is None:
             return
-        sheet = gs_client.open_by_key("1lIDwaGMx-bMUXsLsF4p9_KmaXCyDPZIVeIdBen6ebE0").sheet1
-        df = pd.DataFrame(sheet.get_all_records())
-        buf = BytesIO()
-        df.to_excel(buf, index=False, engine="xlsxwriter")
-        buf.seek(0)
-        st.download_button("📥 Excelをダウンロード", buf, "my_shelf_data.xlsx")
+        data = shelf_sheets.records_to_xlsx(shelf_sheets.read_records(sheet)).getvalue()
+        if not budget.put("export_xlsx", data):
+            # 上限を超える大きさはセッションに残さず、この再実行の間だけ渡す
+            st.download_button("📥 Excelをダウンロード", data, "my_shelf_data.xlsx", key="export_once")
     except Exception as e:
         st.error(f"Excel出力エラー: {e}")
 
-export_excel()
+if st.button("📊 Excelを作成"):
+    export_excel()
+export_xlsx = budget.get("export_xlsx")
+if export_xlsx:
+    st.download_button("📥 Excelをダウンロード", export_xlsx, "my_shelf_data.xlsx")
+
+st.subheader("④ 一括取得（JANCodeLookup）")
+def _parse_code_list(text):
+    return [c for c in (normalize_code(t) for t in re.split(r"[\s,、;]+", text or "")) if c]
+
+def load_unnamed_rows():
+    # 商品名不明の行を (行番号, コード) で返す
+    sheet = _open_sheet()
+    if sheet is None:
+        return []
+    return shelf_sheets.unnamed_rows(shelf_sheets.read_records(sheet))
 
-st.subheader("④ Google Sheetsを開く")
-sheet_url = "https://docs.google.com/spreadsheets/d/1lIDwaGMx-bMUXsLsF4p9_KmaXCyDPZIVeIdBen6ebE0/edit#gid=0"
+def run_bulk_lookup(codes):
+    results = []
+    progress = st.progress(0.0, text=f"0 / {len(set(codes))}")
+    table = st.empty()
+    total = len(set(codes))
+    last_draw = 0.0
+    for code, status, title, image_url, source, error in bulk_lookup(codes):
+        results.append({"コード": code, "商品名": title, "画像URL": image_url,
+                        "HTTP": status, "取得元": source, "エラー": error})
+        # 逐次表示（描画は間引く）
+        now = time.monotonic()
+        if now - last_draw > 0.5 or len(results) == total:
+            progress.progress(len(results) / total, text=f"{len(results)} / {total}")
+            table.dataframe(pd.DataFrame(results), use_container_width=True)
+            last_draw = now
+    return results
+
+def backfill_gsheet(row_codes, results):
+    # 解決済み商品名を1回のbatch_updateで書き戻す
+    try:
+        sheet = _open_sheet()
+        if sheet is None:
+            return
+        count = shelf_sheets.backfill(sheet, row_codes, results, get_snapshot(SHEET_KEY))
+        st.success(f"✅ {count} セルを書き戻しました。")
+    except Exception as e:
+        st.error(f"GS書き戻し中にエラー: {e}")
+
+bulk_source = st.radio("コードの入力元", ["📋 貼り付け", "📄 CSVアップロード", "🟣 Sheetsの商品名不明行", "📚 まとめ読みの結果"],
+                       horizontal=True)
+bulk_codes, bulk_rows = [], []
+if bulk_source == "📋 貼り付け":
+    bulk_codes = _parse_code_list(st.text_area("コードを改行・カンマ区切りで貼り付け"))
+elif bulk_source == "📄 CSVアップロード":
+    csv_file = st.file_uploader("CSVをアップロード（「コード」列または先頭列）", type=["csv"])
+    if csv_file is not None:
+        try:
+            csv_df = pd.read_csv(csv_file, dtype=str)
+            col = "コード" if "コード" in csv_df.columns else csv_df.columns[0]
+            bulk_codes = [c for c in (normalize_code(v) for v in csv_df[col].dropna()) if c]
+        except Exception as e:
+            st.error(f"CSV読み込みエラー: {e}")
+elif bulk_source == "📚 まとめ読みの結果":
+    bulk_codes = [r["コード"] for r in budget.get("multi_codes", []) if r["有効"]]
+    if not bulk_codes:
+        st.caption("「📚 棚まとめ読み」か「🗂️ まとめてアップロード」で読み取ると、ここに結果が入ります。")
+else:
+    if st.button("🔄 商品名不明の行を読み込む"):
+        try:
+            budget.put("bulk_rows", load_unnamed_rows())
+        except Exception as e:
+            st.error(f"GS読み込みエラー: {e}")
+    bulk_rows = budget.get("bulk_rows", [])
+    bulk_codes = [code for _, code in bulk_rows]
+
+if bulk_codes:
+    st.info(f"🔢 対象: {len(set(bulk_codes))} 件（重複除外後）")
+bulk_results = budget.get("bulk_results")
+if st.button("🚀 一括取得", disabled=not bulk_codes, use_container_width=True):
+    with shelf_trace.use(shelf_trace.new_id()), metrics.stage("bulk_lookup"):
+        bulk_results = run_bulk_lookup(bulk_codes)
+    if not budget.put("bulk_results", bulk_results):
+        st.warning("⚠️ 結果が大きいためセッションに保持できません。この画面のうちに登録・書き戻してください。")
+elif bulk_results:
+    st.dataframe(pd.DataFrame(bulk_results), use_container_width=True)
+if bulk_source == "🟣 Sheetsの商品名不明行" and bulk_rows and bulk_results:
+    if st.button("💾 解決した商品名をシートに書き戻す"):
+        backfill_gsheet(bulk_rows, bulk_results)
+elif bulk_results:
+    if st.button("💾 取得結果をまとめて登録", use_container_width=True):
+        if qty_mode:
+            # 数量モードでは入力に出てきた回数をそのまま個数として加算
+            resolved = {r["コード"]: r for r in bulk_results if r["エラー"] is None}
+            add_quantities_to_gsheet(shelf_sheets.tally(
+                (c, resolved[c]["商品名"] or "商品名未取得", resolved[c]["画像URL"]) for c in bulk_codes if c in resolved))
+        else:
+            append_many_to_gsheet([(r["コード"], r["商品名"] or "商品名未取得", r["画像URL"])
+                                   for r in bulk_results if r["エラー"] is None])
+
+st.subheader("⑤ Google Sheetsを開く")
+sheet_url = f"https://docs.google.com/spreadsheets/d/{SHEET_KEY}/edit#gid=0"
 st.markdown(f"🔗 [Google Sheetsを開く]({sheet_url})", unsafe_allow_html=True)
+snapshot = get_snapshot(SHEET_KEY)
+if st.button("🔄 ローカル索引を同期"):
+    try:
+        sheet = _open_sheet()
+        if sheet is not None:
+            snapshot.sync_records(shelf_sheets.read_records(sheet))
+    except Exception as e:
+        st.error(f"GS同期エラー: {e}")
+snapshot_status = snapshot.status()
+if snapshot_status["age_s"] is None:
+    st.caption("🗂️ ローカル索引は未同期です（Sheets検索か上のボタンで同期されます）。")
+else:
+    st.caption(f"🗂️ ローカル索引 {snapshot_status['rows']} 行・{snapshot_status['age_s'] / 60:.0f}分前に同期"
+               f"（ブルーム {snapshot_status['bloom_kb']}KB・偽陽性率 {snapshot_status['bloom_fp']:.2%}）"
+               + ("" if snapshot.fresh() else "— 古いため未登録判定には使っていません"))
+with st.sidebar.expander("🩺 診断：ステージ別レイテンシ"):
+    stage_stats = metrics.snapshot()
+    if stage_stats:
+        st.dataframe(pd.DataFrame(stage_stats).T, use_container_width=True)
+    else:
+        st.caption("まだ計測データがありません。")
+    st.download_button("📥 メトリクスをJSONで保存", metrics.to_json(), "my_shelf_metrics.json", mime="application/json")
+
+    usage = budget.usage()
+    st.caption(f"🧠 セッション保持 {usage['bytes'] / 2**20:.1f} / {usage['max_bytes'] / 2**20:.0f}MB"
+               f"（{usage['items']} 件・追い出し {usage['evictions']} 回）")
+    st.caption(f"🧵 トレースログ: {shelf_trace.TRACE_LOG}（遅いスキャンの集計は bench/trace_report.py）")
+
+    st.markdown("**🔥 再実行プロファイル**")
+    profiles = shelf_profile.recent_profiles()
+    if profiles:
+        st.dataframe(pd.DataFrame([{"ID": p["id"], "ms": round(p["duration_s"] * 1000), "サンプル": p["samples"],
+                                    "最も重い関数": p["hottest"], "中断": p["interrupted"]} for p in profiles]),
+                     use_container_width=True, hide_index=True)
+        latest = profiles[0]["id"]
+        for ext, label in ((".top.txt", "上位関数"), (".collapsed", "flame graph用")):
+            try:
+                with open(shelf_profile.profile_path(latest, ext), "rb") as f:
+                    st.download_button(f"📥 最新の{label}（{ext}）", f.read(), f"{latest}{ext}", key=f"profile{ext}")
+            except OSError:
+                pass
+    else:
+        st.caption("URLに ?profile=1 を付けるか MY_SHELF_PROFILE=1 で起動すると、再実行ごとに記録します。")
+
 st.caption("© 2025 my_shelf v1.214 — JST対応＋通信安定化＋Cloud完全動作版")
+
+# 再実行プロファイルの停止は必ずスクリプトの最後（診断パネルの描画まで含める。この回の記録は次の再実行で一覧に出る）
+_sampler = st.session_state.pop("_profiler", None)
+if _sampler is not None:
+    _sampler.stop()
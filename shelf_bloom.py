@@ -0,0 +1,70 @@
+# shelf_bloom
+# 🌸 ブルームフィルタ（「確実に未登録」をAPIなし・数マイクロ秒で答える／偽陽性のみ・偽陰性なし）
+
+import math, struct, hashlib
+
+FP_RATE = 0.01
+_HEADER = struct.Struct("<4sQQQQ")
+_MAGIC = b"BLM1"
+
+
+class BloomFilter:
+    def __init__(self, capacity, fp_rate=FP_RATE, bits=None, hashes=None):
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self.bits = bits or max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.bits / capacity * math.log(2)))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key: str):
+        # 128bitハッシュ1回から k 個の位置を作る（Kirsch–Mitzenmacher の二重ハッシュ）
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str):
+        array = self._array
+        return all(array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def full(self):
+        # 想定件数を超えると偽陽性率が急に上がるので作り直しの目安にする
+        return self.count > self.capacity
+
+    def expected_fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def nbytes(self):
+        return len(self._array)
+
+    # --------------------------------------------------------
+    # 💾 保存形式（ヘッダー＋ビット列）
+    # --------------------------------------------------------
+    def to_bytes(self):
+        return _HEADER.pack(_MAGIC, self.bits, self.hashes, self.count, self.capacity) + bytes(self._array)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if len(data) < _HEADER.size:
+            raise ValueError("not a bloom filter")
+        magic, bits, hashes, count, capacity = _HEADER.unpack_from(data)
+        if magic != _MAGIC or len(data) - _HEADER.size != (bits + 7) // 8:
+            raise ValueError("not a bloom filter")
+        bloom = cls(capacity, bits=bits, hashes=hashes)
+        bloom.count = count
+        bloom._array[:] = data[_HEADER.size:]
+        return bloom
+
+    @classmethod
+    def of(cls, keys, capacity=None, fp_rate=FP_RATE):
+        keys = list(keys)
+        bloom = cls(capacity or len(keys), fp_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
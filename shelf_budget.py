@@ -0,0 +1,94 @@
+# shelf_budget
+# 🧠 セッション毎のメモリ上限（読み取り結果・一括取得結果・Excelなどを合計バイト数と件数で抑え、古い順に追い出す）
+#   st.session_state に直接大きな値を積むと、開きっぱなしの端末の数だけレプリカのRSSが伸び続けるため
+
+import os, sys, time, threading
+from collections import OrderedDict
+
+MAX_SESSION_BYTES = int(float(os.getenv("MY_SHELF_SESSION_BUDGET_MB", "32")) * 2**20)
+MAX_SESSION_ITEMS = 16
+STATE_KEY = "_budget"
+
+
+def estimate_size(obj, _depth=0):
+    """値のおおよそのバイト数（bytes・DataFrame・BytesIO・入れ子のlist/dict）。"""
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return len(obj)
+    if isinstance(obj, str):
+        return sys.getsizeof(obj)
+    if hasattr(obj, "memory_usage") and hasattr(obj, "columns"):
+        return int(obj.memory_usage(deep=True).sum())
+    if hasattr(obj, "getbuffer"):
+        return obj.getbuffer().nbytes
+    if _depth > 4:
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+                                        for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_size(v, _depth + 1) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class SessionBudget:
+    """名前付きの値を最近使った順に保持し、合計が上限を超えたら最も古いものから捨てる。"""
+
+    def __init__(self, max_bytes=MAX_SESSION_BYTES, max_items=MAX_SESSION_ITEMS):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, name, value, size=None):
+        size = estimate_size(value) if size is None else size
+        with self._lock:
+            self._drop(name)
+            if size > self.max_bytes:
+                # 単独で上限を超える値は持たない（呼び出し側はその場で使い切る）
+                self.evictions += 1
+                return False
+            self._entries[name] = (value, size, time.time())
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_items:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+            return True
+
+    def get(self, name, default=None):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return default
+            self._entries.move_to_end(name)
+            return entry[0]
+
+    def pop(self, name, default=None):
+        with self._lock:
+            entry = self._entries.get(name)
+            self._drop(name)
+            return default if entry is None else entry[0]
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def _drop(self, name):
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def usage(self):
+        with self._lock:
+            return {"bytes": self._bytes, "max_bytes": self.max_bytes, "items": len(self._entries),
+                    "evictions": self.evictions,
+                    "entries": {name: size for name, (_, size, _) in self._entries.items()}}
+
+
+def session_budget(state, **kwargs):
+    """st.session_state（や同じ形のdict）に1つだけ置いた SessionBudget を返す。"""
+    budget = state.get(STATE_KEY)
+    if budget is None:
+        budget = state[STATE_KEY] = SessionBudget(**kwargs)
+    return budget
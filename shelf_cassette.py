@@ -0,0 +1,154 @@
+# shelf_cassette
+# 📼 HTTPカセット記録（OpenAI／JANCodeLookup／Sheets の実リクエスト・応答を秘密情報を除いてJSON Linesに保存）
+#   MY_SHELF_CASSETTE_RECORD=cassettes/shop.jsonl.gz で有効化。再生は bench/replay.py
+
+import os, re, json, gzip, time, base64, hashlib, threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
+
+RECORD_ENV = "MY_SHELF_CASSETTE_RECORD"
+SHEETS_HOST = "sheets.googleapis.com"
+# リクエスト本体はこの大きさまで（Sheetsの書き込み内容など）保存、超えたら（画像入りOCRなど）ハッシュと長さだけ
+MAX_REQUEST_BODY = 4096
+SHEET_KEY_PLACEHOLDER = "{SHEET_KEY}"
+
+_SECRET_PARAMS = {"key", "api_key", "access_token", "token", "client_secret"}
+_SECRET_PATTERNS = [
+    (re.compile(r"sk-[A-Za-z0-9_\-]{16,}"), "sk-REDACTED"),
+    (re.compile(r'("(?:access_token|refresh_token|id_token|private_key|client_secret)"\s*:\s*")[^"]*(")'), r"\1REDACTED\2"),
+    (re.compile(r"Bearer\s+[A-Za-z0-9._\-]+"), "Bearer REDACTED"),
+    # 本番スプレッドシートの所在も残さない
+    (re.compile(r'("spreadsheetId"\s*:\s*")[^"]*(")'), r"\1{SHEET_KEY}\2"),
+    (re.compile(r"(docs\.google\.com/spreadsheets/d/)[^/\"?#]+"), r"\1{SHEET_KEY}"),
+]
+_SPREADSHEET_ID = re.compile(r"(/v4/spreadsheets/)([^/:?]+)")
+# 数字の並び（JANコード・行番号・セル番地）を # にした経路で、記録にない要求も近い応答に対応づける
+_DIGITS = re.compile(r"\d+")
+
+
+# ------------------------------------------------------------
+# 🧽 秘密情報の除去と正規化
+# ------------------------------------------------------------
+def scrub_text(text: str):
+    for pattern, repl in _SECRET_PATTERNS:
+        text = pattern.sub(repl, text)
+    return text
+
+def scrub_path(url: str):
+    """ホストを除いたパス＋クエリ。秘密のクエリは伏せ、スプレッドシートIDは置き換える。"""
+    parts = urlsplit(url)
+    query = [(k, "REDACTED" if k.lower() in _SECRET_PARAMS else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    path = _SPREADSHEET_ID.sub(lambda m: m.group(1) + SHEET_KEY_PLACEHOLDER, parts.path)
+    return path + ("?" + urlencode(query) if query else "")
+
+def route_of(path: str):
+    return _DIGITS.sub("#", path.split("?")[0]) + ("?" + _DIGITS.sub("#", path.split("?", 1)[1]) if "?" in path else "")
+
+def body_digest(body):
+    if body is None:
+        return "", 0
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.sha256(body).hexdigest()[:16], len(body)
+
+def encode_body(data: bytes):
+    try:
+        return {"text": scrub_text(data.decode("utf-8"))}
+    except UnicodeDecodeError:
+        return {"b64": base64.b64encode(data).decode("ascii")}
+
+def decode_body(entry):
+    if "text" in entry:
+        return entry["text"].encode("utf-8")
+    return base64.b64decode(entry.get("b64", ""))
+
+
+# ------------------------------------------------------------
+# 🎙️ 記録（requests の送信口に差し込む）
+# ------------------------------------------------------------
+class CassetteRecorder:
+    def __init__(self, path, hosts):
+        self.path = path
+        self.hosts = set(hosts)
+        self.count = 0
+        self._lock = threading.Lock()
+        self._original_send = None
+
+    def wants(self, url):
+        return urlsplit(url).hostname in self.hosts
+
+    def entry(self, request, response, latency):
+        digest, length = body_digest(request.body)
+        entry = {"method": request.method, "host": urlsplit(request.url).hostname, "path": scrub_path(request.url),
+                 "req_sha": digest, "req_len": length, "status": response.status_code,
+                 "content_type": response.headers.get("Content-Type", ""),
+                 "retry_after": response.headers.get("Retry-After"), "latency_ms": round(latency * 1000, 1),
+                 "recorded_at": time.time(), "response": encode_body(response.content)}
+        if request.body is not None and length <= MAX_REQUEST_BODY:
+            body = request.body if isinstance(request.body, bytes) else str(request.body).encode("utf-8")
+            entry["request"] = encode_body(body)
+        return entry
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with self._lock:
+            # gzipは追記ごとに別メンバーになるが、読み手はそのまま連結して読める
+            with opener(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+            self.count += 1
+
+    def install(self):
+        if self._original_send is not None:
+            return self
+        original = self._original_send = HTTPAdapter.send
+        recorder = self
+
+        def send(adapter, request, **kwargs):
+            t0 = time.perf_counter()
+            response = original(adapter, request, **kwargs)
+            if recorder.wants(request.url):
+                # ストリーム応答も全部読んでおく（呼び出し側は読み込み済みの本体から iter_content できる）
+                response.content
+                try:
+                    recorder.write(recorder.entry(request, response, time.perf_counter() - t0))
+                except Exception:
+                    # 記録の失敗で本来の処理を止めない
+                    pass
+            return response
+
+        HTTPAdapter.send = send
+        return self
+
+    def uninstall(self):
+        if self._original_send is not None:
+            HTTPAdapter.send = self._original_send
+            self._original_send = None
+
+
+def default_hosts():
+    from shelf_ocr import OPENAI_CHAT_URL
+    from shelf_lookup import JANCODELOOKUP_URL
+    return {urlsplit(OPENAI_CHAT_URL).hostname, urlsplit(JANCODELOOKUP_URL.format("")).hostname, SHEETS_HOST}
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def start_recording_from_env():
+    """MY_SHELF_CASSETTE_RECORD が設定されていれば記録を始める（Streamlitの再実行でも1回だけ）。"""
+    global _recorder
+    path = os.getenv(RECORD_ENV)
+    with _recorder_lock:
+        if path and _recorder is None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            _recorder = CassetteRecorder(path, default_hosts()).install()
+        return _recorder
+
+
+# ------------------------------------------------------------
+# 📖 読み込み
+# ------------------------------------------------------------
+def load_cassette(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,82 @@
+# shelf_codeindex
+# 🔡 コード補完用のソート済み索引（前方一致・1桁ワイルドカード・1桁抜けの候補を二分探索で返す／Streamlit非依存）
+
+import re, unicodedata
+from bisect import bisect_left, insort
+
+COMPLETE_LIMIT = 10
+WILDCARDS = "?_"
+# ? 1つにつき10通り当てるので、これを超える数は受け付けない
+MAX_WILDCARDS = 2
+_ALPHABET = "0123456789"
+
+
+def normalize_pattern(text: str):
+    """入力欄の文字列を照合用に（全角→半角・大文字化・先頭ゼロ除去）。ワイルドカードは ? に揃えて残す。"""
+    s = unicodedata.normalize("NFKC", text or "").upper()
+    s = re.sub(f"[{re.escape(WILDCARDS)}]", "?", s)
+    return re.sub(r"[^0-9A-Z?]", "", s).lstrip("0")
+
+
+class CodeIndex:
+    """canonical_code を昇順に並べた配列。追記は insort（10万件で数十マイクロ秒）。"""
+
+    def __init__(self, codes=()):
+        self.codes = sorted(set(codes))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        i = bisect_left(self.codes, code)
+        return i < len(self.codes) and self.codes[i] == code
+
+    def add(self, code):
+        if code and code not in self:
+            insort(self.codes, code)
+
+    def prefix(self, prefix, limit=COMPLETE_LIMIT):
+        out = []
+        i = bisect_left(self.codes, prefix)
+        codes = self.codes
+        while i < len(codes) and codes[i].startswith(prefix) and len(out) < limit:
+            out.append(codes[i])
+            i += 1
+        return out
+
+    def wildcard(self, pattern, limit=COMPLETE_LIMIT):
+        """? を任意の数字1桁として前方一致する候補（? 毎に0〜9を当てて二分探索）。"""
+        if "?" not in pattern:
+            return self.prefix(pattern, limit)
+        head, _, tail = pattern.partition("?")
+        out = []
+        for c in _ALPHABET:
+            out.extend(self.wildcard(head + c + tail, limit - len(out)))
+            if len(out) >= limit:
+                break
+        return out
+
+    def missing_one(self, code, limit=COMPLETE_LIMIT):
+        """1桁抜けたコードとして、どこか1か所に数字を足すと登録済みになる候補。"""
+        out = []
+        for pos in range(len(code) + 1):
+            for c in _ALPHABET:
+                candidate = code[:pos] + c + code[pos:]
+                if candidate not in out and candidate in self:
+                    out.append(candidate)
+                    if len(out) >= limit:
+                        return out
+        return out
+
+    def complete(self, text, limit=COMPLETE_LIMIT):
+        """入力途中の文字列から候補を返す。? があればワイルドカード、なければ前方一致＋1桁抜け。"""
+        pattern = normalize_pattern(text)
+        if not pattern:
+            return []
+        if "?" in pattern:
+            return self.wildcard(pattern, limit) if pattern.count("?") <= MAX_WILDCARDS else []
+        found = [c for c in self.prefix(pattern, limit + 1) if c != pattern][:limit]
+        # 末尾以外の桁が抜けた場合は前方一致に出ないので、1桁抜けの候補も足す
+        if len(found) < limit:
+            found += [c for c in self.missing_one(pattern, limit) if c not in found][:limit - len(found)]
+        return found
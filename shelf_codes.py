@@ -0,0 +1,40 @@
+# shelf_codes
+# 🧮 コード正規化・検証（Streamlit非依存）
+
+import re, unicodedata
+
+
+def normalize_code(s: str, allow_alnum=False, uppercase=True):
+    if not s:
+        return ""
+    s = unicodedata.normalize("NFKC", s)
+    s = re.sub(r"[\u200B-\u200D\uFEFF\s\n\r\t]+", "", s)
+    if allow_alnum:
+        s = re.sub(r"[^A-Za-z0-9]", "", s)
+        if uppercase:
+            s = s.upper()
+    else:
+        s = re.sub(r"\D", "", s)
+    return s
+
+def gtin_check_ok(code: str):
+    # EAN-8 / UPC-A / EAN-13 / GTIN-14 のチェックディジット
+    if not code.isdigit() or len(code) not in (8, 12, 13, 14):
+        return False
+    digits = [int(c) for c in code]
+    body, check = digits[:-1], digits[-1]
+    total = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return (10 - total % 10) % 10 == check
+
+def is_valid_code(code: str, allow_alnum=False):
+    if not code:
+        return False
+    if code.isdigit() and len(code) in (8, 12, 13, 14):
+        # JAN系の桁数ならチェックディジット必須
+        return gtin_check_ok(code)
+    # それ以外（社内コード等）は4桁以上を有効とする
+    return len(code) >= 4 and (allow_alnum or code.isdigit())
+
+def canonical_code(value):
+    # シート上の表記ゆれ（数値化で消えた先頭ゼロ・全角）を吸収した照合用キー
+    return normalize_code(str(value), allow_alnum=True).lstrip("0")
@@ -0,0 +1,153 @@
+# shelf_decode
+# 🔢 ローカルバーコードデコーダ（Code128 A/B/C：走査線のバー幅計測＋チェックサム検証／Streamlit非依存）
+
+from collections import Counter
+import numpy as np
+
+from shelf_vision import open_image, to_gray, detect_barcode_region
+
+# Code128 の各シンボル（バー・スペース交互6本の幅、STOPのみ7本）
+CODE128_PATTERNS = (
+    "212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 221312 231212 112232 122132 "
+    "122231 113222 123122 123221 223211 221132 221231 213212 223112 312131 311222 321122 321221 312212 "
+    "322112 322211 212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 231113 231311 "
+    "112133 112331 132131 113123 113321 133121 313121 211331 231131 213113 213311 213131 311123 311321 "
+    "331121 312113 312311 332111 314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 "
+    "112412 122114 122411 142112 142211 241211 221114 413111 241112 134111 111242 121142 121241 114212 "
+    "124112 124211 411212 421112 421211 212141 214121 412121 111143 111341 131141 114113 114311 411113 "
+    "411311 113141 114131 311141 411131 211412 211214 211232 2331112"
+).split()
+_VALUE_OF = {p: v for v, p in enumerate(CODE128_PATTERNS)}
+START_A, START_B, START_C, STOP = 103, 104, 105, 106
+SHIFT, CODE_C, CODE_B, CODE_A = 98, 99, 100, 101
+
+SCANLINES = 15
+MIN_SYMBOLS = 3  # START + データ1以上 + チェック
+
+
+# ------------------------------------------------------------
+# 📏 走査線 → ラン長（暗・明の交互）
+# ------------------------------------------------------------
+def scanline_runs(row):
+    """1本の走査線を2値化し、最初の暗部から始まるラン長の配列を返す。"""
+    lo, hi = np.percentile(row, (10, 90))
+    if hi - lo < 30:
+        return np.empty(0, dtype=np.int32)
+    dark = row < (lo + hi) / 2
+    edges = np.flatnonzero(dark[1:] != dark[:-1]) + 1
+    bounds = np.concatenate(([0], edges, [len(row)]))
+    runs = np.diff(bounds)
+    if not dark[0]:
+        runs = runs[1:]
+    return runs.astype(np.int32)
+
+def _symbol(runs, i, n=6, modules=11):
+    # runs[i:i+n] を1シンボルとして幅を量子化し、パターン文字列を返す
+    seg = runs[i:i + n]
+    if len(seg) < n:
+        return None
+    unit = seg.sum() / float(modules)
+    widths = np.rint(seg / unit).astype(int)
+    if widths.min() < 1 or widths.max() > 4 or widths.sum() != modules:
+        return None
+    return "".join(map(str, widths))
+
+
+# ------------------------------------------------------------
+# 🔤 シンボル値列 → 文字列
+# ------------------------------------------------------------
+def code128_text(values):
+    start, data = values[0], values[1:]
+    mode = {START_A: "A", START_B: "B", START_C: "C"}[start]
+    out, shift = [], False
+    for v in data:
+        current = ("B" if mode == "A" else "A") if shift else mode
+        shift = False
+        if current == "C":
+            if v < 100:
+                out.append(f"{v:02d}")
+            elif v == CODE_B:
+                mode = "B"
+            elif v == CODE_A:
+                mode = "A"
+            continue
+        if v < 96:
+            if current == "B" or v < 64:
+                out.append(chr(v + 32))
+            else:
+                out.append(chr(v - 64))
+        elif v == SHIFT:
+            shift = True
+        elif v == CODE_C:
+            mode = "C"
+        elif v == CODE_B and current == "A":
+            mode = "B"
+        elif v == CODE_A and current == "B":
+            mode = "A"
+        # FNC1〜FNC4 は読み飛ばす
+    return "".join(out)
+
+def decode_runs(runs):
+    """ラン長列から Code128 を1つ探して復号する（チェックサム不一致はNone）。"""
+    for i in range(0, len(runs) - 6, 2):
+        start = _VALUE_OF.get(_symbol(runs, i))
+        if start not in (START_A, START_B, START_C):
+            continue
+        values, j, stopped = [start], i + 6, False
+        while j + 6 <= len(runs):
+            if _symbol(runs, j, 7, 13) == CODE128_PATTERNS[STOP]:
+                stopped = True
+                break
+            v = _VALUE_OF.get(_symbol(runs, j))
+            if v is None or v >= START_A:
+                break
+            values.append(v)
+            j += 6
+        if not stopped or len(values) < MIN_SYMBOLS:
+            continue
+        check = values.pop()
+        if (values[0] + sum(k * v for k, v in enumerate(values[1:], 1))) % 103 != check:
+            continue
+        return code128_text(values)
+    return None
+
+
+# ------------------------------------------------------------
+# 🖼️ 画像 → Code128（複数走査線の多数決）
+# ------------------------------------------------------------
+def decode_code128(gray):
+    """バーが縦向きのグレースケール配列を走査して読む。逆さ撮りも試す。"""
+    h = gray.shape[0]
+    votes = Counter()
+    for y in np.linspace(h * 0.2, h * 0.8, SCANLINES).astype(int):
+        row = gray[y]
+        for line in (row, row[::-1]):
+            text = decode_runs(scanline_runs(line))
+            if text:
+                votes[text] += 1
+                break
+    if not votes:
+        return None
+    return votes.most_common(1)[0][0]
+
+def decode_code128_gray(gray, box=None):
+    """検出枠（なければ検出する）で向きをそろえて Code128 を読む。読めなければNone。"""
+    if box is None:
+        box = detect_barcode_region(gray)
+    candidates = []
+    if box is not None:
+        x0, y0, x1, y1, vertical = box
+        # 端のバーが欠けないよう横方向に余白を取る
+        mx = (x1 - x0) // 4 if vertical else (x1 - x0) // 10
+        my = (y1 - y0) // 10 if vertical else (y1 - y0) // 4
+        region = gray[max(0, y0 - my):y1 + my, max(0, x0 - mx):x1 + mx]
+        candidates.append(region if vertical else region.T)
+    candidates += [gray, gray.T]
+    for candidate in candidates:
+        text = decode_code128(candidate)
+        if text:
+            return text
+    return None
+
+def decode_code128_image(image_bytes: bytes):
+    return decode_code128_gray(to_gray(open_image(image_bytes)))
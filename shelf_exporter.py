@@ -0,0 +1,146 @@
+# shelf_exporter
+# 📡 Prometheusテキスト形式でメトリクスを公開（別スレッドのHTTPリスナー／定期書き出しのtextfile）
+
+import os, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from shelf_metrics import metrics, BUCKETS
+
+PREFIX = "my_shelf_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 環境変数で有効化（どちらも未設定なら何もしない）
+PORT_ENV = "MY_SHELF_METRICS_PORT"
+ADDR_ENV = "MY_SHELF_METRICS_ADDR"
+TEXTFILE_ENV = "MY_SHELF_METRICS_TEXTFILE"
+TEXTFILE_INTERVAL = 15
+
+HELP = {
+    "stage_duration_seconds": "Latency of each app stage (ocr, jancodelookup, sheet_read, ...).",
+    "stage_errors_total": "Stage executions that failed.",
+    "stage_cache_hits_total": "Stage executions answered from a cache or skipped by local decoding.",
+}
+
+
+# ------------------------------------------------------------
+# 🧾 テキスト形式の組み立て
+# ------------------------------------------------------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+def render(registry=metrics):
+    """exposition format 0.0.4 の本文を返す。同じ名前のサンプルは1つの TYPE 行の下にまとめる。"""
+    families = {}
+
+    def add(name, kind, labels, value):
+        family = families.setdefault(PREFIX + name, (kind, []))
+        family[1].append((tuple(sorted(labels.items())) if isinstance(labels, dict) else labels, value))
+
+    for stage, (buckets, total, count, errors, hits) in registry.histograms().items():
+        for le, n in zip(BUCKETS, buckets):
+            add("stage_duration_seconds_bucket", "histogram", {"stage": stage, "le": repr(le)}, n)
+        add("stage_duration_seconds_bucket", "histogram", {"stage": stage, "le": "+Inf"}, count)
+        add("stage_duration_seconds_sum", "histogram", {"stage": stage}, total)
+        add("stage_duration_seconds_count", "histogram", {"stage": stage}, count)
+        add("stage_errors_total", "counter", {"stage": stage}, errors)
+        add("stage_cache_hits_total", "counter", {"stage": stage}, hits)
+    for (name, labels), value in sorted(registry.counters().items()):
+        add(name, "counter", labels, value)
+    for name, kind, labels, value in registry.collect():
+        add(name, kind, labels, value)
+
+    lines, declared = [], set()
+    for full_name, (kind, samples) in families.items():
+        base = full_name
+        if kind == "histogram":
+            base = full_name.rsplit("_", 1)[0]
+        if base not in declared:
+            declared.add(base)
+            help_text = HELP.get(base[len(PREFIX):])
+            if help_text:
+                lines.append(f"# HELP {base} {help_text}")
+            lines.append(f"# TYPE {base} {kind}")
+        for labels, value in samples:
+            lines.append(f"{full_name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------------------------------------------
+# 🌐 HTTPリスナー（/metrics）
+# ------------------------------------------------------------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # スクレイプ毎のアクセスログは出さない
+        pass
+
+def start_http_exporter(port, addr="0.0.0.0"):
+    """デーモンスレッドで /metrics を返すサーバーを起動する。port=0 なら空きポート（server.server_port で確認）。"""
+    server = ThreadingHTTPServer((addr, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ------------------------------------------------------------
+# 📝 textfile（node_exporter の textfile collector 向け）
+# ------------------------------------------------------------
+def write_textfile(path, registry=metrics):
+    # 読み手が書きかけを見ないよう一時ファイル経由で置き換える
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render(registry))
+    os.replace(tmp, path)
+
+def start_textfile_exporter(path, interval=TEXTFILE_INTERVAL):
+    def loop():
+        while True:
+            try:
+                write_textfile(path)
+            except OSError:
+                pass
+            time.sleep(interval)
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+# ------------------------------------------------------------
+# 🚀 環境変数から起動（Streamlitの再実行でも1回だけ）
+# ------------------------------------------------------------
+_started = {}
+_started_lock = threading.Lock()
+
+def start_from_env():
+    """MY_SHELF_METRICS_PORT / MY_SHELF_METRICS_TEXTFILE に従って起動し、起動済みのものを返す。"""
+    with _started_lock:
+        port = os.getenv(PORT_ENV)
+        if port and "http" not in _started:
+            try:
+                _started["http"] = start_http_exporter(int(port), os.getenv(ADDR_ENV, "0.0.0.0"))
+            except (OSError, ValueError) as e:
+                # 複数プロセスで同じポートを取り合った場合など。アプリ自体は止めない
+                _started["http"] = e
+        path = os.getenv(TEXTFILE_ENV)
+        if path and "textfile" not in _started:
+            _started["textfile"] = start_textfile_exporter(path)
+        return dict(_started)
@@ -0,0 +1,160 @@
+# shelf_imagecache
+# 🖼️ 商品画像プロキシ（1回だけ取得してサムネイル化・内容アドレスでディスク保存・総バイト数でLRU削除）
+
+import os, io, json, time, hashlib, threading
+import requests
+from PIL import Image
+
+from shelf_metrics import metrics
+
+CACHE_DIR = os.getenv("MY_SHELF_IMAGE_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".image_cache"))
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+THUMB_MAX_SIDE = 400
+THUMB_JPEG_QUALITY = 80
+FETCH_TIMEOUT = 4
+MAX_FETCH_BYTES = 15 * 1024 * 1024
+# 取得に失敗したURLはしばらく再取得しない（落ちたホストで画面を止めない）
+FAILURE_TTL = 600
+
+
+class ImageCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "fetch_errors": 0, "evictions": 0}
+        self._blobs = os.path.join(root, "blobs")
+        self._index_path = os.path.join(root, "index.json")
+        self._failures = {}
+        self._lock = threading.Lock()
+        os.makedirs(self._blobs, exist_ok=True)
+        self._index = self._load_index()
+
+    # --------------------------------------------------------
+    # 📒 索引（URL → 内容ハッシュ・サイズ・最終アクセス）
+    # --------------------------------------------------------
+    def _load_index(self):
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {url: e for url, e in index.items() if os.path.exists(self._blob_path(e["digest"]))}
+
+    def _save_index(self):
+        tmp = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self._blobs, f"{digest}.jpg")
+
+    def total_bytes(self):
+        # 同じ画像を複数URLが指す場合は1回だけ数える
+        return sum({e["digest"]: e["size"] for e in self._index.values()}.values())
+
+    # --------------------------------------------------------
+    # 📥 取得
+    # --------------------------------------------------------
+    def cached(self, url: str):
+        with self._lock:
+            return url in self._index
+
+    def get(self, url: str):
+        """サムネイルJPEGのバイト列を返す。取得できなければNone。"""
+        if not url:
+            return None
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is not None:
+                try:
+                    with open(self._blob_path(entry["digest"]), "rb") as f:
+                        data = f.read()
+                    entry["atime"] = time.time()
+                    self.stats["hits"] += 1
+                    return data
+                except OSError:
+                    self._index.pop(url, None)
+            failed_at = self._failures.get(url)
+            if failed_at is not None and time.time() - failed_at < FAILURE_TTL:
+                return None
+        self.stats["misses"] += 1
+        try:
+            data = self._fetch_thumbnail(url)
+        except Exception:
+            with self._lock:
+                self.stats["fetch_errors"] += 1
+                self._failures[url] = time.time()
+            return None
+        self._put(url, data)
+        return data
+
+    def _fetch_thumbnail(self, url):
+        res = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=FETCH_TIMEOUT, stream=True)
+        try:
+            res.raise_for_status()
+            raw = bytearray()
+            for chunk in res.iter_content(65536):
+                raw += chunk
+                if len(raw) > MAX_FETCH_BYTES:
+                    raise ValueError("image too large")
+        finally:
+            res.close()
+        img = Image.open(io.BytesIO(raw))
+        if img.format == "JPEG":
+            img.draft("RGB", (THUMB_MAX_SIDE, THUMB_MAX_SIDE))
+        img.thumbnail((THUMB_MAX_SIDE, THUMB_MAX_SIDE))
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, format="JPEG", quality=THUMB_JPEG_QUALITY)
+        return buf.getvalue()
+
+    def _put(self, url, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        with self._lock:
+            if not os.path.exists(path):
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            self._index[url] = {"digest": digest, "size": len(data), "atime": time.time()}
+            self._failures.pop(url, None)
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        # 最終アクセスが古いURLから外し、どのURLからも参照されない画像ファイルを消す
+        total = self.total_bytes()
+        for url, entry in sorted(self._index.items(), key=lambda kv: kv[1]["atime"]):
+            if total <= self.max_bytes:
+                break
+            del self._index[url]
+            self.stats["evictions"] += 1
+            if all(e["digest"] != entry["digest"] for e in self._index.values()):
+                total -= entry["size"]
+                try:
+                    os.remove(self._blob_path(entry["digest"]))
+                except OSError:
+                    pass
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_image_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+        return _cache
+
+def _collect_metrics():
+    if _cache is None:
+        return []
+    stats = _cache.stats
+    return [("cache_requests_total", "counter", {"cache": "product_image", "result": "hit"}, stats["hits"]),
+            ("cache_requests_total", "counter", {"cache": "product_image", "result": "miss"}, stats["misses"]),
+            ("image_cache_fetch_errors_total", "counter", {}, stats["fetch_errors"]),
+            ("image_cache_evictions_total", "counter", {}, stats["evictions"]),
+            ("image_cache_bytes", "gauge", {}, _cache.total_bytes())]
+
+metrics.collector("image_cache", _collect_metrics)
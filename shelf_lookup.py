@@ -0,0 +1,281 @@
+# shelf_lookup
+# 🛒 JANCodeLookup 取得・解析（Streamlit非依存：アプリ／ベンチ共用）
+
+import os, re, html, time, random, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+import requests
+from bs4 import BeautifulSoup
+
+from shelf_metrics import metrics
+
+JANCODELOOKUP_URL = os.getenv("MY_SHELF_JANCODELOOKUP_URL", "https://www.jancodelookup.com/search/?q={}")
+USER_AGENT = "Mozilla/5.0"
+UNKNOWN_TITLE = "商品名不明"
+
+# 先頭の検索結果ブロックが届いたら受信を打ち切る
+CHUNK_SIZE = 8192
+FRAGMENT_WINDOW = 16384
+
+# 一括取得：同時接続数・ホスト毎の礼儀レート・再試行・キャッシュ
+BULK_WORKERS = 8
+HOST_RATE_PER_SEC = 4.0
+HOST_BURST = 4
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+CACHE_SIZE = 20000
+
+_ITEM_START = re.compile(rb"<div[^>]*class=[\"'][^\"']*\bsearch-result-item\b", re.I)
+_P_CLOSE = re.compile(rb"</p\s*>", re.I)
+_IMG_IMAGE = re.compile(rb"<img[^>]*class=[\"'][^\"']*\bimage\b", re.I)
+
+# 高速パス（断片のみを正規表現で抽出）
+_FAST_P = re.compile(r"<p\b[^>]*>(.*?)</p\s*>", re.I | re.S)
+_FAST_IMG = re.compile(r"<img\b[^>]*>", re.I)
+_ATTR_CLASS = re.compile(r"\bclass\s*=\s*[\"']([^\"']*)[\"']", re.I)
+_ATTR_SRC = re.compile(r"\bsrc\s*=\s*[\"']([^\"']*)[\"']", re.I)
+_TAG = re.compile(r"<[^>]+>")
+_WS = re.compile(r"\s+")
+
+
+# ------------------------------------------------------------
+# 📡 ストリーム受信（先頭ブロックで打ち切り）
+# ------------------------------------------------------------
+def read_result_fragment(chunks, window=FRAGMENT_WINDOW):
+    """チャンク列を読み、(先頭結果ブロック or None, 受信済みバイト列, 受信バイト数) を返す。"""
+    buf = bytearray()
+    start = None
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buf += chunk
+        if start is None:
+            m = _ITEM_START.search(buf)
+            if m is None:
+                continue
+            start = m.start()
+        end = _fragment_end(buf, start, window)
+        if end is not None:
+            return bytes(buf[start:end]), bytes(buf), len(buf)
+    if start is not None:
+        return bytes(buf[start:]), bytes(buf), len(buf)
+    return None, bytes(buf), len(buf)
+
+def _fragment_end(buf, start, window):
+    # 次の結果ブロック開始 → そこまで
+    nxt = _ITEM_START.search(buf, start + 1)
+    if nxt is not None:
+        return nxt.start()
+    # 商品名<p>と画像<img>が揃った → 画像タグの末尾まで
+    p_close = _P_CLOSE.search(buf, start)
+    img = _IMG_IMAGE.search(buf, start)
+    if p_close is not None and img is not None:
+        img_end = buf.find(b">", img.end())
+        if img_end != -1:
+            return max(p_close.end(), img_end + 1)
+    if len(buf) - start >= window:
+        return start + window
+    return None
+
+
+# ------------------------------------------------------------
+# 🔎 解析（高速パス → BeautifulSoupフォールバック）
+# ------------------------------------------------------------
+def parse_fragment_fast(fragment: str):
+    m = _FAST_P.search(fragment)
+    if m is None:
+        return None, None
+    title = _WS.sub(" ", html.unescape(_TAG.sub("", m.group(1)))).strip()
+    image_url = None
+    for tag in _FAST_IMG.finditer(fragment):
+        cls = _ATTR_CLASS.search(tag.group(0))
+        if cls and "image" in cls.group(1).split():
+            src = _ATTR_SRC.search(tag.group(0))
+            image_url = html.unescape(src.group(1)) if src else None
+            break
+    return title or None, image_url
+
+def parse_html_full(text: str):
+    soup = BeautifulSoup(text, "html.parser")
+    name_tag = soup.select_one("div.search-result-item p")
+    title = name_tag.get_text(strip=True) if name_tag else None
+    img_tag = soup.select_one("div.search-result-item img.image")
+    image_url = img_tag["src"] if img_tag and img_tag.has_attr("src") else None
+    return title, image_url
+
+def parse_product_html(fragment, body, encoding="utf-8"):
+    if fragment is not None:
+        title, image_url = parse_fragment_fast(fragment.decode(encoding, "replace"))
+        if title:
+            return title, image_url
+        # 断片だけをBeautifulSoupで解析
+        title, image_url = parse_html_full(fragment.decode(encoding, "replace"))
+        if title:
+            return title, image_url
+    # 全文フォールバック（マークアップ変更時など）
+    title, image_url = parse_html_full(body.decode(encoding, "replace"))
+    return title or UNKNOWN_TITLE, image_url
+
+
+# ------------------------------------------------------------
+# 🛒 取得（HTTPステータス, 商品名, 画像URL, 受信バイト数）
+# ------------------------------------------------------------
+def _response_encoding(res):
+    enc = (res.encoding or "").lower()
+    # charset未指定時のrequests既定（ISO-8859-1）は日本語ページでは誤り
+    if not enc or enc == "iso-8859-1":
+        return "utf-8"
+    return enc
+
+def lookup_jan(jan_query: str, session=None, timeout=10, verify=False):
+    http = session or requests
+    url = JANCODELOOKUP_URL.format(jan_query)
+    res = http.get(url, headers={"User-Agent": USER_AGENT}, timeout=timeout, verify=verify, stream=True)
+    try:
+        if res.status_code != 200:
+            return res.status_code, None, None, 0
+        fragment, body, nbytes = read_result_fragment(res.iter_content(CHUNK_SIZE))
+        title, image_url = parse_product_html(fragment, body, _response_encoding(res))
+        return res.status_code, title, image_url, nbytes
+    finally:
+        # 残りのボディは読まずに接続を閉じる
+        res.close()
+
+
+# ------------------------------------------------------------
+# 🚦 ホスト毎のレート制限（トークンバケット）
+# ------------------------------------------------------------
+class HostRateLimiter:
+    def __init__(self, rate_per_sec=HOST_RATE_PER_SEC, burst=HOST_BURST):
+        self.rate = rate_per_sec
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str):
+        while True:
+            with self._lock:
+                tokens, stamp = self._buckets.get(host, (self.burst, time.monotonic()))
+                now = time.monotonic()
+                tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+host_limiter = HostRateLimiter()
+
+
+# ------------------------------------------------------------
+# 🗃️ 取得結果キャッシュ（LRU・成功結果のみ）
+# ------------------------------------------------------------
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def cache_get(jan_query: str):
+    with _cache_lock:
+        hit = _cache.get(jan_query)
+        if hit is not None:
+            _cache.move_to_end(jan_query)
+    metrics.inc("cache_requests_total", cache="jan_lookup", result="miss" if hit is None else "hit")
+    return hit
+
+def cache_clear():
+    with _cache_lock:
+        _cache.clear()
+
+def cache_put(jan_query: str, title, image_url):
+    with _cache_lock:
+        _cache[jan_query] = (title, image_url)
+        _cache.move_to_end(jan_query)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+# ------------------------------------------------------------
+# 🔁 再試行つき取得（スレッド毎にSessionを再利用）
+# ------------------------------------------------------------
+_local = threading.local()
+
+def _thread_session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        _local.session = session
+    return session
+
+def lookup_jan_polite(jan_query: str, limiter=None, retries=MAX_RETRIES, timeout=10, verify=False, span=None):
+    """(status, 商品名, 画像URL, 取得元) を返す。取得元は "cache" / "web"。span には受信バイト数（再試行分も）を足す。"""
+    cached = cache_get(jan_query)
+    if cached is not None:
+        metrics.inc("jan_lookup_total", tier="cache")
+        return 200, cached[0], cached[1], "cache"
+    metrics.inc("jan_lookup_total", tier="web")
+    limiter = limiter or host_limiter
+    host = urlsplit(JANCODELOOKUP_URL).hostname
+    status, error = None, None
+    for attempt in range(retries + 1):
+        if attempt:
+            # ジッター付き指数バックオフ
+            time.sleep(random.uniform(0, BACKOFF_BASE * (2 ** (attempt - 1))))
+        limiter.acquire(host)
+        try:
+            status, title, image_url, nbytes = lookup_jan(jan_query, session=_thread_session(), timeout=timeout, verify=verify)
+        except requests.RequestException as e:
+            status, error = None, e
+            continue
+        if span is not None:
+            span.add_bytes(nbytes)
+        metrics.inc("upstream_responses_total", upstream="jancodelookup", code=status)
+        if status == 200:
+            cache_put(jan_query, title, image_url)
+            return status, title, image_url, "web"
+        if status not in RETRY_STATUSES:
+            break
+    if status is None and error is not None:
+        raise error
+    return status, None, None, "web"
+
+def bulk_lookup(codes, workers=BULK_WORKERS, limiter=None):
+    """コード列を並列に解決し、完了順に (code, status, 商品名, 画像URL, 取得元, エラー) を返すジェネレータ。"""
+    unique = list(dict.fromkeys(c for c in codes if c))
+    _bulk_pending_add(len(unique))
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    futures = {pool.submit(lookup_jan_polite, code, limiter): code for code in unique}
+    remaining = len(futures)
+    try:
+        for fut in as_completed(futures):
+            code = futures[fut]
+            remaining -= 1
+            _bulk_pending_add(-1)
+            try:
+                status, title, image_url, source = fut.result()
+                yield code, status, title, image_url, source, None
+            except Exception as e:
+                yield code, None, None, None, "web", str(e)
+    finally:
+        # 途中で打ち切られた（再実行でジェネレータが閉じられた）ら、未着手の分は取り消して待たずに戻る
+        #   実行中の分（最大 workers 件）だけはバックグラウンドで終わらせる
+        pool.shutdown(wait=False, cancel_futures=True)
+        _bulk_pending_add(-remaining)
+
+# 一括取得の未完了件数（Prometheusのキュー長）
+_bulk_pending = 0
+_bulk_pending_lock = threading.Lock()
+
+def _bulk_pending_add(n):
+    global _bulk_pending
+    with _bulk_pending_lock:
+        _bulk_pending += n
+
+def _collect_metrics():
+    with _cache_lock:
+        size = len(_cache)
+    return [("jan_lookup_cache_entries", "gauge", {}, size),
+            ("bulk_lookup_queue_depth", "gauge", {}, _bulk_pending)]
+
+metrics.collector("lookup", _collect_metrics)
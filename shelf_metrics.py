@@ -0,0 +1,178 @@
+# shelf_metrics
+# ⏱️ ステージ別レイテンシ計測（直近ウィンドウのp50/p95/p99＋呼出・エラー・キャッシュヒット数／Streamlit非依存）
+# 　 Prometheus向けに累積ヒストグラム・ラベル付きカウンタ・収集関数（キュー長など）も保持する
+
+import json, time, threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+WINDOW = 1000
+# 累積ヒストグラムの上限（秒）。+Inf は出力時に付ける
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# stage() の入れ子の深さ（0が最上位。sheet_search の中の sheet_read などは1以上）
+_depth = ContextVar("stage_depth", default=0)
+
+
+class StageStats:
+    def __init__(self, window=WINDOW):
+        self.durations = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.last = None
+        # ウィンドウと違い起動時からの累積（Prometheus用）
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.total_seconds = 0.0
+        self.observed = 0
+
+    def observe(self, seconds):
+        self.durations.append(seconds)
+        self.last = seconds
+        self.total_seconds += seconds
+        self.observed += 1
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                self.bucket_counts[i] += 1
+
+    def percentile(self, p, samples):
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def snapshot(self):
+        samples = sorted(self.durations)
+        ms = lambda v: None if v is None else round(v * 1000, 1)
+        return {
+            "calls": self.calls, "errors": self.errors, "cache_hits": self.cache_hits,
+            "p50_ms": ms(self.percentile(50, samples)), "p95_ms": ms(self.percentile(95, samples)),
+            "p99_ms": ms(self.percentile(99, samples)), "last_ms": ms(self.last),
+        }
+
+
+class Span:
+    """stage() が返す計測中の区間。例外なしの失敗は fail()、キャッシュで済んだら cache_hit()。"""
+
+    def __init__(self):
+        self.failed = False
+        self.hit = False
+        self.tier = None
+        self.bytes = None
+        self.depth = _depth.get()
+
+    def fail(self):
+        self.failed = True
+
+    def cache_hit(self, tier="cache"):
+        self.hit = True
+        self.tier = tier
+
+    def add_bytes(self, n):
+        # 送受信・処理したバイト数（トレースに残す）
+        self.bytes = (self.bytes or 0) + n
+
+
+class Metrics:
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.started = time.time()
+        self._stages = {}
+        self._counters = {}
+        self._collectors = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, name):
+        stats = self._stages.get(name)
+        if stats is None:
+            stats = self._stages[name] = StageStats(self.window)
+        return stats
+
+    def record(self, name, seconds, error=False, cache_hit=False):
+        with self._lock:
+            stats = self._stage(name)
+            stats.calls += 1
+            stats.errors += bool(error)
+            stats.cache_hits += bool(cache_hit)
+            stats.observe(seconds)
+
+    def hit(self, name, tier="cache"):
+        # 処理自体を省略できた（キャッシュ・ローカル復号など）回数だけ数える
+        with self._lock:
+            self._stage(name).cache_hits += 1
+        span = Span()
+        span.cache_hit(tier)
+        self._notify(name, time.time(), 0.0, span)
+
+    def inc(self, name, amount=1, **labels):
+        # ラベル付きカウンタ（例: inc("sheets_api_calls_total", method="append_rows")）
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def collector(self, key, fn):
+        """出力時に呼ばれる収集関数を登録する。fn は (名前, "counter"/"gauge", ラベルdict, 値) を返す。同じkeyは上書き。"""
+        with self._lock:
+            self._collectors[key] = fn
+
+    def listener(self, key, fn):
+        """区間の終わりごとに fn(名前, 開始時刻, 秒, Span) を呼ぶ（トレースログ用）。同じkeyは上書き。"""
+        with self._lock:
+            self._listeners[key] = fn
+
+    def _notify(self, name, started, seconds, span):
+        for fn in list(self._listeners.values()):
+            try:
+                fn(name, started, seconds, span)
+            except Exception:
+                # 記録側の不具合で本来の処理を止めない
+                continue
+
+    @contextmanager
+    def stage(self, name):
+        span = Span()
+        token = _depth.set(span.depth + 1)
+        started = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span.failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - t0
+            _depth.reset(token)
+            self.record(name, seconds, span.failed, span.hit)
+            self._notify(name, started, seconds, span)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in sorted(self._stages.items())}
+
+    def histograms(self):
+        # {stage: (バケット累積数リスト, 合計秒, 件数, エラー数, キャッシュヒット数)}
+        with self._lock:
+            return {name: (list(st.bucket_counts), st.total_seconds, st.observed, st.errors, st.cache_hits)
+                    for name, st in sorted(self._stages.items())}
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def collect(self):
+        with self._lock:
+            collectors = list(self._collectors.values())
+        samples = []
+        for fn in collectors:
+            try:
+                samples.extend(fn())
+            except Exception:
+                # 収集側の不具合で出力全体を落とさない
+                continue
+        return samples
+
+    def to_json(self):
+        return json.dumps({"started": self.started, "dumped": time.time(), "stages": self.snapshot()},
+                          ensure_ascii=False, indent=2)
+
+metrics = Metrics()
@@ -0,0 +1,113 @@
+# shelf_namesearch
+# 🔎 商品名の部分一致検索（文字バイグラムの転置索引／NFKC・ひらがな→カタカナ・大小文字を揃えて照合／Streamlit非依存）
+
+import re, math, heapq, unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+SEARCH_LIMIT = 20
+# 全バイグラム一致が足りないとき、この割合以上のバイグラムが一致すれば候補にする
+MIN_FUZZY_RATIO = 0.5
+# あいまい検索で数える転置リストの上限（「商品」のようにほぼ全行にある並びは数えない）
+MAX_FUZZY_POSTINGS = 20000
+# 長いほうの転置リストがこの倍を超えたら、集合にせず二分探索で照合する
+BISECT_RATIO = 16
+_HIRAGANA = re.compile(r"[ぁ-ゖ]")
+_NOISE = re.compile(r"[\s　・･,，、。.．/／\-‐－―〜~()（）\[\]［］「」『』【】]+")
+
+
+def normalize_name(text):
+    """全角英数→半角・半角カナ→全角（NFKC）、英字は小文字、ひらがなはカタカナ、空白と記号は除去。"""
+    s = unicodedata.normalize("NFKC", str(text or "")).lower()
+    s = _HIRAGANA.sub(lambda m: chr(ord(m.group()) + 0x60), s)
+    return _NOISE.sub("", s)
+
+def bigrams(s):
+    if len(s) < 2:
+        return [s] if s else []
+    return [s[i:i + 2] for i in range(len(s) - 1)]
+
+def _has(postings, doc):
+    i = bisect_left(postings, doc)
+    return i < len(postings) and postings[i] == doc
+
+def _intersect(lists):
+    """昇順配列（短い順）の共通部分。相手がずっと長ければ二分探索、同程度なら集合演算。"""
+    found = lists[0]
+    for postings in lists[1:]:
+        if not found:
+            break
+        if len(postings) > len(found) * BISECT_RATIO:
+            found = [doc for doc in found if _has(postings, doc)]
+        else:
+            found = sorted(set(found).intersection(postings))
+    return found
+
+
+class NameIndex:
+    """行番号（0始まり）→ 正規化済み商品名と、バイグラム → 行番号の昇順配列。"""
+
+    def __init__(self):
+        self.names = []
+        self._postings = {}
+        self._renamed = set()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, doc, name):
+        """doc は追記順（昇順）で渡す。既存の doc を渡すと名前だけ差し替える（古いバイグラムは照合時に落ちる）。"""
+        norm = normalize_name(name)
+        if doc < len(self.names):
+            if self.names[doc] != norm:
+                self._renamed.add(doc)
+            self.names[doc] = norm
+        else:
+            self.names.extend([""] * (doc - len(self.names)))
+            self.names.append(norm)
+        for gram in set(bigrams(norm)) | set(norm):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("I")
+            if not postings or postings[-1] < doc:
+                postings.append(doc)
+            elif not _has(postings, doc):
+                postings.insert(bisect_left(postings, doc), doc)
+
+    @classmethod
+    def of(cls, names):
+        index = cls()
+        for doc, name in enumerate(names):
+            index.add(doc, name)
+        return index
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """[(doc, score)] を良い順に返す。score は 部分文字列一致 > 一致バイグラム割合 > 名前の短さ。"""
+        q = normalize_name(query)
+        grams = list(dict.fromkeys(bigrams(q)))
+        if not grams:
+            return []
+        lists = sorted((self._postings.get(g, array("I")) for g in grams), key=len)
+        # まず全バイグラムを含む行（短いリストから順に絞る）
+        matched = dict.fromkeys(_intersect(lists), len(grams))
+        if not matched and len(grams) > 1:
+            # 1件も無ければ一部のバイグラムだけ一致する行を拾う（誤字・語順違い）
+            need = max(1, math.ceil(len(grams) * MIN_FUZZY_RATIO))
+            counts = Counter()
+            for postings in lists:
+                if len(postings) <= MAX_FUZZY_POSTINGS:
+                    counts.update(postings)
+            for doc, n in counts.items():
+                if n >= need:
+                    matched.setdefault(doc, n)
+        names, total = self.names, len(grams)
+        scored = [((q in names[doc], n / total, -len(names[doc])), doc)
+                  for doc, n in matched.items() if doc not in self._renamed]
+        for doc in self._renamed.intersection(matched):
+            # 名前が差し替えられた行は古いバイグラムが残っているので数え直す
+            own = set(bigrams(names[doc])) | set(names[doc])
+            n = sum(g in own for g in grams)
+            if n:
+                scored.append(((q in names[doc], n / total, -len(names[doc])), doc))
+        return [(doc, score) for score, doc in heapq.nlargest(limit, scored)]
@@ -0,0 +1,630 @@
+# shelf_ocr
+# 🤖 OpenAI OCR 呼び出し（再試行・締切・サーキットブレーカー／Streamlit非依存）
+
+import os, binascii, json, re, time, random, threading, queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+import requests
+
+from shelf_metrics import metrics
+
+OPENAI_CHAT_URL = os.getenv("MY_SHELF_OPENAI_URL", "https://api.openai.com/v1/chat/completions")
+OCR_MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "あなたはバーコードや印字コードを正確に読むOCRアシスタントです。"
+
+MULTI_MAX_TOKENS = 800
+
+# タイルバッチ：複数の切り出し画像を1リクエストにまとめる
+BATCH_MIN = 2
+BATCH_MAX = 16
+BATCH_MAX_WAIT = 0.8
+BATCH_DEADLINE = 40.0
+# バッチ1回の試行の時間切れは1枚分（ATTEMPT_TIMEOUT）に枚数に応じて足す（締切の残りが上限）
+BATCH_ATTEMPT_PER_IMAGE = 2.0
+# 同時に送るバッチ数（遅いバッチ1つで後ろの待ち行列が全部止まらないように）
+BATCH_SENDERS = 2
+
+# 画像はJSON化した後で差し込む（base64をチャンク単位で1つのバッファへ直接書く）
+_IMAGE_SLOT = "@@image{}@@"
+_IMAGE_SLOT_RE = re.compile(rb"@@image(\d+)@@")
+_DATA_URL_HEAD = b"data:image/jpeg;base64,"
+B64_CHUNK = 3 * 64 * 1024
+
+# 1スキャンあたりの締切（秒）と再試行設定
+SCAN_DEADLINE = 20.0
+ATTEMPT_TIMEOUT = 12.0
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 4.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# ブレーカー：連続失敗で開き、一定時間後に1件だけ試す
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 30.0
+
+# ヘッジ：直近レイテンシのパーセンタイルを超えたら同一リクエストをもう1本
+HEDGE_PERCENTILE = 95
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 4.0
+HEDGE_BUDGET = 0.05
+# 負けた側は途中で止められず最後まで走って課金されるので、走り残りがこれ以上あれば新たにヘッジしない
+HEDGE_MAX_ABANDONED = 2
+
+
+class OcrError(Exception):
+    pass
+
+class OcrHttpError(OcrError):
+    def __init__(self, status, text):
+        super().__init__(f"{status} {text}")
+        self.status = status
+        self.retry_after = None
+
+class CircuitOpenError(OcrError):
+    pass
+
+class DeadlineExceeded(OcrError):
+    pass
+
+
+# ------------------------------------------------------------
+# ⏳ 締切
+# ------------------------------------------------------------
+class Deadline:
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+
+# ------------------------------------------------------------
+# 🔌 サーキットブレーカー（プロセス共通）
+# ------------------------------------------------------------
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._probe = False
+            if self.state == "half_open" and not self._probe:
+                self._probe = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probe = False
+
+    def retry_in(self):
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+breaker = CircuitBreaker()
+
+# 画面表示用カウンタ
+stats = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0, "rejected": 0, "deadline": 0}
+_stats_lock = threading.Lock()
+
+def _count(key, n=1):
+    with _stats_lock:
+        stats[key] += n
+
+def breaker_status():
+    return {"state": breaker.state, "consecutive": breaker.failures,
+            "retry_in": round(breaker.retry_in(), 1), **stats}
+
+
+# ------------------------------------------------------------
+# 🪁 ヘッジ送信（パーセンタイル閾値＋追加リクエスト予算）
+# ------------------------------------------------------------
+class HedgePolicy:
+    def __init__(self, percentile=HEDGE_PERCENTILE, window=HEDGE_WINDOW, min_samples=HEDGE_MIN_SAMPLES,
+                 default_delay=HEDGE_DEFAULT_DELAY, budget=HEDGE_BUDGET, max_abandoned=HEDGE_MAX_ABANDONED):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.budget = budget
+        self.max_abandoned = max_abandoned
+        self.latencies = deque(maxlen=window)
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        # 結果を使わずに走らせたままにしたリクエスト（累計と、まだ走っている数）
+        self.abandoned = 0
+        self.abandoned_running = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def delay(self):
+        with self._lock:
+            samples = sorted(self.latencies)
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        idx = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[idx]
+
+    def start_primary(self):
+        with self._lock:
+            self.primaries += 1
+
+    def try_hedge(self):
+        # 追加リクエストは一次リクエスト数 × budget まで（ヘッジ1本につき、負けた側の1本が余分に課金される）
+        with self._lock:
+            if self.hedges + 1 > self.primaries * self.budget or self.abandoned_running >= self.max_abandoned:
+                return False
+            self.hedges += 1
+            return True
+
+    def record_win(self, tag):
+        if tag == "hedge":
+            with self._lock:
+                self.hedge_wins += 1
+
+    def abandon(self, n):
+        with self._lock:
+            self.abandoned += n
+            self.abandoned_running += n
+
+    def abandoned_done(self):
+        with self._lock:
+            self.abandoned_running -= 1
+
+    def status(self):
+        rate = self.hedges / self.primaries if self.primaries else 0.0
+        return {"threshold": round(self.delay(), 2), "primaries": self.primaries, "hedges": self.hedges,
+                "hedge_rate": round(rate, 3), "hedge_wins": self.hedge_wins, "abandoned": self.abandoned,
+                "abandoned_running": self.abandoned_running}
+
+hedge = HedgePolicy()
+
+# ヘッジ送信用の接続プール。送信中は1本を占有し、終わったら戻す（負けて放置した側も終わり次第戻る）
+HEDGE_SESSION_POOL = 4
+_hedge_sessions = []
+_hedge_sessions_lock = threading.Lock()
+
+def _checkout_session():
+    with _hedge_sessions_lock:
+        if _hedge_sessions:
+            return _hedge_sessions.pop()
+    return requests.Session()
+
+def _checkin_session(http):
+    with _hedge_sessions_lock:
+        if len(_hedge_sessions) < HEDGE_SESSION_POOL:
+            _hedge_sessions.append(http)
+            return
+    http.close()
+
+def _send_once(headers, body, timeout, session=None):
+    http = session or requests
+    t0 = time.monotonic()
+    response = http.post(OPENAI_CHAT_URL, headers=headers, data=body, timeout=timeout)
+    if response.status_code == 200:
+        hedge.observe(time.monotonic() - t0)
+    return response
+
+def _send_hedged(headers, body, timeout):
+    """一次リクエストが閾値内に返らなければ2本目を送り、先に返った方を採用する。
+    requests は送信中のリクエストを別スレッドから止められないので、負けた側は締切まで走らせたまま捨てる（課金される）。
+    接続はプールから借りるので、毎回TCP/TLSの握手からやり直さない。"""
+    hedge.start_primary()
+    results = queue.Queue()
+    started = time.monotonic()
+    lock = threading.Lock()
+    state = {"launched": 0, "finished": 0, "abandoned": False}
+
+    def fire(tag):
+        t0 = time.monotonic()
+        http = _checkout_session()
+        try:
+            results.put((tag, http.post(OPENAI_CHAT_URL, headers=headers, data=body, timeout=timeout), None,
+                         time.monotonic() - t0))
+        except Exception as e:
+            results.put((tag, None, e, time.monotonic() - t0))
+        finally:
+            _checkin_session(http)
+            with lock:
+                state["finished"] += 1
+                abandoned = state["abandoned"]
+            if abandoned:
+                hedge.abandoned_done()
+
+    def launch(tag):
+        with lock:
+            state["launched"] += 1
+        threading.Thread(target=fire, args=(tag,), daemon=True).start()
+
+    launch("primary")
+    in_flight, hedged, last_error = 1, False, None
+    try:
+        while in_flight:
+            elapsed = time.monotonic() - started
+            wait = timeout - elapsed
+            if not hedged:
+                wait = min(wait, hedge.delay() - elapsed)
+            try:
+                tag, response, error, latency = results.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                if time.monotonic() - started >= timeout:
+                    break
+                hedged = True
+                if hedge.try_hedge():
+                    launch("hedge")
+                    in_flight += 1
+                continue
+            in_flight -= 1
+            if error is not None:
+                last_error = error
+                continue
+            if response.status_code == 200:
+                hedge.record_win(tag)
+                hedge.observe(latency)
+                if tag == "hedge":
+                    # 負けた一次リクエストの経過時間も下限値として記録
+                    hedge.observe(time.monotonic() - started)
+            return response
+    finally:
+        # まだ走っている側は止められないので、放置分として数える（終わり次第 abandoned_done で減る）
+        with lock:
+            state["abandoned"] = True
+            running = state["launched"] - state["finished"]
+        if running:
+            hedge.abandon(running)
+    raise last_error or requests.Timeout(f"OCR request timed out after {timeout:.1f}s")
+
+
+# ------------------------------------------------------------
+# 🧾 リクエスト組み立て
+# ------------------------------------------------------------
+def build_prompt(allow_alnum=False):
+    directive = "数字のみを半角で返してください。" if not allow_alnum else "英数字のみを半角で返してください。"
+    return f"この画像の中央付近に印字されたコードを読み取り、{directive}説明や余計な文字は不要です。"
+
+def build_multi_prompt(allow_alnum=False):
+    charset = "数字のみ" if not allow_alnum else "英数字のみ"
+    return (
+        "この画像に写っているバーコード・印字コードをすべて読み取ってください。"
+        f"各コードは{charset}を半角で、画像左上を(0,0)・右下を(1,1)とした中心座標x,yを添えて、"
+        'JSON配列 [{"code": "...", "x": 0.0, "y": 0.0}] のみを返してください。説明は不要です。'
+    )
+
+_JSON_ARRAY = re.compile(r"\[.*\]", re.S)
+
+def parse_multi_codes(raw: str):
+    """マルチコード応答を [{"code", "x", "y"}] に変換する（コードフェンスや前置きは無視）。"""
+    m = _JSON_ARRAY.search(raw or "")
+    if m is None:
+        return []
+    try:
+        items = json.loads(m.group(0))
+    except ValueError:
+        return []
+    found = []
+    for item in items:
+        if isinstance(item, dict) and item.get("code"):
+            found.append({"code": str(item["code"]), "x": _coord(item.get("x")), "y": _coord(item.get("y"))})
+        elif isinstance(item, (str, int)):
+            found.append({"code": str(item), "x": None, "y": None})
+    return found
+
+def _coord(v):
+    try:
+        return round(min(1.0, max(0.0, float(v))), 3)
+    except (TypeError, ValueError):
+        return None
+
+def _image_part(index: int):
+    return {"type": "image_url", "image_url": {"url": _IMAGE_SLOT.format(index)}}
+
+def build_payload(prompt: str, max_tokens=50):
+    """画像1枚ぶんの差し込み枠を持つリクエスト（encode_body で本体化する）。"""
+    return {
+        "model": OCR_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    _image_part(0)
+                ]
+            }
+        ],
+        "max_tokens": max_tokens
+    }
+
+def encode_body(payload: dict, images):
+    """JSON本体を1つの事前確保バッファに組み立てる。base64は文字列を経由せずチャンク毎に書き込む。"""
+    parts = _IMAGE_SLOT_RE.split(json.dumps(payload).encode("ascii"))
+    literals, slots = parts[0::2], [int(i) for i in parts[1::2]]
+    size = sum(len(p) for p in literals)
+    size += sum(len(_DATA_URL_HEAD) + 4 * ((len(images[i]) + 2) // 3) for i in slots)
+    body = bytearray(size)
+    out = memoryview(body)
+    pos = 0
+    for literal, slot in zip(literals, slots + [None]):
+        out[pos:pos + len(literal)] = literal
+        pos += len(literal)
+        if slot is None:
+            break
+        out[pos:pos + len(_DATA_URL_HEAD)] = _DATA_URL_HEAD
+        pos += len(_DATA_URL_HEAD)
+        src = memoryview(images[slot])
+        for i in range(0, len(src), B64_CHUNK):
+            encoded = binascii.b2a_base64(src[i:i + B64_CHUNK], newline=False)
+            out[pos:pos + len(encoded)] = encoded
+            pos += len(encoded)
+    return body
+
+def build_body(image_bytes: bytes, prompt: str, max_tokens=50):
+    return encode_body(build_payload(prompt, max_tokens), [image_bytes])
+
+
+# ------------------------------------------------------------
+# 🔁 送信（締切内で再試行、ブレーカー連動）
+# ------------------------------------------------------------
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+def post_chat(body, api_key: str, deadline=None, max_retries=MAX_RETRIES, session=None, hedged=False,
+              attempt_timeout=ATTEMPT_TIMEOUT):
+    """Chat Completions を呼び、応答テキストを返す。bodyは encode_body の結果（dictも可）。失敗時は OcrError 系を送出。"""
+    _count("calls")
+    if not breaker.allow():
+        _count("rejected")
+        raise CircuitOpenError(f"OCR APIを一時停止中（{breaker.retry_in():.0f}秒後に再試行）")
+    try:
+        return _post_attempts(body, api_key, deadline, max_retries, session, hedged, attempt_timeout)
+    except OcrError:
+        # OcrError 系はブレーカーへ記録済み
+        raise
+    except BaseException:
+        # 想定外の例外でも半開の試行枠を返し、失敗として数える（残ると再起動まで全OCRを拒否する）
+        _count("failures")
+        breaker.record_failure()
+        raise
+
+def _post_attempts(body, api_key, deadline, max_retries, session, hedged, attempt_timeout):
+    # 結果は必ず breaker.record_success / record_failure に記録してから返す・送出する
+    deadline = deadline or Deadline(SCAN_DEADLINE)
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+    if isinstance(body, dict):
+        body = json.dumps(body).encode("ascii")
+    last_error = None
+    out_of_time = False
+    for attempt in range(max_retries + 1):
+        if attempt:
+            _count("retries")
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+            if isinstance(last_error, OcrHttpError) and last_error.retry_after:
+                delay = max(delay, last_error.retry_after)
+            if delay >= deadline.remaining():
+                out_of_time = True
+                break
+            time.sleep(delay)
+        timeout = min(attempt_timeout, deadline.remaining())
+        if timeout <= 0:
+            out_of_time = True
+            break
+        _count("attempts")
+        try:
+            if hedged:
+                # 負けた側は締切まで走り続けるので、呼び出し元の session ではなくプールの接続を使う
+                response = _send_hedged(headers, body, timeout)
+            else:
+                response = _send_once(headers, body, timeout, session)
+        except requests.RequestException as e:
+            # タイムアウト・切断に加え、応答途中の切断（ChunkedEncodingError 等）も再試行
+            last_error = e
+            if deadline.remaining() <= 0:
+                out_of_time = True
+                break
+            continue
+        metrics.inc("upstream_responses_total", upstream="openai", code=response.status_code)
+        if response.status_code == 200:
+            breaker.record_success()
+            try:
+                return response.json()["choices"][0]["message"]["content"].strip()
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                _count("failures")
+                raise OcrError(f"OCR応答の解析に失敗: {e}")
+        last_error = OcrHttpError(response.status_code, response.text)
+        last_error.retry_after = _retry_after(response)
+        if response.status_code not in RETRY_STATUSES:
+            # 4xx（キー不正など）は再試行しない。APIは応答しているのでブレーカーは閉じる
+            breaker.record_success()
+            _count("failures")
+            raise last_error
+    _count("failures")
+    breaker.record_failure()
+    if out_of_time:
+        _count("deadline")
+        raise DeadlineExceeded(f"OCRが締切内に完了しませんでした: {last_error}")
+    if isinstance(last_error, OcrError):
+        raise last_error
+    raise OcrError(str(last_error))
+
+
+# ------------------------------------------------------------
+# 🧩 タイルバッチOCR（複数画像を1メッセージで送信）
+# ------------------------------------------------------------
+def build_batch_prompt(count: int, allow_alnum=False):
+    charset = "数字のみ" if not allow_alnum else "英数字のみ"
+    return (
+        f"以下の{count}枚の画像（#1〜#{count}）それぞれについて、中央付近に印字されたコードを{charset}・半角で読み取り、"
+        f'画像の順番どおりに長さ{count}のJSON文字列配列 ["...", ...] のみを返してください。'
+        "読めない画像は空文字にしてください。説明は不要です。"
+    )
+
+def build_batch_payload(count: int, allow_alnum=False):
+    content = [{"type": "text", "text": build_batch_prompt(count, allow_alnum)}]
+    for i in range(count):
+        content.append({"type": "text", "text": f"#{i + 1}"})
+        content.append(_image_part(i))
+    return {
+        "model": OCR_MODEL,
+        "messages": [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": content}],
+        "max_tokens": 30 * count + 50
+    }
+
+def build_batch_body(images, allow_alnum=False):
+    return encode_body(build_batch_payload(len(images), allow_alnum), images)
+
+def parse_batch_codes(raw: str, count: int):
+    """応答を画像順のコード列（長さcount、読めない分は空文字）にそろえる。"""
+    m = _JSON_ARRAY.search(raw or "")
+    items = []
+    if m is not None:
+        try:
+            items = json.loads(m.group(0))
+        except ValueError:
+            items = []
+    codes = [str(v.get("code", "")) if isinstance(v, dict) else str(v or "") for v in items][:count]
+    return codes + [""] * (count - len(codes))
+
+class OcrBatcher:
+    """submit() された画像を溜め、件数上限か待ち時間上限で1リクエストにまとめて送る。"""
+
+    def __init__(self, api_key, allow_alnum=False, min_size=BATCH_MIN, max_size=BATCH_MAX,
+                 max_wait=BATCH_MAX_WAIT, send=None):
+        self.api_key = api_key
+        self.allow_alnum = allow_alnum
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.size = min_size
+        self.stats = {"batches": 0, "images": 0, "timer_flushes": 0, "failed_batches": 0}
+        self._send = send or self._send_chat
+        self._pending = queue.Queue()
+        # 送信中のバッチが BATCH_SENDERS 本に達したら次を集めずに待つ（その間に溜まった分は大きいバッチになる）
+        self._senders = threading.BoundedSemaphore(BATCH_SENDERS)
+        self._pool = ThreadPoolExecutor(max_workers=BATCH_SENDERS, thread_name_prefix="ocr-batch")
+        self._stats_lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, image_bytes: bytes) -> Future:
+        fut = Future()
+        self._pending.put((image_bytes, fut))
+        return fut
+
+    def pending(self):
+        return self._pending.qsize()
+
+    def status(self):
+        batches = self.stats["batches"]
+        return {**self.stats, "batch_size": self.size, "pending": self.pending(),
+                "avg_batch": round(self.stats["images"] / batches, 2) if batches else 0.0}
+
+    def _send_chat(self, images):
+        body = build_batch_body(images, self.allow_alnum)
+        raw = post_chat(body, self.api_key, deadline=Deadline(BATCH_DEADLINE),
+                        attempt_timeout=ATTEMPT_TIMEOUT + BATCH_ATTEMPT_PER_IMAGE * (len(images) - 1))
+        return parse_batch_codes(raw, len(images))
+
+    def _collect(self):
+        batch = [self._pending.get()]
+        flush_at = time.monotonic() + self.max_wait
+        while len(batch) < self.size:
+            wait = flush_at - time.monotonic()
+            if wait <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def _adapt(self, filled):
+        # 積み残しが多ければ倍増、タイマーで半端に送ったら半減
+        if filled and self.pending() >= self.size:
+            self.size = min(self.max_size, self.size * 2)
+        elif not filled:
+            self.stats["timer_flushes"] += 1
+            self.size = max(self.min_size, self.size // 2)
+
+    def _run(self):
+        while True:
+            self._senders.acquire()
+            batch = self._collect()
+            self._adapt(len(batch) >= self.size)
+            with self._stats_lock:
+                self.stats["batches"] += 1
+                self.stats["images"] += len(batch)
+            self._pool.submit(self._deliver, batch)
+
+    def _deliver(self, batch):
+        try:
+            try:
+                codes = self._send([image_bytes for image_bytes, _ in batch])
+            except Exception as e:
+                with self._stats_lock:
+                    self.stats["failed_batches"] += 1
+                for _, fut in batch:
+                    fut.set_exception(e)
+                return
+            for (_, fut), code in zip(batch, codes):
+                fut.set_result(code)
+        finally:
+            self._senders.release()
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def _collect_metrics():
+    # Prometheus出力用：ブレーカー・送信カウンタ・ヘッジ・バッチ待ち行列
+    samples = [("ocr_breaker_state", "gauge", {"state": s}, int(breaker.state == s))
+               for s in ("closed", "open", "half_open")]
+    samples += [("ocr_events_total", "counter", {"event": k}, v) for k, v in stats.items()]
+    samples += [("ocr_hedge_requests_total", "counter", {"kind": "primary"}, hedge.primaries),
+                ("ocr_hedge_requests_total", "counter", {"kind": "hedge"}, hedge.hedges),
+                ("ocr_hedge_wins_total", "counter", {}, hedge.hedge_wins),
+                ("ocr_hedge_abandoned_total", "counter", {}, hedge.abandoned),
+                ("ocr_hedge_abandoned_running", "gauge", {}, hedge.abandoned_running)]
+    with _batchers_lock:
+        batchers = list(_batchers.items())
+    for (_, allow_alnum), b in batchers:
+        labels = {"alnum": str(allow_alnum).lower()}
+        samples += [("ocr_batch_queue_depth", "gauge", labels, b.pending()),
+                    ("ocr_batch_size", "gauge", labels, b.size),
+                    ("ocr_batches_total", "counter", labels, b.stats["batches"]),
+                    ("ocr_batch_images_total", "counter", labels, b.stats["images"])]
+    return samples
+
+metrics.collector("ocr", _collect_metrics)
+
+def get_batcher(api_key, allow_alnum=False):
+    with _batchers_lock:
+        key = (api_key, allow_alnum)
+        if key not in _batchers:
+            _batchers[key] = OcrBatcher(api_key, allow_alnum)
+        return _batchers[key]
@@ -0,0 +1,114 @@
+# shelf_pipeline
+# ⚙️ 画像パイプライン（1回のデコードでローカル復号・切り出し／プロセスプール＋共有メモリ）
+
+import os, threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+from shelf_vision import open_image, to_gray, detect_on_thumbnail, crop_box, encode_crop
+from shelf_decode import decode_code128_gray
+
+# 小さい入力はプロセス起動・転送のほうが高くつくのでスレッドで処理
+MIN_PROCESS_ITEMS = 4
+MIN_PROCESS_BYTES = 2 * 1024 * 1024
+WORKERS = os.cpu_count() or 1
+
+
+# ------------------------------------------------------------
+# 🧪 前処理本体（デコード1回）
+# ------------------------------------------------------------
+def preprocess(image_bytes: bytes, allow_alnum=False, auto_crop=True, keep_original=True):
+    """{"local_code", "ocr_bytes", "box"} を返す。ocr_bytes は切り出しJPEG（なければ元画像）。
+    近似フレームの判定は shelf_vision.frame_key で先に済ませる（再利用できればここは呼ばない）。"""
+    img = open_image(image_bytes)
+    box, _ = detect_on_thumbnail(img)
+    result = {"local_code": "", "ocr_bytes": None, "box": None}
+    if allow_alnum:
+        result["local_code"] = decode_code128_gray(to_gray(img), box) or ""
+    if auto_crop and not result["local_code"]:
+        crop = crop_box(box, img.width, img.height)
+        if crop is not None:
+            result["ocr_bytes"], result["box"] = encode_crop(img, crop), crop
+    if result["ocr_bytes"] is None and keep_original:
+        result["ocr_bytes"] = image_bytes
+    return result
+
+
+# ------------------------------------------------------------
+# 🧵 ワーカー側：共有メモリから入力を読む（画像はpickleしない）
+# ------------------------------------------------------------
+def _process_slice(shm_name, offset, length, allow_alnum, auto_crop):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = bytes(shm.buf[offset:offset + length])
+    finally:
+        shm.close()
+    # 元画像は親が持っているので返さない
+    return preprocess(data, allow_alnum, auto_crop, keep_original=False)
+
+
+# ------------------------------------------------------------
+# 🏭 プール（プロセス共通・遅延生成）
+# ------------------------------------------------------------
+class ImagePipeline:
+    def __init__(self, workers=WORKERS, min_process_items=MIN_PROCESS_ITEMS, min_process_bytes=MIN_PROCESS_BYTES):
+        self.workers = max(1, workers)
+        self.min_process_items = min_process_items
+        self.min_process_bytes = min_process_bytes
+        self.stats = {"process_batches": 0, "thread_batches": 0, "images": 0}
+        self._procs = None
+        self._threads = ThreadPoolExecutor(max_workers=self.workers)
+        self._lock = threading.Lock()
+
+    def _process_pool(self):
+        with self._lock:
+            if self._procs is None:
+                # Streamlitのスレッドを抱えたままforkしないようspawnで起動
+                self._procs = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"))
+            return self._procs
+
+    def use_processes(self, images):
+        return (self.workers > 1 and len(images) >= self.min_process_items
+                and sum(len(b) for b in images) >= self.min_process_bytes)
+
+    def map(self, images, allow_alnum=False, auto_crop=True):
+        """画像バイト列のリストを前処理し、同じ順で結果を返す。"""
+        images = list(images)
+        self.stats["images"] += len(images)
+        if not self.use_processes(images):
+            self.stats["thread_batches"] += 1
+            return list(self._threads.map(lambda b: preprocess(b, allow_alnum, auto_crop), images))
+        self.stats["process_batches"] += 1
+        return self._map_processes(images, allow_alnum, auto_crop)
+
+    def _map_processes(self, images, allow_alnum, auto_crop):
+        # 全画像を1つの共有メモリに詰め、ワーカーには (名前, 位置, 長さ) だけを渡す
+        total = sum(len(b) for b in images)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, total))
+        try:
+            offsets, pos = [], 0
+            for b in images:
+                shm.buf[pos:pos + len(b)] = b
+                offsets.append((pos, len(b)))
+                pos += len(b)
+            pool = self._process_pool()
+            futures = [pool.submit(_process_slice, shm.name, off, n, allow_alnum, auto_crop) for off, n in offsets]
+            results = [f.result() for f in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+        for original, result in zip(images, results):
+            if result["ocr_bytes"] is None:
+                result["ocr_bytes"] = original
+        return results
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = ImagePipeline()
+        return _pipeline
@@ -0,0 +1,138 @@
+# shelf_profile
+# 🔥 再実行単位のサンプリングプロファイラ（上位関数の表＋flame graph用の collapsed stack を保存）
+#   ?profile=1 または MY_SHELF_PROFILE=1 のときだけ動く。無効時は何もしない（フックも入れない）
+
+import os, sys, json, time, threading
+from collections import Counter
+
+PROFILE_ENV = "MY_SHELF_PROFILE"
+PROFILE_DIR = os.getenv("MY_SHELF_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".profiles"))
+SAMPLE_INTERVAL = 0.005
+TOP_N = 30
+KEEP_PROFILES = 50
+
+
+def enabled(query_params=None):
+    if os.getenv(PROFILE_ENV, "").lower() in ("1", "true", "yes", "on"):
+        return True
+    return bool(query_params) and str(query_params.get("profile", "")).lower() in ("1", "true", "on")
+
+def _label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# ------------------------------------------------------------
+# 🎯 サンプラー（対象スレッドのスタックを別スレッドから定期採取）
+# ------------------------------------------------------------
+class RerunSampler:
+    def __init__(self, name, root_file=None, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.name = name
+        self.root_file = os.path.abspath(root_file) if root_file else None
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            # スクリプト本体より外側（Streamlitの実行基盤）は切り捨てる
+            if self.root_file and os.path.abspath(frame.f_code.co_filename) == self.root_file \
+                    and frame.f_code.co_name == "<module>":
+                break
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stacks[self._stack(frame)] += 1
+            self.samples += 1
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, interrupted=False, out_dir=PROFILE_DIR):
+        """採取を止めて .collapsed と .top.txt を保存し、概要dictを返す。"""
+        self._stop.set()
+        self._thread.join()
+        duration = time.time() - self.started
+        summary = self.summary(duration, interrupted)
+        os.makedirs(out_dir, exist_ok=True)
+        base = os.path.join(out_dir, summary["id"])
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        with open(base + ".top.txt", "w", encoding="utf-8") as f:
+            f.write(self.top_table(summary))
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+        _prune(out_dir)
+        return summary
+
+    # --------------------------------------------------------
+    # 📊 集計
+    # --------------------------------------------------------
+    def collapsed(self):
+        # Brendan Gregg形式: 「根;…;葉 回数」を1行ずつ（flamegraph.pl / speedscope でそのまま読める）
+        return "".join(f"{';'.join(_label(c) for c in stack)} {n}\n" for stack, n in self.stacks.most_common())
+
+    def hot_functions(self, n=TOP_N):
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            if not stack:
+                continue
+            own[stack[-1]] += count
+            for code in set(stack):
+                total[code] += count
+        return [(_label(code), own[code], total[code]) for code, _ in own.most_common(n)]
+
+    def summary(self, duration, interrupted=False):
+        hot = self.hot_functions(1)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)) + f"{int(self.started * 1000) % 1000:03d}"
+        return {"id": f"{stamp}-{self.name}", "started": self.started, "duration_s": round(duration, 3),
+                "samples": self.samples, "interrupted": interrupted, "hottest": hot[0][0] if hot else None}
+
+    def top_table(self, summary):
+        per_sample = summary["duration_s"] / self.samples * 1000 if self.samples else 0.0
+        lines = [f"# {summary['id']}  {summary['duration_s'] * 1000:.0f}ms  {self.samples} samples"
+                 f"{'  (interrupted)' if summary['interrupted'] else ''}",
+                 f"{'self ms':>9}{'total ms':>10}  function"]
+        for label, own, total in self.hot_functions():
+            lines.append(f"{own * per_sample:>9.1f}{total * per_sample:>10.1f}  {label}")
+        return "\n".join(lines) + "\n"
+
+def _prune(out_dir, keep=KEEP_PROFILES):
+    summaries = sorted(f for f in os.listdir(out_dir) if f.endswith(".json"))
+    for name in summaries[:-keep]:
+        base = os.path.join(out_dir, name[:-len(".json")])
+        for ext in (".json", ".collapsed", ".top.txt"):
+            try:
+                os.remove(base + ext)
+            except OSError:
+                pass
+
+def recent_profiles(n=10, out_dir=PROFILE_DIR):
+    try:
+        names = sorted((f for f in os.listdir(out_dir) if f.endswith(".json")), reverse=True)[:n]
+    except OSError:
+        return []
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(out_dir, name), encoding="utf-8") as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+def profile_path(profile_id, ext=".collapsed", out_dir=PROFILE_DIR):
+    return os.path.join(out_dir, profile_id + ext)
@@ -0,0 +1,251 @@
+# shelf_sheets
+# 📗 Google Sheets 操作（検索・登録・書き戻し・Excel化／Streamlit非依存：アプリ／ベンチ共用）
+
+import os, re
+from io import BytesIO
+import pandas as pd
+import requests
+import gspread
+from gspread.utils import rowcol_to_a1
+
+from shelf_codes import normalize_code, canonical_code
+from shelf_lookup import UNKNOWN_TITLE
+from shelf_metrics import metrics
+
+SHEET_KEY = os.getenv("MY_SHELF_SHEET_KEY", "1lIDwaGMx-bMUXsLsF4p9_KmaXCyDPZIVeIdBen6ebE0")
+# ローカルのフェイク等へ向ける場合のAPIベースURL（例: http://127.0.0.1:8766）
+SHEETS_API_ENV = "MY_SHELF_SHEETS_URL"
+SHEETS_API_BASE = "https://sheets.googleapis.com"
+UNNAMED_TITLES = ("", UNKNOWN_TITLE, "商品名未取得")
+
+
+# ------------------------------------------------------------
+# ⏱️ API呼び出しの計測
+# ------------------------------------------------------------
+def timed(stage, fn, *args, method=None, **kwargs):
+    # Sheets API呼び出しをステージ計測し、メソッド別の回数と429などの応答コードも数える
+    metrics.inc("sheets_api_calls_total", method=method or fn.__name__)
+    with metrics.stage(stage):
+        try:
+            return fn(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            metrics.inc("upstream_responses_total", upstream="sheets", code=e.response.status_code)
+            raise
+
+
+# ------------------------------------------------------------
+# 🔌 接続先の差し替え（本番はアプリ側の認証クライアント）
+# ------------------------------------------------------------
+class _RebasedSession(requests.Session):
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(SHEETS_API_BASE):
+            url = self.base_url + url[len(SHEETS_API_BASE):]
+        return super().request(method, url, *args, **kwargs)
+
+def endpoint_client(base_url=None):
+    """MY_SHELF_SHEETS_URL（または base_url）へ向けた認証なしクライアント。未設定ならNone。"""
+    base_url = base_url or os.getenv(SHEETS_API_ENV)
+    if not base_url:
+        return None
+    return gspread.Client(None, session=_RebasedSession(base_url))
+
+def open_sheet(client, key=None):
+    return timed("sheet_open", lambda: client.open_by_key(key or SHEET_KEY).sheet1, method="open_by_key")
+
+def read_records(sheet):
+    return timed("sheet_read", sheet.get_all_records)
+
+
+# ------------------------------------------------------------
+# 🔍 検索（先頭列のコードを先頭ゼロ無視で一致）
+# ------------------------------------------------------------
+def find_in_records(records, code_to_find):
+    """(商品名, 画像URL) を返す。見つからなければ (None, None)。"""
+    df = pd.DataFrame(records)
+    left = df.iloc[:, 0].astype(str).str.lstrip("0")
+    right = str(code_to_find).lstrip("0")
+    hit = df[left == right]
+    if hit.empty:
+        return None, None
+    name = hit.iloc[0]["商品名"] if "商品名" in hit.columns else hit.iloc[0, 1]
+    img_url = hit.iloc[0]["画像URL"] if "画像URL" in hit.columns else None
+    return name, img_url
+
+def search(sheet, code_to_find, snapshot=None):
+    records = read_records(sheet)
+    if snapshot is not None and not snapshot.fresh():
+        # 古ければ全件読んだついでにローカルのスナップショットも同期する（新しければ索引の作り直しはしない）
+        snapshot.sync_records(records)
+    return find_in_records(records, code_to_find)
+
+
+# ------------------------------------------------------------
+# 💾 登録
+# ------------------------------------------------------------
+def append_one(sheet, code, product_name, img_url, registered_at, snapshot=None):
+    header = timed("sheet_read", sheet.row_values, 1)
+    col_map = {name: idx + 1 for idx, name in enumerate(header)}
+    next_row = len(timed("sheet_read", sheet.get_all_values)) + 1
+    values = {"コード": code, "商品名": product_name, "登録日": registered_at, "画像URL": img_url or ""}
+    for col in ("コード", "商品名", "登録日", "画像URL"):
+        if col in col_map:
+            timed("sheet_write", sheet.update_cell, next_row, col_map[col], values[col])
+    if snapshot is not None:
+        snapshot.note_append([{col: values.get(col, "") for col in header}])
+
+def append_many(sheet, items, registered_at, snapshot=None):
+    # (コード, 商品名, 画像URL) の列を append_rows 1回で登録し、件数を返す
+    header = timed("sheet_read", sheet.row_values, 1)
+    rows = []
+    for code, name, img_url in items:
+        values = {"コード": code, "商品名": name, "登録日": registered_at, "画像URL": img_url or ""}
+        rows.append([values.get(col, "") for col in header])
+    if rows:
+        timed("sheet_write", sheet.append_rows, rows, value_input_option="USER_ENTERED")
+        if snapshot is not None:
+            snapshot.note_append([dict(zip(header, row)) for row in rows])
+    return len(rows)
+
+
+# ------------------------------------------------------------
+# 🔢 数量モード（登録済みのコードは行を増やさず数量列に加算）
+# ------------------------------------------------------------
+QTY_COLUMN = "数量"
+
+def tally(items):
+    """(コード, 商品名, 画像URL) の列をコード毎に (コード, 商品名, 画像URL, 個数) へまとめる（初出順）。"""
+    merged = {}
+    for code, name, img_url in items:
+        key = canonical_code(code)
+        if key in merged:
+            merged[key][3] += 1
+        else:
+            merged[key] = [code, name, img_url, 1]
+    return [tuple(v) for v in merged.values()]
+
+def _quantity(value):
+    # 数量列ができる前の行（空欄）は1スキャン1行なので1個と数える
+    try:
+        return int(float(str(value).strip() or 1))
+    except ValueError:
+        return 1
+
+def _cell(value_range):
+    return value_range[0][0] if value_range and value_range[0] else ""
+
+def _rows_in_code_column(sheet, code_col, codes):
+    # コード列だけを1回で読み、各コードのシート上の行番号（無ければNone）を返す（全件読みよりずっと小さい）
+    letter = re.sub(r"\d", "", rowcol_to_a1(1, code_col))
+    column = timed("sheet_read", sheet.get, f"{letter}2:{letter}", method="get")
+    found = {}
+    for i, cells in enumerate(column, start=2):
+        code = canonical_code(cells[0]) if cells else ""
+        if code:
+            found.setdefault(code, i)
+    return [found.get(canonical_code(code)) for code in codes]
+
+def add_quantities(sheet, items, registered_at, snapshot):
+    """tally() でまとめた (コード, 商品名, 画像URL, 個数) を数量列に加算し、(加算した行数, 追記した行数) を返す。
+    登録済みのコードはスナップショットの行番号で数量セルだけを書き換え、未登録のコードだけ追記する。
+    スナップショットは最大 MAX_AGE 古いので、未登録に見えるコードは追記の前にコード列を読んで確かめる。
+    加算は「読む→書く」でSheetsに排他がないため、その間（1往復分）に他の端末が同じ行へ加算すると1回分が消える。"""
+    header = timed("sheet_read", sheet.row_values, 1)
+    if QTY_COLUMN not in header:
+        timed("sheet_write", sheet.update_cell, 1, len(header) + 1, QTY_COLUMN)
+        header.append(QTY_COLUMN)
+        snapshot.note_column(QTY_COLUMN)
+    if not snapshot.fresh():
+        # 他の端末が登録したコードを追記で重複させないよう、古ければ全件読みで同期し直す
+        snapshot.sync_records(read_records(sheet))
+    code_col = header.index("コード") + 1 if "コード" in header else 1
+    qty_col = header.index(QTY_COLUMN) + 1
+
+    for attempt in range(2):
+        rows = [snapshot.row_number(item[0]) for item in items]
+        if not all(rows):
+            # 他の端末・手入力で同期後に登録されたコードを重複して追記しない
+            confirmed = _rows_in_code_column(sheet, code_col, [item[0] for item in items])
+            rows = [row or found for row, found in zip(rows, confirmed)]
+        existing = [(row, item) for row, item in zip(rows, items) if row]
+        # 手で行を消した等で行がずれていないか、加算前に各行のコードと数量を1回で読んで確かめる
+        ranges = [rowcol_to_a1(row, col) for row, _ in existing for col in (code_col, qty_col)]
+        cells = timed("sheet_read", sheet.batch_get, ranges) if ranges else []
+        shifted = any(canonical_code(_cell(cells[2 * i])) != canonical_code(item[0])
+                      for i, (_, item) in enumerate(existing))
+        if not shifted:
+            break
+        if attempt:
+            raise RuntimeError("シートの行番号がローカル索引と一致しません。再同期してからやり直してください。")
+        snapshot.sync_records(read_records(sheet))
+
+    # 読んだ数量にすぐ足して書く（読んでから書くまでの間を短くする）
+    updates, counts = [], []
+    for i, (row, (_, _, _, count)) in enumerate(existing):
+        total = _quantity(_cell(cells[2 * i + 1])) + count
+        updates.append({"range": rowcol_to_a1(row, qty_col), "values": [[total]]})
+        counts.append((row, total))
+    if updates:
+        timed("sheet_write", sheet.batch_update, updates)
+        for row, total in counts:
+            snapshot.note_update(row, {QTY_COLUMN: total})
+
+    new_rows = []
+    for code, name, img_url, count in (item for row, item in zip(rows, items) if not row):
+        values = {"コード": code, "商品名": name, "登録日": registered_at, "画像URL": img_url or "", QTY_COLUMN: count}
+        new_rows.append([values.get(col, "") for col in header])
+    if new_rows:
+        timed("sheet_write", sheet.append_rows, new_rows, value_input_option="USER_ENTERED")
+        snapshot.note_append([dict(zip(header, row)) for row in new_rows])
+    return len(updates), len(new_rows)
+
+
+# ------------------------------------------------------------
+# 📚 商品名不明行の抽出と書き戻し
+# ------------------------------------------------------------
+def unnamed_rows(records):
+    # 商品名不明の行を (行番号, コード) で返す
+    rows = []
+    for idx, rec in enumerate(records):
+        name = str(rec.get("商品名", "")).strip()
+        code = normalize_code(str(rec.get("コード", "") or list(rec.values())[0]))
+        if code and name in UNNAMED_TITLES:
+            rows.append((idx + 2, code))
+    return rows
+
+def backfill(sheet, row_codes, results, snapshot=None):
+    # 解決済み商品名を1回のbatch_updateで書き戻し、更新セル数を返す
+    header = timed("sheet_read", sheet.row_values, 1)
+    col_map = {name: idx + 1 for idx, name in enumerate(header)}
+    resolved = {r["コード"]: r for r in results if r["商品名"] and r["商品名"] != UNKNOWN_TITLE}
+    updates, changed = [], []
+    for row, code in row_codes:
+        hit = resolved.get(code)
+        if not hit:
+            continue
+        changed.append((row, {"商品名": hit["商品名"], **({"画像URL": hit["画像URL"]} if hit["画像URL"] else {})}))
+        if "商品名" in col_map:
+            updates.append({"range": rowcol_to_a1(row, col_map["商品名"]), "values": [[hit["商品名"]]]})
+        if "画像URL" in col_map and hit["画像URL"]:
+            updates.append({"range": rowcol_to_a1(row, col_map["画像URL"]), "values": [[hit["画像URL"]]]})
+    if updates:
+        timed("sheet_write", sheet.batch_update, updates)
+        if snapshot is not None:
+            # 書き戻した商品名をローカル索引にも反映（商品名検索ですぐ引けるように）
+            for row, values in changed:
+                snapshot.note_update(row, values)
+    return len(updates)
+
+
+# ------------------------------------------------------------
+# 📤 Excel化
+# ------------------------------------------------------------
+def records_to_xlsx(records):
+    with metrics.stage("excel_build"):
+        buf = BytesIO()
+        pd.DataFrame(records).to_excel(buf, index=False, engine="xlsxwriter")
+        buf.seek(0)
+        return buf
@@ -0,0 +1,355 @@
+# shelf_snapshot
+# 🗂️ シートのローカルスナップショット（古ければ全件読みで同期・登録時に追記・ディスクへ保存／Streamlit非依存）
+#   コード→行番号の索引・未登録判定用のブルームフィルタ・補完用のソート済みコード索引・商品名のバイグラム索引を一緒に持つ
+
+import os, json, gzip, time, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from shelf_bloom import BloomFilter
+from shelf_codeindex import CodeIndex, COMPLETE_LIMIT
+from shelf_codes import canonical_code
+from shelf_metrics import metrics
+from shelf_namesearch import NameIndex, SEARCH_LIMIT
+
+SNAPSHOT_DIR = os.getenv("MY_SHELF_SNAPSHOT_DIR",
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sheet_snapshot"))
+# 他の端末の登録はこの秒数までしか見逃さない（古ければ未登録判定に使わず全件読みで同期し直す）
+MAX_AGE = float(os.getenv("MY_SHELF_SNAPSHOT_MAX_AGE", "600"))
+# 追記で溢れないよう、行数のこの倍を見込んでブルームフィルタを作る
+BLOOM_HEADROOM = 2
+MIN_BLOOM_CAPACITY = 1024
+# 全件の保存（gzip）はスクリプトのスレッドを止めないよう1本のスレッドで順に書く
+_saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-save")
+
+
+class SheetSnapshot:
+    def __init__(self, key, root=SNAPSHOT_DIR, max_age=MAX_AGE):
+        self.key = key
+        self.max_age = max_age
+        self.header = []
+        self.rows = []
+        self.synced_at = None
+        self.row_of = {}
+        self.bloom = BloomFilter(MIN_BLOOM_CAPACITY)
+        self.code_index = CodeIndex()
+        # 商品名の索引は大きい（10万行で数秒）ので、同期後の最初の商品名検索で作る（None は未作成）
+        self.name_index = None
+        self._lock = threading.RLock()
+        self._names_lock = threading.Lock()
+        self._edits = 0
+        self._renamed = set()
+        self._saving = None
+        base = os.path.join(root, hashlib.sha256(key.encode("utf-8")).hexdigest()[:16])
+        self._paths = {"rows": base + ".json.gz", "appends": base + ".appends.jsonl", "bloom": base + ".bloom"}
+
+    # --------------------------------------------------------
+    # 🔄 同期（全件読みの結果で置き換え）と追記
+    # --------------------------------------------------------
+    def sync_records(self, records):
+        """get_all_records() の結果で置き換えて保存する。"""
+        header = list(records[0].keys()) if records else list(self.header)
+        self.replace(header, [[rec.get(col, "") for col in header] for rec in records])
+
+    def replace(self, header, rows, synced_at=None):
+        # 索引はロックの外で作ってから差し替える（作っている間も absent()/complete() は古い索引で答える）
+        header, rows = list(header), [list(r) for r in rows]
+        built = self._build(header, rows)
+        with self._lock:
+            name_index, old_header, old_rows, edits = self.name_index, self.header, self.rows, self._edits
+        # 商品名が前回と同じなら商品名の索引はそのまま使う
+        if name_index is not None and [_name_of(header, r) for r in rows] != [_name_of(old_header, r) for r in old_rows]:
+            name_index = None
+        with self._lock:
+            if self._edits != edits:
+                name_index = None
+            self.header, self.rows = header, rows
+            self.synced_at = synced_at or time.time()
+            self.row_of, self.code_index, self.bloom = built
+            self.name_index = name_index
+            self._edits += 1
+            self._renamed = set()
+            self._start_journal()
+            self._saving = _saver.submit(self._write_quietly, *self._save_args())
+
+    def flush(self):
+        """裏で書いている保存が終わるまで待つ（ベンチ・終了時用）。"""
+        saving = self._saving
+        if saving is not None:
+            saving.result()
+
+    def note_append(self, records):
+        """登録した行（{列名: 値}）を末尾に足し、索引とブルームフィルタも更新する。"""
+        with self._lock:
+            if not self.header and records:
+                self.header = list(records[0].keys())
+            added = [[rec.get(col, "") for col in self.header] for rec in records]
+            for row in added:
+                self.rows.append(row)
+                self._index_row(len(self.rows) - 1)
+            if self.bloom.full():
+                self._rebuild_bloom()
+            self._journal(added)
+
+    def note_update(self, row_number, values):
+        """シートの既存行（行番号は2始まり）を書き換えたときに {列名: 値} で反映する（商品名の書き戻し等）。"""
+        with self._lock:
+            i = row_number - 2
+            if not 0 <= i < len(self.rows):
+                return
+            row = self.rows[i]
+            for col, value in values.items():
+                if col in self.header:
+                    j = self.header.index(col)
+                    row.extend([""] * (j + 1 - len(row)))
+                    row[j] = value
+            self._edits += 1
+            self._renamed.add(i)
+            if self.name_index is not None:
+                self.name_index.add(i, self._name_of(row))
+            self._journal_update(row_number, row)
+
+    def note_column(self, name):
+        """シートのヘッダーに列を足したとき（数量列など）。既存行は空欄のまま。"""
+        with self._lock:
+            if name not in self.header:
+                self.header.append(name)
+                self._journal([{"header": self.header}], bloom=False)
+
+    def _code_column(self):
+        return _code_column(self.header)
+
+    def _name_of(self, row):
+        return _name_of(self.header, row)
+
+    def _index_row(self, i):
+        self._edits += 1
+        if self.name_index is not None:
+            self.name_index.add(i, self._name_of(self.rows[i]))
+        code = canonical_code(self.rows[i][self._code_column()]) if self.rows[i] else ""
+        if code and code not in self.row_of:
+            # 重複登録は最初の行（find_in_records と同じ）
+            self.row_of[code] = i + 2
+            self.bloom.add(code)
+            self.code_index.add(code)
+
+    @staticmethod
+    def _build(header, rows, bloom=True):
+        """(row_of, code_index, bloom) を作る。インスタンスに触らないのでロック不要。"""
+        code_col = _code_column(header)
+        row_of = {}
+        for i, row in enumerate(rows):
+            code = canonical_code(row[code_col]) if row else ""
+            if code and code not in row_of:
+                # 重複登録は最初の行（find_in_records と同じ）
+                row_of[code] = i + 2
+        return row_of, CodeIndex(row_of), (_bloom_of(row_of) if bloom else None)
+
+    def _rebuild_bloom(self):
+        self.bloom = _bloom_of(self.row_of)
+
+    # --------------------------------------------------------
+    # 🔍 問い合わせ
+    # --------------------------------------------------------
+    def fresh(self):
+        return self.synced_at is not None and time.time() - self.synced_at < self.max_age
+
+    def absent(self, code):
+        """True なら同期時点のシートに確実に無い（False は「あるかもしれない」）。"""
+        key = canonical_code(code)
+        with self._lock:
+            return bool(key) and key not in self.bloom
+
+    def complete(self, text, limit=COMPLETE_LIMIT):
+        """入力途中のコードから登録済みの候補を [(シート上のコード, 商品名)] で返す。"""
+        with self._lock:
+            found = self.code_index.complete(text, limit)
+            return [self.row_values(code) for code in found]
+
+    def row_number(self, code):
+        """登録済みならシート上の行番号（2始まり・重複登録は最初の行）、なければNone。"""
+        with self._lock:
+            return self.row_of.get(canonical_code(code))
+
+    def search_names(self, query, limit=SEARCH_LIMIT):
+        """商品名の部分一致（表記ゆれ・多少の誤字を許す）で [(シート上のコード, 商品名, 行番号)] を良い順に返す。"""
+        while True:
+            index = self._names()
+            with self._lock:
+                if index is not self.name_index:
+                    # 作っている間に同期し直された
+                    continue
+                found = index.search(query, limit)
+                return [(str(self.rows[i][self._code_column()]) if self.rows[i] else "", self._name_of(self.rows[i]), i + 2)
+                        for i, _ in found]
+
+    def _names(self):
+        # 商品名の索引を（なければ）ロックの外で作る。作っている間の追記・書き換えは最後に足す
+        with self._names_lock:
+            with self._lock:
+                if self.name_index is not None:
+                    return self.name_index
+                rows, count = self.rows, len(self.rows)
+                names = [self._name_of(row) for row in rows]
+                self._renamed = set()
+            index = NameIndex.of(names)
+            with self._lock:
+                if self.rows is rows:
+                    for i in sorted(self._renamed | set(range(count, len(rows)))):
+                        index.add(i, self._name_of(rows[i]))
+                    self.name_index = index
+                return index
+
+    def row_values(self, code):
+        row = self.rows[self.row_of[code] - 2]
+        return str(row[self._code_column()]), self._name_of(row)
+
+    def age(self):
+        return None if self.synced_at is None else time.time() - self.synced_at
+
+    # --------------------------------------------------------
+    # 💾 保存・読み込み（本体はgzip JSON、登録分は追記ジャーナル、ブルームはビット列のまま）
+    # --------------------------------------------------------
+    def save(self):
+        with self._lock:
+            self._start_journal()
+            args = self._save_args()
+        self._write(*args)
+
+    def _save_args(self):
+        # 行リストの浅いコピーを渡す（以後の追記はジャーナル側に書かれる）
+        return self.synced_at, list(self.header), list(self.rows), self.bloom.to_bytes()
+
+    def _write(self, synced_at, header, rows, bloom_bytes):
+        os.makedirs(os.path.dirname(self._paths["rows"]), exist_ok=True)
+        tmp = _tmp_path(self._paths["rows"])
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=3) as f:
+            json.dump({"key": self.key, "synced_at": synced_at, "header": header, "rows": rows},
+                      f, ensure_ascii=False)
+        os.replace(tmp, self._paths["rows"])
+        _write_bytes(self._paths["bloom"], bloom_bytes)
+
+    def _write_quietly(self, *args):
+        try:
+            self._write(*args)
+        except OSError:
+            # 保存できなくてもメモリ上の索引は使える
+            pass
+
+    def _start_journal(self):
+        # 同期より前の追記は新しい行に含まれるので捨て、どの同期に続く追記かを先頭に書く
+        # （本体の保存より先に落ちても、古い本体に新しい追記を重ねないように）
+        try:
+            os.makedirs(os.path.dirname(self._paths["appends"]), exist_ok=True)
+            with open(self._paths["appends"], "w", encoding="utf-8") as f:
+                f.write(json.dumps({"base": self.synced_at}) + "\n")
+        except OSError:
+            pass
+
+    def _save_bloom(self):
+        _write_bytes(self._paths["bloom"], self.bloom.to_bytes())
+
+    def _journal(self, rows, bloom=True):
+        # 追記は行そのもの（リスト）、既存行の書き換えは {"row": 行番号, "values": 行}、列の追加は {"header": [...]} で1行ずつ
+        # （先頭は続き元の同期時刻 {"base": synced_at}）
+        try:
+            with open(self._paths["appends"], "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            if bloom:
+                self._save_bloom()
+        except OSError:
+            # 保存できなくてもメモリ上の索引は正しい（次の同期で作り直す）
+            pass
+
+    def _journal_update(self, row_number, row):
+        self._journal([{"row": row_number, "values": row}], bloom=False)
+
+    def load(self):
+        with self._lock:
+            try:
+                with gzip.open(self._paths["rows"], "rt", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return False
+            self.header, self.rows, self.synced_at = data["header"], data["rows"], data["synced_at"]
+            try:
+                with open(self._paths["appends"], encoding="utf-8") as f:
+                    for entry in (json.loads(line) for line in f if line.strip()):
+                        if isinstance(entry, dict) and "base" in entry:
+                            if entry["base"] != self.synced_at:
+                                # 別の同期に続く追記（本体の保存前に落ちた）なので重ねない
+                                break
+                        elif isinstance(entry, dict) and "header" in entry:
+                            self.header = entry["header"]
+                        elif isinstance(entry, dict):
+                            if 0 <= entry["row"] - 2 < len(self.rows):
+                                self.rows[entry["row"] - 2] = entry["values"]
+                        else:
+                            self.rows.append(entry)
+            except (OSError, ValueError):
+                pass
+            self.row_of, self.code_index, _ = self._build(self.header, self.rows, bloom=False)
+            self.name_index = None
+            self._edits += 1
+            try:
+                with open(self._paths["bloom"], "rb") as f:
+                    self.bloom = BloomFilter.from_bytes(f.read())
+            except (OSError, ValueError):
+                self.bloom = None
+            # 保存済みのブルームが行と食い違う（ジャーナル書き込み後に落ちた等）なら作り直す
+            if self.bloom is None or self.bloom.count != len(self.row_of) or self.bloom.full():
+                self._rebuild_bloom()
+            return True
+
+    def status(self):
+        with self._lock:
+            return {"rows": len(self.rows), "codes": len(self.row_of), "age_s": self.age(),
+                    "bloom_kb": round(self.bloom.nbytes() / 1024, 1), "bloom_fp": round(self.bloom.expected_fp_rate(), 4)}
+
+
+def _code_column(header):
+    return header.index("コード") if "コード" in header else 0
+
+def _name_of(header, row):
+    name_col = header.index("商品名") if "商品名" in header else 1
+    return row[name_col] if name_col < len(row) else ""
+
+def _bloom_of(codes):
+    bloom = BloomFilter(max(MIN_BLOOM_CAPACITY, len(codes) * BLOOM_HEADROOM))
+    for code in codes:
+        bloom.add(code)
+    return bloom
+
+def _tmp_path(path):
+    # 保存スレッドとジャーナル側が同じ一時ファイルを使わないようスレッド毎に分ける
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def _write_bytes(path, data):
+    tmp = _tmp_path(path)
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+def get_snapshot(key):
+    """シート毎に1つ（プロセス内で共有）。初回はディスクから読み込む。"""
+    with _snapshots_lock:
+        snap = _snapshots.get(key)
+        if snap is None:
+            snap = _snapshots[key] = SheetSnapshot(key)
+            snap.load()
+        return snap
+
+def _collect_metrics():
+    samples = []
+    for key, snap in list(_snapshots.items()):
+        status = snap.status()
+        samples.append(("sheet_snapshot_rows", "gauge", {}, status["rows"]))
+        if status["age_s"] is not None:
+            samples.append(("sheet_snapshot_age_seconds", "gauge", {}, round(status["age_s"], 1)))
+    return samples
+
+metrics.collector("sheet_snapshot", _collect_metrics)
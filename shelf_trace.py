@@ -0,0 +1,103 @@
+# shelf_trace
+# 🧵 スキャン単位のトレースログ（1スキャン＝1トレースID。OCR・JANCodeLookup・Sheets書き込みの各区間をJSON Linesに記録）
+#   shelf_metrics の stage()/hit() の区間を、トレースが有効な間だけローテーション付きファイルへ書き出す
+#   集計は python bench/trace_report.py
+
+import os, json, uuid, logging, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from shelf_metrics import metrics
+
+TRACE_LOG = os.getenv("MY_SHELF_TRACE_LOG",
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), ".traces", "spans.jsonl"))
+MAX_BYTES = int(os.getenv("MY_SHELF_TRACE_MAX_BYTES", 5 * 2**20))
+BACKUPS = 5
+
+_current = ContextVar("shelf_trace_id", default=None)
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def new_id():
+    return uuid.uuid4().hex[:16]
+
+def current():
+    return _current.get()
+
+@contextmanager
+def use(trace_id):
+    """このブロック内の区間を trace_id に紐づける（Streamlitの再実行をまたいで同じIDを渡せる）。"""
+    token = _current.set(trace_id)
+    try:
+        yield trace_id
+    finally:
+        _current.reset(token)
+
+
+# ------------------------------------------------------------
+# 📝 書き出し（サイズでローテーション：spans.jsonl → spans.jsonl.1 …）
+# ------------------------------------------------------------
+def _get_logger(path=TRACE_LOG):
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("my_shelf.trace")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+        return _logger
+
+def span_record(trace_id, name, started, seconds, span):
+    return {"trace": trace_id, "span": name, "start": round(started, 3), "ms": round(seconds * 1000, 1),
+            "outcome": "error" if span.failed else "ok", "bytes": span.bytes, "tier": span.tier, "depth": span.depth}
+
+def _on_span(name, started, seconds, span):
+    trace_id = _current.get()
+    if trace_id is None:
+        return
+    _get_logger().info(json.dumps(span_record(trace_id, name, started, seconds, span), ensure_ascii=False))
+
+metrics.listener("trace", _on_span)
+
+
+# ------------------------------------------------------------
+# 📖 読み込みと集計
+# ------------------------------------------------------------
+def log_files(path=TRACE_LOG):
+    # 古い順（.5 → … → .1 → 本体）
+    backups = [f"{path}.{i}" for i in range(BACKUPS, 0, -1)]
+    return [p for p in backups + [path] if os.path.exists(p)]
+
+def read_spans(path=TRACE_LOG):
+    for name in log_files(path):
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 書き込み途中の行などは飛ばす
+                    continue
+
+def group_traces(spans):
+    """トレースID毎に {trace, start, ms, spans, errors, stages} へまとめる。ms は最初の開始から最後の終了まで。"""
+    traces = {}
+    for s in spans:
+        t = traces.setdefault(s["trace"], {"trace": s["trace"], "start": s["start"], "end": s["start"],
+                                           "spans": [], "errors": 0})
+        t["spans"].append(s)
+        t["start"] = min(t["start"], s["start"])
+        t["end"] = max(t["end"], s["start"] + s["ms"] / 1000)
+        t["errors"] += s["outcome"] == "error"
+    for t in traces.values():
+        t["ms"] = round((t["end"] - t["start"]) * 1000, 1)
+        t["spans"].sort(key=lambda s: s["start"])
+    return list(traces.values())
+
+def busy_ms(trace):
+    # 最上位の区間の合計（再実行の間に店員が操作していた時間も、入れ子の区間の二重計上も含めない）
+    return round(sum(s["ms"] for s in trace["spans"] if not s.get("depth")), 1)
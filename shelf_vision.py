@@ -0,0 +1,296 @@
+# shelf_vision
+# 🖼️ 画像前処理（NumPyでバーコード領域を検出して切り出し／Streamlit非依存）
+
+import io, threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageOps
+
+from shelf_metrics import metrics
+
+# 検出は長辺この画素数まで縮小して行う
+DETECT_MAX_SIDE = 800
+CELL = 8
+# 切り出し余白（バー方向の左右・上、下側は印字数字ぶん広め）
+PAD_SIDE = 0.08
+PAD_TOP = 0.10
+PAD_BOTTOM = 0.45
+# 画像のほぼ全体なら切り出さない
+MAX_CROP_FRACTION = 0.6
+CROP_JPEG_QUALITY = 90
+
+# プレビュー用サムネイル
+PREVIEW_MAX_SIDE = 640
+PREVIEW_JPEG_QUALITY = 80
+
+# 近似フレーム判定（dHash 64bit は候補の絞り込みだけ。同じ商品かはバー幅の署名で確かめる）
+HASH_SIZE = 8
+HASH_INDEX_SIZE = 64
+HASH_MAX_DISTANCE = 5
+# バー幅署名：静寂域とみなす明部の幅（最細バー比）・最低ラン数・同じとみなすバー＋スペース幅の差（モジュール）
+SIGNATURE_QUIET = 7
+SIGNATURE_MIN_RUNS = 20
+SIGNATURE_MAX_MODULES = 1.0
+
+
+# ------------------------------------------------------------
+# 📥 読み込み（EXIF回転・JPEGドラフト縮小）
+# ------------------------------------------------------------
+def open_image(image_bytes: bytes, max_side=None):
+    img = Image.open(io.BytesIO(image_bytes))
+    if max_side and img.format == "JPEG":
+        # JPEGはデコード時に1/2〜1/8へ縮小できる
+        img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side))
+    return img
+
+def to_gray(img):
+    return np.asarray(img.convert("L"), dtype=np.float32)
+
+def make_thumbnail(image_bytes: bytes, max_side=PREVIEW_MAX_SIDE):
+    """プレビュー用JPEG。JPEGはドラフトモードで縮小デコードするので全画素を展開しない。"""
+    img = open_image(image_bytes, max_side=max_side)
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=PREVIEW_JPEG_QUALITY)
+    return buf.getvalue()
+
+
+# ------------------------------------------------------------
+# 🔎 バーコード領域検出（勾配の向きの偏り → 粗い格子で連結成分）
+# ------------------------------------------------------------
+def _box_mean(a, ky, kx):
+    # 積分画像による箱型平均（同サイズで返す）
+    pad = np.pad(a, ((ky // 2 + 1, ky - ky // 2), (kx // 2 + 1, kx - kx // 2)), mode="edge")
+    ii = pad.cumsum(0).cumsum(1)
+    h, w = a.shape
+    s = ii[ky:ky + h, kx:kx + w] - ii[:h, kx:kx + w] - ii[ky:ky + h, :w] + ii[:h, :w]
+    return s / float(ky * kx)
+
+def _cells(a, cell=CELL):
+    h, w = a.shape[0] // cell * cell, a.shape[1] // cell * cell
+    return a[:h, :w].reshape(h // cell, cell, w // cell, cell).mean(axis=(1, 3))
+
+def _grow(seed, mask):
+    # マスク内で種から膨張を繰り返す（4近傍の塗りつぶし）
+    region = seed & mask
+    while True:
+        grown = region.copy()
+        grown[1:, :] |= region[:-1, :]
+        grown[:-1, :] |= region[1:, :]
+        grown[:, 1:] |= region[:, :-1]
+        grown[:, :-1] |= region[:, 1:]
+        grown &= mask
+        if (grown == region).all():
+            return region
+        region = grown
+
+def _oriented_region(gray, bars_vertical):
+    gy, gx = np.abs(np.diff(gray, axis=0, append=gray[-1:, :])), np.abs(np.diff(gray, axis=1, append=gray[:, -1:]))
+    across, along = (gx, gy) if bars_vertical else (gy, gx)
+    k = max(3, min(gray.shape) // 40)
+    score = np.clip(_box_mean(across, k, k) - _box_mean(along, k, k), 0, None)
+    cells = _cells(score)
+    if cells.size == 0 or cells.max() <= 0:
+        return None, 0.0
+    mask = cells >= max(cells.max() * 0.35, cells.mean() + 2 * cells.std())
+    seed = np.zeros_like(mask)
+    seed[np.unravel_index(np.argmax(cells), cells.shape)] = True
+    region = _grow(seed, mask)
+    ys, xs = np.nonzero(region)
+    box = (xs.min() * CELL, ys.min() * CELL, (xs.max() + 1) * CELL, (ys.max() + 1) * CELL)
+    return box, float(cells[region].sum())
+
+def detect_barcode_region(gray):
+    """グレースケール配列からバーコードらしい領域 (x0, y0, x1, y1, 縦バーか) を返す。"""
+    best = None
+    for vertical in (True, False):
+        box, energy = _oriented_region(gray, vertical)
+        if box is not None and (best is None or energy > best[1]):
+            best = (box + (vertical,), energy)
+    return best[0] if best else None
+
+def _pad_box(box, width, height):
+    x0, y0, x1, y1, vertical = box
+    bw, bh = x1 - x0, y1 - y0
+    if vertical:
+        # 縦バー：数字は下側
+        x0, x1 = x0 - bw * PAD_SIDE, x1 + bw * PAD_SIDE
+        y0, y1 = y0 - bh * PAD_TOP, y1 + bh * PAD_BOTTOM
+    else:
+        # 横バー（90°回転）：数字はどちらかの横にあるので左右両方を広げる
+        x0, x1 = x0 - bw * PAD_BOTTOM, x1 + bw * PAD_BOTTOM
+        y0, y1 = y0 - bh * PAD_SIDE, y1 + bh * PAD_SIDE
+    return max(0, int(x0)), max(0, int(y0)), min(width, int(x1)), min(height, int(y1))
+
+
+# ------------------------------------------------------------
+# ✂️ 切り出し（見つからなければ元画像のまま）
+# ------------------------------------------------------------
+def scale_box(box, scale):
+    x0, y0, x1, y1, vertical = box
+    return int(x0 * scale), int(y0 * scale), int(x1 * scale), int(y1 * scale), vertical
+
+def detect_on_thumbnail(img):
+    """縮小画像で検出し、(元画像座標の検出枠 or None, 縮小グレー配列) を返す。"""
+    small = img.copy()
+    small.thumbnail((DETECT_MAX_SIDE, DETECT_MAX_SIDE))
+    gray = to_gray(small)
+    box = detect_barcode_region(gray)
+    return (scale_box(box, img.width / small.width) if box else None), gray
+
+def crop_box(box, width, height):
+    """検出枠に余白を足した切り出し枠。画像のほぼ全体ならNone。"""
+    if box is None:
+        return None
+    crop = _pad_box(box, width, height)
+    if (crop[2] - crop[0]) * (crop[3] - crop[1]) > MAX_CROP_FRACTION * width * height:
+        return None
+    return crop
+
+def encode_crop(img, crop):
+    buf = io.BytesIO()
+    img.crop(crop).convert("RGB").save(buf, format="JPEG", quality=CROP_JPEG_QUALITY)
+    return buf.getvalue()
+
+def find_barcode_box(image_bytes: bytes):
+    """元画像座標での切り出し枠 (x0, y0, x1, y1) と元画像を返す。見つからなければ枠はNone。"""
+    img = open_image(image_bytes)
+    box, _ = detect_on_thumbnail(img)
+    return crop_box(box, img.width, img.height), img
+
+def crop_to_barcode(image_bytes: bytes):
+    """(切り出しJPEGバイト列, 枠) を返す。見つからなければ (元バイト列, None)。"""
+    crop, img = find_barcode_box(image_bytes)
+    if crop is None:
+        return image_bytes, None
+    return encode_crop(img, crop), crop
+
+
+# ------------------------------------------------------------
+# 🧬 知覚ハッシュ（dHash）と近似フレーム索引
+# ------------------------------------------------------------
+def dhash(gray, hash_size=HASH_SIZE):
+    """(hash_size+1)×hash_size に縮小し、横隣との明暗差をビット化した整数を返す。"""
+    img = Image.fromarray(gray.astype(np.uint8)).resize((hash_size + 1, hash_size), Image.BILINEAR)
+    a = np.asarray(img, dtype=np.int16)
+    bits = (a[:, 1:] > a[:, :-1]).ravel()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+def frame_hash(image_bytes: bytes):
+    # JPEGドラフト縮小で高速にデコードしてからハッシュ
+    return dhash(to_gray(open_image(image_bytes, max_side=256)))
+
+def hamming(a: int, b: int):
+    return (a ^ b).bit_count()
+
+def bar_signature(gray, box):
+    """検出枠の中央を横切る明暗からバーとスペースの幅を測り、隣り合う組の幅（全幅比）を返す。読めなければNone。
+    全体の見た目（dHash）が同じでも、別のコードなら少なくとも1組が1モジュール以上ずれる。"""
+    if box is None:
+        return None
+    x0, y0, x1, y1, vertical = box
+    if not vertical:
+        gray, (x0, y0, x1, y1) = gray.T, (y0, x0, y1, x1)
+    band = gray[y0 + (y1 - y0) // 4:y1 - (y1 - y0) // 4]
+    if band.size == 0 or x1 <= x0:
+        return None
+    profile = band.mean(axis=0)
+    lo, hi = np.percentile(profile[x0:x1], 5), np.percentile(profile[x0:x1], 95)
+    if hi - lo < 40:
+        return None
+    dark = profile < (lo + hi) / 2
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(dark.astype(np.int8))) + 1, [len(dark)]))
+    runs = [(bool(dark[a]), a, b - a) for a, b in zip(bounds[:-1], bounds[1:])]
+    bars = [w for is_dark, _, w in runs if is_dark]
+    if len(bars) < SIGNATURE_MIN_RUNS // 2:
+        return None
+    # 検出枠は一部しか覆わないことがあるので、中心から左右へ静寂域（広い明部）まで広げる
+    quiet = SIGNATURE_QUIET * np.percentile(bars, 20)
+    center = (x0 + x1) // 2
+    i = j = next(k for k, (_, a, w) in enumerate(runs) if a <= center < a + w)
+    while i > 0 and (runs[i - 1][0] or runs[i - 1][2] <= quiet):
+        i -= 1
+    while j < len(runs) - 1 and (runs[j + 1][0] or runs[j + 1][2] <= quiet):
+        j += 1
+    seq = runs[i:j + 1]
+    while seq and not seq[0][0]:
+        seq = seq[1:]
+    while seq and not seq[-1][0]:
+        seq = seq[:-1]
+    if len(seq) < SIGNATURE_MIN_RUNS:
+        return None
+    widths = np.array([w for _, _, w in seq], dtype=np.float32)
+    # 隣り合うバー＋スペースの組にすると、しきい値によるバーの太り・細りが打ち消される
+    return (widths[:-1] + widths[1:]) / widths.sum()
+
+def signature_distance(a, b):
+    """2つの署名の最大のずれ（モジュール単位）。文字列（画像ダイジェスト）は完全一致なら0。"""
+    if a is None or b is None:
+        return float("inf")
+    if isinstance(a, str) or isinstance(b, str):
+        return 0.0 if isinstance(a, str) and isinstance(b, str) and a == b else float("inf")
+    if len(a) != len(b):
+        return float("inf")
+    # 最も細い組はバー1＋スペース1 = 2モジュール
+    module = min(a.min(), b.min()) / 2
+    return float(np.abs(a - b).max() / module)
+
+def frame_key(image_bytes: bytes):
+    """(dHash, バー幅署名 or None)。JPEGはドラフト縮小でデコードし、検出も縮小画像で行う。"""
+    gray = to_gray(open_image(image_bytes, max_side=DETECT_MAX_SIDE))
+    return dhash(gray), bar_signature(gray, detect_barcode_region(gray))
+
+# 全セッション合計（Prometheus用）
+frame_stats = {"hits": 0, "misses": 0}
+_frame_stats_lock = threading.Lock()
+
+class FrameIndex:
+    """直近のフレーム→結果（セッション毎に1つ）。dHashが近く、かつ署名が一致するときだけ同じ商品とみなす。"""
+
+    def __init__(self, capacity=HASH_INDEX_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        setattr(self, key, getattr(self, key) + 1)
+        with _frame_stats_lock:
+            frame_stats[key] += 1
+
+    def lookup(self, namespace, h: int, signature, max_distance=HASH_MAX_DISTANCE):
+        """(結果, dHash距離) を返す。署名が無い（バーを読めない）フレームは再利用しない。"""
+        with self._lock:
+            best, best_d = None, max_distance + 1
+            if signature is not None:
+                for key, (sig, _) in self._items.items():
+                    if key[0] != namespace:
+                        continue
+                    d = hamming(key[1], h)
+                    if d < best_d and signature_distance(sig, signature) <= SIGNATURE_MAX_MODULES:
+                        best, best_d = key, d
+            if best is None:
+                self._count("misses")
+                return None, None
+            self._items.move_to_end(best)
+            self._count("hits")
+            return self._items[best][1], best_d
+
+    def put(self, namespace, h: int, signature, result):
+        if signature is None:
+            return
+        with self._lock:
+            # dHashが同じ別商品で上書きしないよう、署名もキーに含める
+            key = (namespace, h, signature if isinstance(signature, str) else signature.tobytes())
+            self._items[key] = (signature, result)
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+metrics.collector("frame_index", lambda: [
+    ("cache_requests_total", "counter", {"cache": "frame_hash", "result": "hit"}, frame_stats["hits"]),
+    ("cache_requests_total", "counter", {"cache": "frame_hash", "result": "miss"}, frame_stats["misses"]),
+])